@@ -45,10 +45,13 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Keep last, see prof_rate_service/profiling.py
+    'prof_rate_service.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'cwk1Project.urls'
@@ -79,9 +82,77 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open across requests so warmed-up workers reuse them
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Ratings for these academic years live in read-only, compacted archive
+# files written by `manage.py archiveratings`, see prof_rate_service/partitions.py
+# Set as a comma separated list, e.g. PROF_RATE_ARCHIVED_YEARS=2022,2023
+
+RATING_ARCHIVE_DIR = BASE_DIR / 'rating_archives'
+RATING_ARCHIVED_YEARS = [int(year) for year in os.environ.get('PROF_RATE_ARCHIVED_YEARS', '').split(',') if year.strip()]
+
+for year in RATING_ARCHIVED_YEARS:
+    DATABASES['ratings_%d' % year] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'file:%s?mode=ro&immutable=1' % (RATING_ARCHIVE_DIR / ('ratings_%d.sqlite3' % year)),
+    }
+
+DATABASE_ROUTERS = ['prof_rate_service.routers.RatingPartitionRouter']
+
+
+# Cache shared by all worker processes on the host, see prof_rate_service/cache_backends.py
+# Point PROF_RATE_CACHE_PATH at /dev/shm to keep it in memory
+
+CACHES = {
+    'default': {
+        'BACKEND': 'prof_rate_service.cache_backends.SQLiteCache',
+        'LOCATION': os.environ.get('PROF_RATE_CACHE_PATH', BASE_DIR / 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_BYTES': 64 * 1024 * 1024,
+        },
+    }
+}
+
+
+# Structured logging written by a background thread, see prof_rate_service/logutils.py
+# Repeated client errors (4xx) are sampled: the first few of each kind per
+# window are written and the rest only counted in the service metrics
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            '()': 'prof_rate_service.logutils.StructuredFormatter',
+        },
+    },
+    'filters': {
+        'sampleClientErrors': {
+            '()': 'prof_rate_service.logutils.SamplingFilter',
+            'burst': 5,
+            'window': 60,
+        },
+    },
+    'handlers': {
+        'background': {
+            'class': 'prof_rate_service.logutils.BackgroundHandler',
+            'formatter': 'structured',
+            'filters': ['sampleClientErrors'],
+        },
+    },
+    'loggers': {
+        'prof_rate_service': {
+            'handlers': ['background'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -126,4 +197,50 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 #AUTH_USER_MODEL = 'prof_rate_service.User'
 
-LOGIN_REDIRECT_URL = '/'
\ No newline at end of file
+LOGIN_REDIRECT_URL = '/'
+
+# Startup warm-up of worker processes, see prof_rate_service/warmup.py
+# Set PROF_RATE_WARMUP=0 in the environment to turn it off
+PROF_RATE_WARMUP = os.environ.get('PROF_RATE_WARMUP', '1') != '0'
+
+# Seconds a pre-rendered response is kept for (generations invalidate it sooner)
+PROF_RATE_CACHE_TIMEOUT = 300
+
+# While one request rebuilds a response, others are served the previous
+# version of it, or wait up to PROF_RATE_CACHE_BUILD_WAIT seconds for the
+# new one when this is off
+PROF_RATE_CACHE_SERVE_STALE = True
+PROF_RATE_CACHE_BUILD_WAIT = 10
+# Directory of lock files that stop several processes rebuilding the same
+# response at once; leave PROF_RATE_CACHE_LOCK_DIR unset to coalesce only
+# within each process
+PROF_RATE_CACHE_LOCK_DIR = os.environ.get('PROF_RATE_CACHE_LOCK_DIR')
+
+# Write throttling and admission control, see prof_rate_service/throttling.py
+# Requests each user (or client address, before login) may make, as
+# {view: (requests, seconds)}
+PROF_RATE_THROTTLE_RATES = {
+    'rateProfessor': (30, 60),
+    'registerUser': (5, 300),
+}
+# Requests each process runs at once, by view; the rest get a 503
+PROF_RATE_ADMISSION_LIMITS = {
+    'rateProfessor': 4,
+    'registerUser': 2,
+    'professorAnalytics': 2,
+}
+PROF_RATE_ADMISSION_RETRY_AFTER = 1
+# META key holding the client's address when behind a proxy, e.g. 'HTTP_X_REAL_IP'
+PROF_RATE_CLIENT_IP_HEADER = os.environ.get('PROF_RATE_CLIENT_IP_HEADER')
+
+# Threads each process hashes registration passwords on, see prof_rate_service/accounts.py
+PROF_RATE_HASH_WORKERS = 2
+
+# On-demand profiling, see prof_rate_service/profiling.py
+# Requests sending PROF_RATE_PROFILE_TOKEN in an X-Profile-Token header are
+# profiled; leave it unset to turn that off
+PROF_RATE_PROFILE_TOKEN = os.environ.get('PROF_RATE_PROFILE_TOKEN')
+# Fraction of requests to profile at random, by URL name, e.g. {'rateProfessor': 0.01}
+PROF_RATE_PROFILE_SAMPLE_RATES = {}
+PROF_RATE_PROFILE_DIR = BASE_DIR / 'profiles'
+PROF_RATE_PROFILE_KEEP = 50
@@ -8,9 +8,20 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 """
 
 import os
+import time
 
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cwk1Project.settings')
 
+startedAt = time.perf_counter()
 application = get_wsgi_application()
+
+# WSGI servers import this module in each worker, or once in the master
+# before forking when the app is preloaded (warmup.py has the workers drop
+# the database connections they inherit). Either way the workers are warm
+# before they start taking requests
+from prof_rate_service import warmup  # noqa: E402
+
+warmup.recordDjangoSetup(time.perf_counter() - startedAt)
+warmup.runStartupWarmup()
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.db import connection, transaction
+
+
+#-------------------------------------------------------------------------
+# Student registration
+# Duplicate usernames and emails are caught by the unique indexes on
+# auth_user (the email one is added by migration 0006) rather than checked
+# first, and the user and their Student group membership are inserted
+# together. Passwords are hashed on a small pool of threads, so an async
+# worker keeps serving other requests meanwhile; hashlib releases the GIL
+# while it hashes.
+#-------------------------------------------------------------------------
+STUDENT_GROUP = 'Student'
+
+_hashExecutor = None
+_hashExecutorLock = threading.Lock()
+
+
+def hashExecutor():
+    global _hashExecutor
+
+    with _hashExecutorLock:
+        if _hashExecutor is None:
+            _hashExecutor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'PROF_RATE_HASH_WORKERS', 2),
+                thread_name_prefix='password-hash'
+            )
+        return _hashExecutor
+
+
+async def hashPassword(password):
+    return await asyncio.get_running_loop().run_in_executor(hashExecutor(), make_password, password)
+
+
+#---------------------------------------------------------------------------
+# createStudent
+# Inserts the user and adds them to the Student group in one transaction,
+# taking the group's id in the same statement instead of looking it up.
+# Returns: The new user's id
+# Raises:  IntegrityError if the username or email is taken (see
+#          conflictingField), Group.DoesNotExist if there is no Student group
+#---------------------------------------------------------------------------
+def createStudent(username, email, hashedPassword):
+    with transaction.atomic():
+        user = User(
+            username=User.normalize_username(username),
+            email=User.objects.normalize_email(email),
+            password=hashedPassword,
+        )
+        user.save()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO %s (user_id, group_id) SELECT %%s, id FROM %s WHERE name = %%s'
+                % (User.groups.through._meta.db_table, Group._meta.db_table),
+                [user.pk, STUDENT_GROUP]
+            )
+            if not cursor.rowcount:
+                raise Group.DoesNotExist('Student group does not exist.')
+
+    return user.pk
+
+
+# Returns: 'username' or 'email' if error is that column's unique index
+#          being violated, else None
+def conflictingField(error):
+    message = str(error)
+    if 'UNIQUE' not in message.upper():
+        return None
+    for field in ('email', 'username'):
+        if '.' + field in message or '(%s)' % field in message:
+            return field
+    return None
@@ -0,0 +1,159 @@
+import itertools
+from collections import namedtuple
+from django.db import connections
+from . import partitions
+from .models import Professor, Rating
+
+# NumPy is optional; without it the analytics endpoint and command report
+# that they are unavailable
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+#-------------------------------------------------------------------------
+# Professor analytics
+# Statistics over every rating in every partition, computed in a few
+# vectorized passes over columnar arrays rather than row by row:
+# - means smoothed towards the global mean as if each professor had
+#   PRIOR_WEIGHT extra ratings at that mean, so a handful of ratings
+#   cannot top the rankings
+# - per-user bias (how far a user rates above the global mean, shrunk by
+#   USER_PRIOR_WEIGHT) removed before averaging
+# - 95% intervals around the adjusted mean, from each professor's
+#   variance shrunk towards the global variance the same way
+# Professors are ranked on the adjusted mean.
+#-------------------------------------------------------------------------
+PRIOR_WEIGHT = 5
+USER_PRIOR_WEIGHT = 3
+Z_95 = 1.959964
+
+RatingMatrix = namedtuple('RatingMatrix', ['users', 'professors', 'instances', 'ratings'])
+
+
+def available():
+    return np is not None
+
+
+# Reads one partition's ratings as (users, professors, instances, ratings)
+# arrays. Each row is packed into one integer by SQLite when the ids are
+# small enough, so a single value per row crosses into Python.
+def loadPartition(db):
+    table = Rating._meta.db_table
+
+    with connections[db].cursor() as cursor:
+        cursor.execute(
+            'SELECT (SELECT MAX(user_id) FROM {0}), (SELECT MAX(professor_id) FROM {0}), '
+            '(SELECT MAX(module_instance_id) FROM {0})'.format(table)
+        )
+        userBits, professorBits, instanceBits = [(value or 0).bit_length() for value in cursor.fetchone()]
+
+        # Ratings are 1 to 5, so three bits hold them
+        if userBits + professorBits + instanceBits + 3 <= 63:
+            instanceShift = 3
+            professorShift = instanceShift + instanceBits
+            userShift = professorShift + professorBits
+            cursor.execute(
+                'SELECT (user_id << %d) | (professor_id << %d) | (module_instance_id << %d) | rating FROM %s'
+                % (userShift, professorShift, instanceShift, table)
+            )
+            packed = np.fromiter(itertools.chain.from_iterable(cursor), dtype=np.int64)
+            return (
+                (packed >> userShift).astype(np.int32),
+                ((packed >> professorShift) & ((1 << professorBits) - 1)).astype(np.int32),
+                ((packed >> instanceShift) & ((1 << instanceBits) - 1)).astype(np.int32),
+                (packed & 7).astype(np.int8),
+            )
+
+        cursor.execute('SELECT user_id, professor_id, module_instance_id, rating FROM %s' % table)
+        rows = np.fromiter(itertools.chain.from_iterable(cursor), dtype=np.int64).reshape(-1, 4)
+        return rows[:, 0].astype(np.int32), rows[:, 1].astype(np.int32), rows[:, 2].astype(np.int32), rows[:, 3].astype(np.int8)
+
+
+# Loads every partition's ratings into one compact array per column
+def loadRatingMatrix():
+    parts = [loadPartition(db) for db in partitions.ratingDatabases()]
+    if len(parts) == 1:
+        return RatingMatrix(*parts[0])
+    return RatingMatrix(*(np.concatenate(column) for column in zip(*parts)))
+
+
+#---------------------------------------------------------------------------
+# professorStatistics
+# Returns: {professor id: {'ratings', 'mean', 'smoothed_mean',
+#          'adjusted_mean', 'ci_low', 'ci_high'}} for every professor with
+#          ratings, and the global mean
+#---------------------------------------------------------------------------
+def professorStatistics(matrix):
+    ratings = matrix.ratings.astype(np.float64)
+    if not len(ratings):
+        return {}, None
+
+    globalMean = ratings.mean()
+    globalVariance = ratings.var()
+
+    # Shrunk per-user bias, subtracted from each of the user's ratings
+    userCounts = np.bincount(matrix.users)
+    userSums = np.bincount(matrix.users, weights=ratings)
+    userBias = (userSums - userCounts * globalMean) / (userCounts + USER_PRIOR_WEIGHT)
+
+    counts = np.bincount(matrix.professors)
+    sums = np.bincount(matrix.professors, weights=ratings)
+
+    # Work in one buffer the size of the ratings, squared in place once summed
+    adjusted = userBias[matrix.users]
+    np.subtract(ratings, adjusted, out=adjusted)
+    adjustedSums = np.bincount(matrix.professors, weights=adjusted)
+    np.square(adjusted, out=adjusted)
+    adjustedSquares = np.bincount(matrix.professors, weights=adjusted)
+
+    rated = np.flatnonzero(counts)
+    counts, sums = counts[rated], sums[rated]
+    adjustedSums, adjustedSquares = adjustedSums[rated], adjustedSquares[rated]
+
+    weights = counts + PRIOR_WEIGHT
+    means = sums / counts
+    smoothed = (sums + PRIOR_WEIGHT * globalMean) / weights
+    adjustedMeans = (adjustedSums + PRIOR_WEIGHT * globalMean) / weights
+
+    # Variance of the adjusted ratings about their own mean, shrunk the
+    # same way as the means
+    spread = np.maximum(adjustedSquares - adjustedSums * adjustedSums / counts, 0)
+    variance = (spread + PRIOR_WEIGHT * globalVariance) / weights
+    margin = Z_95 * np.sqrt(variance / weights)
+    low = np.clip(adjustedMeans - margin, 1, 5)
+    high = np.clip(adjustedMeans + margin, 1, 5)
+
+    statistics = {}
+    for row in zip(rated.tolist(), counts.tolist(), means.tolist(), smoothed.tolist(), adjustedMeans.tolist(), low.tolist(), high.tolist()):
+        statistics[row[0]] = dict(zip(('ratings', 'mean', 'smoothed_mean', 'adjusted_mean', 'ci_low', 'ci_high'), row[1:]))
+    return statistics, float(globalMean)
+
+
+#---------------------------------------------------------------------------
+# buildProfessorAnalytics
+# Returns: The global mean and rating count, and every rated professor's
+#          statistics in rank order
+#---------------------------------------------------------------------------
+def buildProfessorAnalytics():
+    matrix = loadRatingMatrix()
+    statistics, globalMean = professorStatistics(matrix)
+
+    # Archives may hold ratings of since deleted professors, which are left out
+    rankings = []
+    for professorId, code, name in Professor.objects.filter(id__in=list(statistics)).values_list('id', 'professor_code', 'name'):
+        entry = {'professor_code': code, 'name': name}
+        entry.update({key: round(value, 4) if isinstance(value, float) else value for key, value in statistics[professorId].items()})
+        rankings.append(entry)
+
+    rankings.sort(key=lambda entry: (-entry['adjusted_mean'], -entry['ratings'], entry['professor_code']))
+    for rank, entry in enumerate(rankings, 1):
+        entry['rank'] = rank
+
+    return {
+        'global_mean': None if globalMean is None else round(globalMean, 4),
+        'ratings': len(matrix.ratings),
+        'prior_weight': PRIOR_WEIGHT,
+        'professor_rankings': rankings,
+    }
@@ -0,0 +1,201 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+#-------------------------------------------------------------------------
+# SQLiteCache
+# A cache backend shared by every worker process on the host, with no
+# service to run: entries live in one SQLite file (put it on /dev/shm to
+# keep it in memory). The total size of stored values is held under the
+# MAX_BYTES option by evicting the least recently used entries.
+#
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'prof_rate_service.cache_backends.SQLiteCache',
+#         'LOCATION': '/dev/shm/prof_rate_cache.sqlite3',
+#         'OPTIONS': {'MAX_BYTES': 64 * 1024 * 1024},
+#     }
+# }
+#-------------------------------------------------------------------------
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS cache_entry (
+           key TEXT PRIMARY KEY,
+           value BLOB NOT NULL,
+           size INTEGER NOT NULL,
+           expires REAL,
+           accessed REAL NOT NULL
+       ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS cache_entry_accessed ON cache_entry (accessed)',
+
+    # Running total of stored bytes, kept up to date by triggers so that
+    # checking the memory cap never needs to scan the table
+    'CREATE TABLE IF NOT EXISTS cache_usage (id INTEGER PRIMARY KEY CHECK (id = 1), bytes INTEGER NOT NULL)',
+    'INSERT OR IGNORE INTO cache_usage (id, bytes) VALUES (1, 0)',
+    '''CREATE TRIGGER IF NOT EXISTS cache_entry_insert AFTER INSERT ON cache_entry
+       BEGIN UPDATE cache_usage SET bytes = bytes + NEW.size WHERE id = 1; END''',
+    '''CREATE TRIGGER IF NOT EXISTS cache_entry_update AFTER UPDATE OF size ON cache_entry
+       BEGIN UPDATE cache_usage SET bytes = bytes - OLD.size + NEW.size WHERE id = 1; END''',
+    '''CREATE TRIGGER IF NOT EXISTS cache_entry_delete AFTER DELETE ON cache_entry
+       BEGIN UPDATE cache_usage SET bytes = bytes - OLD.size WHERE id = 1; END''',
+]
+
+# Reads only refresh an entry's LRU position when it is older than this,
+# so hot keys do not turn every cache hit into a write
+ACCESS_RESOLUTION = 1.0
+
+
+class SQLiteCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        options = dict(params.get('OPTIONS', {}))
+        self._maxBytes = int(options.pop('MAX_BYTES', 64 * 1024 * 1024))
+        super().__init__({**params, 'OPTIONS': options})
+
+        self._path = str(location)
+        self._local = threading.local()
+
+    #---------------------------------------------------------------------
+    # Connections are per thread and per process, as SQLite handles must
+    # not be carried across a fork
+    #---------------------------------------------------------------------
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+
+        connection = sqlite3.connect(self._path, timeout=30, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        with connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    # Returns: The time the entry expires at, or None if it never does
+    def _expiry(self, timeout):
+        return self.get_backend_timeout(timeout)
+
+    def _store(self, connection, key, value, timeout):
+        expires = self._expiry(timeout)
+        now = time.time()
+
+        # A timeout of 0 (or less) expires the entry straight away
+        if expires is not None and expires <= now:
+            connection.execute('DELETE FROM cache_entry WHERE key = ?', (key,))
+            return
+
+        blob = pickle.dumps(value, self.pickle_protocol)
+        connection.execute(
+            'INSERT OR REPLACE INTO cache_entry (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)',
+            (key, blob, len(blob), expires, now),
+        )
+
+    def _evict(self, connection):
+        usage = connection.execute('SELECT bytes FROM cache_usage WHERE id = 1').fetchone()[0]
+        if usage <= self._maxBytes:
+            return
+
+        # Drop least recently used entries until a tenth of the cap is free,
+        # expired entries first as they are dead weight anyway
+        target = int(self._maxBytes * 0.9)
+        connection.execute('DELETE FROM cache_entry WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+        usage = connection.execute('SELECT bytes FROM cache_usage WHERE id = 1').fetchone()[0]
+        for key, size in connection.execute('SELECT key, size FROM cache_entry ORDER BY accessed').fetchall():
+            if usage <= target:
+                break
+            connection.execute('DELETE FROM cache_entry WHERE key = ?', (key,))
+            usage -= size
+
+    def _live(self, connection, key):
+        row = connection.execute('SELECT value, expires, accessed FROM cache_entry WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        now = time.time()
+        if row[1] is not None and row[1] <= now:
+            connection.execute('DELETE FROM cache_entry WHERE key = ?', (key,))
+            return None
+        if now - row[2] > ACCESS_RESOLUTION:
+            connection.execute('UPDATE cache_entry SET accessed = ? WHERE key = ?', (now, key))
+        return row
+
+    #---------------------------------------------------------------------
+    # Django cache API
+    #---------------------------------------------------------------------
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._live(self._connection(), key)
+        return default if row is None else pickle.loads(row[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            self._store(connection, key, value, timeout)
+            self._evict(connection)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            if self._live(connection, key) is not None:
+                return False
+            self._store(connection, key, value, timeout)
+            self._evict(connection)
+            return True
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+
+        # Read and write under one write lock so concurrent workers never
+        # lose an increment, which generation counters rely on
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            row = self._live(connection, key)
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            blob = pickle.dumps(value, self.pickle_protocol)
+            connection.execute('UPDATE cache_entry SET value = ?, size = ? WHERE key = ?', (blob, len(blob), key))
+            return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            if self._live(connection, key) is None:
+                return False
+            connection.execute('UPDATE cache_entry SET expires = ? WHERE key = ?', (self._expiry(timeout), key))
+            return True
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        with connection:
+            return connection.execute('DELETE FROM cache_entry WHERE key = ?', (key,)).rowcount > 0
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._live(self._connection(), key) is not None
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM cache_entry')
+
+    def close(self, **kwargs):
+        # Connections are kept for the life of the thread, as reopening
+        # one would cost more than the lookups it serves
+        pass
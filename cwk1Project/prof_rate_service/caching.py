@@ -0,0 +1,232 @@
+import json
+import os
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from . import metrics
+from .models import ModuleInstance, Professor
+
+# File locks coordinate builds across processes where the platform has them
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+#-------------------------------------------------------------------------
+# Cache scopes
+# Each scope has a generation number held in the cache. Cached values are
+# keyed by the generations they depend on, so bumping a generation (from
+# the signal handlers in signals.py) invalidates everything built from it.
+#-------------------------------------------------------------------------
+CATALOGUE = 'catalogue' # Modules, professors, module instances + assignments
+RATINGS = 'ratings'     # Rating rows
+
+KEY_PREFIX = 'prof_rate_service'
+
+
+def generationKey(scope):
+    return '%s:generation:%s' % (KEY_PREFIX, scope)
+
+
+def currentGeneration(scope):
+    generation = cache.get(generationKey(scope))
+
+    # Seed missing generations from the clock, so a generation that was
+    # evicted never restarts at a number that older entries were built with
+    if generation is None:
+        cache.add(generationKey(scope), time.time_ns(), None)
+        generation = cache.get(generationKey(scope), 0)
+
+    return generation
+
+
+def bumpGeneration(scope):
+    try:
+        cache.incr(generationKey(scope))
+    except ValueError:
+        cache.set(generationKey(scope), time.time_ns(), None)
+
+
+def cacheTimeout():
+    return getattr(settings, 'PROF_RATE_CACHE_TIMEOUT', 300)
+
+
+#-------------------------------------------------------------------------
+# Pre-rendered responses
+# Builds the JSON body for a read endpoint once per generation and serves
+# the encoded bytes from the cache until one of its scopes changes.
+#
+# Builds are single-flight: when a body is missing, one request builds it
+# while the others either get the last body built for that name (when
+# PROF_RATE_CACHE_SERVE_STALE is on) or wait for the new one. Requests in
+# other processes take part too when PROF_RATE_CACHE_LOCK_DIR is set.
+#-------------------------------------------------------------------------
+LOCK_POLL_INTERVAL = 0.01
+
+
+def renderBody(builder):
+    # Builders return either the payload or an already encoded body
+    body = builder()
+    if not isinstance(body, bytes):
+        body = json.dumps(body, cls=DjangoJSONEncoder).encode('utf-8')
+    return body
+
+
+def latestKey(name):
+    return '%s:latest:%s' % (KEY_PREFIX, name)
+
+
+def serveStale():
+    return getattr(settings, 'PROF_RATE_CACHE_SERVE_STALE', True)
+
+
+def buildWait():
+    return getattr(settings, 'PROF_RATE_CACHE_BUILD_WAIT', 10)
+
+
+class BuildLock:
+    # Held while a body is built: a thread lock for this process, and an
+    # flock on a file in PROF_RATE_CACHE_LOCK_DIR for the others
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.file = None
+
+    # Returns: Whether the lock was taken within timeout seconds
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        if not self.lock.acquire(True, timeout):
+            return False
+
+        directory = getattr(settings, 'PROF_RATE_CACHE_LOCK_DIR', None)
+        if directory is None or fcntl is None:
+            return True
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self.file = open(os.path.join(directory, '%s.lock' % self.name), 'a')
+            while True:
+                try:
+                    fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return True
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        break
+                    time.sleep(LOCK_POLL_INTERVAL)
+        except BaseException:
+            self.release()
+            raise
+
+        self.release()
+        return False
+
+    def release(self):
+        if self.file is not None:
+            self.file.close() # Closing the file drops the flock
+            self.file = None
+        self.lock.release()
+
+
+_buildLocks = {}
+_buildLocksLock = threading.Lock()
+
+
+def buildLock(name):
+    with _buildLocksLock:
+        if name not in _buildLocks:
+            _buildLocks[name] = BuildLock(name)
+        return _buildLocks[name]
+
+
+def cachedBody(name, builder, scopes):
+    generations = ':'.join(str(currentGeneration(scope)) for scope in scopes)
+    key = '%s:body:%s:%s' % (KEY_PREFIX, name, generations)
+
+    body = cache.get(key)
+    if body is not None:
+        return body
+
+    lock = buildLock(name)
+    locked = lock.acquire(0)
+    if not locked:
+        # Another request is building this body already
+        stale = cache.get(latestKey(name)) if serveStale() else None
+        if stale is not None:
+            metrics.increment('cache.stale_served')
+            return stale
+
+        metrics.increment('cache.coalesced')
+        locked = lock.acquire(buildWait())
+        if not locked:
+            # The build is taking too long, so build another copy
+            metrics.increment('cache.build_wait_expired')
+
+    try:
+        # The body may have been built while this request waited
+        body = cache.get(key)
+        if body is None:
+            body = renderBody(builder)
+            cache.set(key, body, cacheTimeout())
+            cache.set(latestKey(name), body, None)
+        return body
+    finally:
+        if locked:
+            lock.release()
+
+
+#-------------------------------------------------------------------------
+# In-process catalogue
+# Professors and module instances change rarely but are looked up on every
+# rating, so each process keeps a snapshot and reloads it when the
+# catalogue generation moves on.
+#-------------------------------------------------------------------------
+class CatalogueSnapshot:
+    def __init__(self, generation):
+        self.generation = generation
+
+        # Professors keyed by professor code
+        self.professors = {p.professor_code: p for p in Professor.objects.all()}
+
+        # Module instances keyed by (module code, academic year, semester)
+        self.moduleInstances = {
+            (m.module.code, m.academic_year, m.semester): m
+            for m in ModuleInstance.objects.select_related('module')
+        }
+
+        # The same professors and module instances keyed by id
+        self.professorsById = {p.id: p for p in self.professors.values()}
+        self.moduleInstancesById = {m.id: m for m in self.moduleInstances.values()}
+
+    def getProfessor(self, professorCode):
+        try:
+            return self.professors[professorCode]
+        except KeyError:
+            raise Professor.DoesNotExist('Professor matching query does not exist.') from None
+
+    def getModuleInstance(self, moduleCode, academicYear, semester):
+        try:
+            return self.moduleInstances[(moduleCode, academicYear, semester)]
+        except KeyError:
+            raise ModuleInstance.DoesNotExist('ModuleInstance matching query does not exist.') from None
+
+
+_snapshot = None
+_snapshotLock = threading.Lock()
+
+
+def catalogue():
+    global _snapshot
+
+    generation = currentGeneration(CATALOGUE)
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.generation == generation:
+        return snapshot
+
+    # Only one thread reloads, the rest pick up its snapshot
+    with _snapshotLock:
+        if _snapshot is None or _snapshot.generation != generation:
+            _snapshot = CatalogueSnapshot(generation)
+        return _snapshot
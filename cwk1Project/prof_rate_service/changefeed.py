@@ -0,0 +1,120 @@
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+from .models import ChangeFeedHorizon, ChangeLogEntry, Module, ModuleInstance, Professor, Rating
+
+
+#-------------------------------------------------------------------------
+# Change feed
+# Every insert, update and delete of the catalogue and of ratings is
+# appended to ChangeLogEntry by the receivers in signals.py. Consumers
+# apply inserts and updates as upserts keyed by (entity, key), as
+# compaction may leave only an update behind for a new record.
+#-------------------------------------------------------------------------
+MODULE = 'module'
+PROFESSOR = 'professor'
+MODULE_INSTANCE = 'module_instance'
+ASSIGNMENT = 'assignment'
+RATING = 'rating'
+
+
+# Entity name and data recorded for each model. Ratings leave out the
+# user, as the feed is public like the rating endpoints.
+def serializeModule(module):
+    return {'code': module.code, 'name': module.name}
+
+
+def serializeProfessor(professor):
+    return {'professor_code': professor.professor_code, 'name': professor.name}
+
+
+def serializeModuleInstance(instance):
+    return {'module_id': instance.module_id, 'academic_year': instance.academic_year, 'semester': instance.semester}
+
+
+def serializeRating(rating):
+    return {'module_instance_id': rating.module_instance_id, 'professor_id': rating.professor_id, 'rating': rating.rating}
+
+
+ENTITIES = {
+    Module: (MODULE, serializeModule),
+    Professor: (PROFESSOR, serializeProfessor),
+    ModuleInstance: (MODULE_INSTANCE, serializeModuleInstance),
+    Rating: (RATING, serializeRating),
+}
+
+
+def assignmentKey(instanceId, professorId):
+    return '%s:%s' % (instanceId, professorId)
+
+
+def recordSaved(instance, created):
+    entity, serialize = ENTITIES[type(instance)]
+    ChangeLogEntry.objects.create(
+        entity=entity,
+        key=str(instance.pk),
+        operation='insert' if created else 'update',
+        data=serialize(instance),
+    )
+
+
+def recordDeleted(instance):
+    entity = ENTITIES[type(instance)][0]
+    ChangeLogEntry.objects.create(entity=entity, key=str(instance.pk), operation='delete')
+
+
+# pairs is an iterable of (module instance id, professor id)
+def recordAssignments(pairs, operation):
+    ChangeLogEntry.objects.bulk_create(
+        ChangeLogEntry(
+            entity=ASSIGNMENT,
+            key=assignmentKey(instanceId, professorId),
+            operation=operation,
+            data={'module_instance_id': instanceId, 'professor_id': professorId} if operation != 'delete' else None,
+        )
+        for instanceId, professorId in pairs
+    )
+
+
+def currentHorizon():
+    return ChangeFeedHorizon.objects.filter(id=1).values_list('cursor', flat=True).first() or 0
+
+
+#---------------------------------------------------------------------------
+# changesSince
+# Returns: (entries after the cursor in cursor order, at most limit of them,
+#          whether more entries remain)
+#---------------------------------------------------------------------------
+def changesSince(cursor, limit):
+    entries = list(ChangeLogEntry.objects
+        .filter(id__gt=cursor)
+        .order_by('id')
+        .values_list('id', 'entity', 'key', 'operation', 'data')[:limit + 1]
+    )
+    return entries[:limit], len(entries) > limit
+
+
+#---------------------------------------------------------------------------
+# compact
+# Drops every entry superseded by a later one for the same record, which
+# is safe for any cursor, then drops deletions older than tombstoneAge and
+# moves the horizon past them.
+# Returns: (superseded entries dropped, tombstones dropped)
+#---------------------------------------------------------------------------
+def compact(tombstoneAge):
+    newer = ChangeLogEntry.objects.filter(entity=OuterRef('entity'), key=OuterRef('key'), id__gt=OuterRef('id'))
+    superseded, _ = ChangeLogEntry.objects.filter(Exists(newer)).delete()
+
+    with transaction.atomic():
+        tombstones = ChangeLogEntry.objects.filter(operation='delete', created__lt=timezone.now() - tombstoneAge)
+        last = tombstones.aggregate(last=Max('id'))['last']
+        if last is None:
+            return superseded, 0
+
+        dropped, _ = tombstones.filter(id__lte=last).delete()
+        horizon, created = ChangeFeedHorizon.objects.get_or_create(id=1)
+        if last > horizon.cursor:
+            horizon.cursor = last
+            horizon.save()
+
+    return superseded, dropped
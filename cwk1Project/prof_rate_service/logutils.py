@@ -0,0 +1,125 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from . import metrics
+
+
+#-------------------------------------------------------------------------
+# BackgroundHandler
+# Hands records to a queue and returns at once. A listener thread formats
+# them and does the actual writing, so request threads never wait on I/O.
+# Writes to stderr, or to `filename` when given.
+#-------------------------------------------------------------------------
+class BackgroundHandler(QueueHandler):
+    def __init__(self, filename=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.FileHandler(filename) if filename else logging.StreamHandler(sys.stderr)
+        self._startListener()
+        atexit.register(self.stop)
+
+        # Threads do not survive a fork, so workers forked from a process
+        # that already configured logging start a listener of their own
+        os.register_at_fork(after_in_child=self._startListener)
+
+    def _startListener(self):
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+
+    # Writes out the records still queued, if the listener is running
+    def stop(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Resolve the message now, as its arguments may change once we
+        # return, but leave tracebacks for the listener to format
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        # Shed records rather than block a request when the writer falls behind
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment('log.dropped.queue_full')
+
+
+#-------------------------------------------------------------------------
+# StructuredFormatter
+# One JSON object per line, including the event and status fields that
+# views pass through `extra`.
+#-------------------------------------------------------------------------
+STRUCTURED_FIELDS = ['event', 'status', 'path', 'user']
+
+
+class StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry['traceback'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+#-------------------------------------------------------------------------
+# SamplingFilter
+# Lets the first `burst` records of each sample key through per `window`
+# seconds and drops the rest, counting drops per key in metrics. Records
+# without a sample key (server errors, info messages) always pass.
+#-------------------------------------------------------------------------
+class SamplingFilter(logging.Filter):
+    def __init__(self, burst=5, window=60):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'sample_key', None)
+        if key is None:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            startedAt, seen = self._windows.get(key, (now, 0))
+            if now - startedAt >= self.window:
+                startedAt, seen = now, 0
+            self._windows[key] = (startedAt, seen + 1)
+
+        if seen < self.burst:
+            return True
+
+        metrics.increment('log.dropped.%s' % key)
+        return False
+
+
+#---------------------------------------------------------------------------
+# logClientError
+# Logs a 4xx outcome: a warning with no traceback, sampled per event so a
+# client flooding bad requests cannot flood the log.
+#---------------------------------------------------------------------------
+def logClientError(logger, status, event, message, *args):
+    logger.warning(message, *args, extra={'event': event, 'status': status, 'sample_key': '%s.%s' % (event, status)})
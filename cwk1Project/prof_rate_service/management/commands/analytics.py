@@ -0,0 +1,114 @@
+import math
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, Sum
+from prof_rate_service import analytics, partitions
+from prof_rate_service.models import Rating
+
+
+#-------------------------------------------------------------------------
+# The same statistics as analytics.professorStatistics, from per-user,
+# per-professor and per-(user, professor) ORM aggregates in every
+# partition, combined in Python. Used as the benchmark baseline.
+#-------------------------------------------------------------------------
+def ormStatistics():
+    professors = {}
+    users = {}
+    pairs = []
+    count, total, squares = 0, 0, 0
+
+    for db in partitions.ratingDatabases():
+        ratings = Rating.objects.using(db).order_by()
+        for professorId, n, s in ratings.values_list('professor_id').annotate(n=Count('id'), s=Sum('rating')):
+            merged = professors.setdefault(professorId, [0, 0])
+            merged[0] += n
+            merged[1] += s
+        for userId, n, s, ss in ratings.values_list('user_id').annotate(n=Count('id'), s=Sum('rating'), ss=Sum(F('rating') * F('rating'))):
+            merged = users.setdefault(userId, [0, 0])
+            merged[0] += n
+            merged[1] += s
+            count, total, squares = count + n, total + s, squares + ss
+        pairs += ratings.values_list('user_id', 'professor_id').annotate(n=Count('id'), s=Sum('rating'), ss=Sum(F('rating') * F('rating')))
+
+    if not count:
+        return {}, None
+    globalMean = total / count
+    globalVariance = squares / count - globalMean * globalMean
+    userBias = {userId: (s - n * globalMean) / (n + analytics.USER_PRIOR_WEIGHT) for userId, (n, s) in users.items()}
+
+    # Sums of the bias-adjusted ratings and of their squares
+    adjusted = {}
+    for userId, professorId, n, s, ss in pairs:
+        bias = userBias[userId]
+        merged = adjusted.setdefault(professorId, [0.0, 0.0])
+        merged[0] += s - n * bias
+        merged[1] += ss - 2 * bias * s + n * bias * bias
+
+    statistics = {}
+    for professorId, (n, s) in professors.items():
+        adjustedSum, adjustedSquares = adjusted[professorId]
+        weight = n + analytics.PRIOR_WEIGHT
+        adjustedMean = (adjustedSum + analytics.PRIOR_WEIGHT * globalMean) / weight
+        variance = (max(adjustedSquares - adjustedSum * adjustedSum / n, 0) + analytics.PRIOR_WEIGHT * globalVariance) / weight
+        margin = analytics.Z_95 * math.sqrt(variance / weight)
+        statistics[professorId] = {
+            'ratings': n,
+            'mean': s / n,
+            'smoothed_mean': (s + analytics.PRIOR_WEIGHT * globalMean) / weight,
+            'adjusted_mean': adjustedMean,
+            'ci_low': min(max(adjustedMean - margin, 1), 5),
+            'ci_high': min(max(adjustedMean + margin, 1), 5),
+        }
+    return statistics, globalMean
+
+
+class Command(BaseCommand):
+    help = 'Ranks professors on bias-adjusted, smoothed mean ratings computed with NumPy.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help='Professors to list.')
+        parser.add_argument('--benchmark', action='store_true', help='Also time the equivalent ORM aggregation and compare results.')
+
+    def handle(self, *args, **options):
+        if not analytics.available():
+            raise CommandError('NumPy is not installed.')
+
+        startedAt = time.perf_counter()
+        result = analytics.buildProfessorAnalytics()
+        elapsed = time.perf_counter() - startedAt
+
+        self.stdout.write('%d ratings, global mean %s, computed in %.2fs' % (result['ratings'], result['global_mean'], elapsed))
+        self.stdout.write('%-5s %-6s %-30s %8s %6s %8s %8s %17s' % ('Rank', 'Code', 'Name', 'Ratings', 'Mean', 'Smoothed', 'Adjusted', '95% interval'))
+        for entry in result['professor_rankings'][:options['top']]:
+            self.stdout.write('%-5d %-6s %-30s %8d %6.2f %8.2f %8.2f %8.2f - %6.2f' % (
+                entry['rank'], entry['professor_code'], entry['name'], entry['ratings'], entry['mean'],
+                entry['smoothed_mean'], entry['adjusted_mean'], entry['ci_low'], entry['ci_high']
+            ))
+
+        if not options['benchmark']:
+            return
+
+        # Time each stage of the NumPy path, then the ORM path
+        startedAt = time.perf_counter()
+        matrix = analytics.loadRatingMatrix()
+        loadSeconds = time.perf_counter() - startedAt
+        startedAt = time.perf_counter()
+        vectorized, vectorizedMean = analytics.professorStatistics(matrix)
+        computeSeconds = time.perf_counter() - startedAt
+
+        startedAt = time.perf_counter()
+        orm, ormMean = ormStatistics()
+        ormSeconds = time.perf_counter() - startedAt
+
+        difference = max(
+            (abs(vectorized[professorId][key] - orm[professorId][key]) for professorId in orm for key in orm[professorId]),
+            default=0.0
+        )
+        self.stdout.write(
+            'numpy: load %.2fs + compute %.3fs = %.2fs, %.1f MB of columns'
+            % (loadSeconds, computeSeconds, loadSeconds + computeSeconds, sum(column.nbytes for column in matrix) / 1e6)
+        )
+        self.stdout.write('orm:   %.2fs' % ormSeconds)
+        self.stdout.write('largest difference between the two: %.2e' % difference)
+        if vectorized.keys() != orm.keys():
+            raise CommandError('NumPy and ORM results cover different professors.')
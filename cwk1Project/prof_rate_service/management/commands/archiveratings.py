@@ -0,0 +1,91 @@
+import os
+import sqlite3
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from prof_rate_service import caching, partitions
+from prof_rate_service.models import ModuleInstance, Rating
+
+
+class Command(BaseCommand):
+    help = (
+        'Freezes the ratings of an academic year into a read-only, compacted archive file '
+        'and removes them from the default database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('year', type=int)
+
+    def handle(self, *args, **options):
+        year = options['year']
+        if partitions.isArchived(year):
+            raise CommandError('Ratings for %d are already archived.' % year)
+
+        path = partitions.archivePath(year)
+        if path.exists():
+            raise CommandError('%s already exists.' % path)
+        os.makedirs(settings.RATING_ARCHIVE_DIR, exist_ok=True)
+
+        table = Rating._meta.db_table
+        columns = [field.column for field in Rating._meta.concrete_fields]
+        default = connections['default']
+
+        # The archive gets the rating table and its indexes exactly as the
+        # default database defines them
+        with default.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE tbl_name = %s AND sql IS NOT NULL ORDER BY type DESC", [table])
+            schema = [row[0] for row in cursor.fetchall()]
+
+        archive = sqlite3.connect(str(path))
+        try:
+            for statement in schema:
+                archive.execute(statement)
+
+            # Stream the year's ratings across in id order
+            query = (Rating.objects
+                    .filter(module_instance__academic_year=year)
+                    .order_by('id')
+                    .values_list(*[field.attname for field in Rating._meta.concrete_fields])
+            )
+            insert = 'INSERT INTO %s (%s) VALUES (%s)' % (table, ', '.join(columns), ', '.join('?' * len(columns)))
+            copied = 0
+            batch = []
+            for row in query.iterator(chunk_size=5000):
+                batch.append(row)
+                if len(batch) == 5000:
+                    archive.executemany(insert, batch)
+                    copied += len(batch)
+                    batch = []
+            archive.executemany(insert, batch)
+            copied += len(batch)
+            archive.commit()
+
+            # Compact the file and leave it as a single self-contained file
+            archive.execute('PRAGMA journal_mode=DELETE')
+            archive.execute('ANALYZE')
+            archive.execute('VACUUM')
+            archived = archive.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+        finally:
+            archive.close()
+
+        if archived != copied:
+            path.unlink()
+            raise CommandError('Archive holds %d ratings but %d were copied, archive removed.' % (archived, copied))
+        os.chmod(path, 0o444)
+        self.stdout.write('Archived %d ratings for %d to %s.' % (archived, year, path))
+
+        # Remove the moved rows directly rather than through the ORM, as
+        # they have only moved, not been deleted. Left in place they would
+        # be counted twice once the archive is served.
+        with transaction.atomic(using='default'), default.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM %s WHERE module_instance_id IN (SELECT id FROM %s WHERE academic_year = %%s)'
+                % (table, ModuleInstance._meta.db_table),
+                [year]
+            )
+            self.stdout.write('Removed %d ratings from the default database.' % cursor.rowcount)
+        caching.bumpGeneration(caching.RATINGS)
+
+        self.stdout.write(
+            'Add %d to PROF_RATE_ARCHIVED_YEARS and restart the workers to serve ratings from the archive.' % year
+        )
@@ -0,0 +1,123 @@
+import multiprocessing
+import os
+import tempfile
+import time
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings
+from prof_rate_service import caching, metrics, views
+from prof_rate_service.cache_backends import SQLiteCache
+
+
+# Endpoint bodies the workers fetch, with the scopes the views cache them under
+HOT_BODIES = {
+    'allModuleInstances': (views.buildModuleInstances, [caching.CATALOGUE]),
+    'allProfessorRatings': (views.buildProfessorRatings, [caching.CATALOGUE, caching.RATINGS]),
+}
+
+
+def cacheSettings(kind, path):
+    if kind == 'shared':
+        return {'default': {'BACKEND': 'prof_rate_service.cache_backends.SQLiteCache', 'LOCATION': path}}
+    return {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchcache'}}
+
+
+def makeBackend(kind, path):
+    if kind == 'shared':
+        return SQLiteCache(path, {})
+    return LocMemCache('benchcache-%d' % os.getpid(), {})
+
+
+#-------------------------------------------------------------------------
+# One simulated worker: after an invalidation it serves a burst of
+# requests through caching.cachedBody, as the views do. Returns the builds
+# it did, the seconds spent building, the stale bodies it was served and
+# the seconds spent serving the burst.
+#-------------------------------------------------------------------------
+def runWorker(kind, path, lockDir, requests):
+    builds = 0
+    buildSeconds = 0.0
+
+    def counted(builder):
+        def build():
+            nonlocal builds, buildSeconds
+            buildStartedAt = time.perf_counter()
+            body = builder()
+            buildSeconds += time.perf_counter() - buildStartedAt
+            builds += 1
+            return body
+        return build
+
+    with override_settings(CACHES=cacheSettings(kind, path), PROF_RATE_CACHE_LOCK_DIR=lockDir):
+        staleBefore = metrics.snapshot().get('cache.stale_served', 0)
+        startedAt = time.perf_counter()
+
+        for i in range(requests):
+            name = list(HOT_BODIES)[i % len(HOT_BODIES)]
+            builder, scopes = HOT_BODIES[name]
+            caching.cachedBody(name, counted(builder), scopes)
+
+        servedSeconds = time.perf_counter() - startedAt
+        stale = metrics.snapshot().get('cache.stale_served', 0) - staleBefore
+
+    connections.close_all()
+    return builds, buildSeconds, stale, servedSeconds
+
+
+class Command(BaseCommand):
+    help = 'Compares per-process caching with the shared SQLite cache across simulated workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=200, help='Requests each worker serves per invalidation.')
+        parser.add_argument('--invalidations', type=int, default=5)
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'benchcache.sqlite3')
+            lockDir = os.path.join(directory, 'locks')
+
+            for kind in ('per-process', 'shared'):
+                totalBuilds = 0
+                totalBuildSeconds = 0.0
+                totalStale = 0
+                wallSeconds = 0.0
+
+                for _ in range(options['invalidations']):
+                    # Bumping the generations retires every cached body, as
+                    # a write to the catalogue or ratings would. Per-process
+                    # caches start empty anyway, each round's workers being
+                    # new processes.
+                    with override_settings(CACHES=cacheSettings(kind, path)):
+                        caching.bumpGeneration(caching.CATALOGUE)
+                        caching.bumpGeneration(caching.RATINGS)
+
+                    connections.close_all()
+                    jobs = [(kind, path, lockDir, options['requests'])] * workers
+                    startedAt = time.perf_counter()
+                    with multiprocessing.get_context('fork').Pool(workers) as pool:
+                        results = pool.starmap(runWorker, jobs)
+                    wallSeconds += time.perf_counter() - startedAt
+
+                    totalBuilds += sum(r[0] for r in results)
+                    totalBuildSeconds += sum(r[1] for r in results)
+                    totalStale += sum(r[2] for r in results)
+
+                served = workers * options['requests'] * options['invalidations']
+                self.stdout.write(
+                    '%-12s builds=%-5d builds_per_body_per_invalidation=%.2f stale_served=%-5d db_seconds=%.3f wall_seconds=%.3f requests=%d'
+                    % (kind, totalBuilds, totalBuilds / (len(HOT_BODIES) * options['invalidations']),
+                       totalStale, totalBuildSeconds, wallSeconds, served)
+                )
+
+            # Single-process hit latency for each backend
+            for kind in ('per-process', 'shared'):
+                backend = makeBackend(kind, path)
+                backend.set('bench:latency', b'x' * 16384)
+                startedAt = time.perf_counter()
+                for _ in range(10000):
+                    backend.get('bench:latency')
+                self.stdout.write('%-12s hit_latency_us=%.1f' % (kind, (time.perf_counter() - startedAt) * 100))
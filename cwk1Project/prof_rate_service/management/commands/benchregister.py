@@ -0,0 +1,76 @@
+import asyncio
+import time
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from prof_rate_service import accounts
+
+
+# Registration as registerUser did it before: taken emails and usernames
+# checked up front, the password hashed on the request thread and the
+# group looked up before the membership is added
+def legacyRegister(username, email, password):
+    if User.objects.filter(email=email).exists() or User.objects.filter(username=username).exists():
+        raise CommandError('%s is already registered.' % username)
+    user = User.objects.create_user(username=username, email=email, password=password)
+    user.groups.add(Group.objects.get(name=accounts.STUDENT_GROUP))
+
+
+# Savepoints are left out, counting only the statements that do the work
+def statements(queries):
+    return sum(1 for query in queries.captured_queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE')))
+
+
+async def streamlinedRegister(username, email, password):
+    hashedPassword = await accounts.hashPassword(password)
+    await sync_to_async(accounts.createStudent)(username, email, hashedPassword)
+
+
+class Command(BaseCommand):
+    help = (
+        'Times registrations through the old and the streamlined registerUser paths. '
+        'Every account made is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10, help='Registrations timed on each path.')
+        parser.add_argument('--concurrency', type=int, default=4, help='Streamlined registrations in flight at once.')
+
+    def handle(self, *args, **options):
+        count = max(1, options['count'])
+        concurrency = max(1, options['concurrency'])
+
+        def accountsFor(path):
+            return [('bench-%s-%d' % (path, i), 'bench-%s-%d@example.com' % (path, i), 'Bench-Password-%d' % i) for i in range(count)]
+
+        async def runStreamlined(batch):
+            slots = asyncio.Semaphore(concurrency)
+
+            async def register(account):
+                async with slots:
+                    await streamlinedRegister(*account)
+
+            await asyncio.gather(*(register(account) for account in batch))
+
+        with transaction.atomic():
+            Group.objects.get_or_create(name=accounts.STUDENT_GROUP)
+
+            startedAt = time.perf_counter()
+            with CaptureQueriesContext(connection) as legacyQueries:
+                for account in accountsFor('legacy'):
+                    legacyRegister(*account)
+            legacySeconds = time.perf_counter() - startedAt
+
+            startedAt = time.perf_counter()
+            with CaptureQueriesContext(connection) as streamlinedQueries:
+                async_to_sync(runStreamlined)(accountsFor('streamlined'))
+            streamlinedSeconds = time.perf_counter() - startedAt
+
+            transaction.set_rollback(True)
+
+        self.stdout.write('legacy:      %d registrations in %.2fs, %.2f/s, %.1f statements each' % (
+            count, legacySeconds, count / legacySeconds, statements(legacyQueries) / count))
+        self.stdout.write('streamlined: %d registrations in %.2fs, %.2f/s, %.1f statements each (%d in flight)' % (
+            count, streamlinedSeconds, count / streamlinedSeconds, statements(streamlinedQueries) / count, concurrency))
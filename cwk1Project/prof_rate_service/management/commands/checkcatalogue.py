@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from prof_rate_service import caching, readmodels
+
+
+class Command(BaseCommand):
+    help = 'Compares the module instance catalogue read model with the normalized tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Rewrite every mismatched entry.')
+
+    def handle(self, *args, **options):
+        mismatches = readmodels.findCatalogueMismatches()
+        for instanceId, problem in mismatches:
+            self.stdout.write('Module instance %s: %s' % (instanceId, problem))
+
+        if not mismatches:
+            self.stdout.write('Catalogue is consistent.')
+            return
+
+        if options['repair']:
+            readmodels.refreshCatalogue(instanceId for instanceId, problem in mismatches)
+            # Cached bodies were built from the stale entries
+            caching.bumpGeneration(caching.CATALOGUE)
+            self.stdout.write('Repaired %d entries.' % len({instanceId for instanceId, problem in mismatches}))
+        else:
+            raise CommandError('%d catalogue mismatches found.' % len(mismatches))
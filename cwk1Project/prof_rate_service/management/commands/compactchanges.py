@@ -0,0 +1,21 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from prof_rate_service import changefeed
+
+
+class Command(BaseCommand):
+    help = (
+        'Compacts the change log: drops entries superseded by later changes to the same record, '
+        'and deletions older than the tombstone retention period.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tombstone-days', type=int, default=30,
+            help='Days to keep deletions for. Consumers further behind than this must resync from cursor 0.'
+        )
+
+    def handle(self, *args, **options):
+        superseded, tombstones = changefeed.compact(timedelta(days=options['tombstone_days']))
+        self.stdout.write('Dropped %d superseded entries and %d expired deletions.' % (superseded, tombstones))
+        self.stdout.write('Change feed horizon is now cursor %d.' % changefeed.currentHorizon())
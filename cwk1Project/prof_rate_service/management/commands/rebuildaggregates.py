@@ -0,0 +1,102 @@
+import multiprocessing
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from prof_rate_service import caching, readmodels
+from prof_rate_service.models import ModuleInstance, Professor, RatingAggregate
+
+
+#-------------------------------------------------------------------------
+# One worker task: tallies the ratings of a range of professor ids from
+# every partition, on the worker's own database connections.
+# Returns: (first id, last id, tallies, ratings read, seconds taken)
+#-------------------------------------------------------------------------
+def tallyRange(job):
+    first, last, chunkSize = job
+    startedAt = time.perf_counter()
+    tallies, read = readmodels.tallyRatings(first, last, chunkSize)
+    connections.close_all()
+    return first, last, tallies, read, time.perf_counter() - startedAt
+
+
+# Splits the professor ids into contiguous ranges holding a similar number
+# of professors
+def professorRanges(ids, count):
+    size = max(1, -(-len(ids) // count))
+    return [(ids[start], ids[min(start + size, len(ids)) - 1]) for start in range(0, len(ids), size)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the rating aggregates from the ratings in every partition, split by professor '
+        'across a pool of worker processes. Rating writes wait until the rebuild finishes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--ranges', type=int, help='Professor id ranges to split the work into, 4 per worker by default.')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Ratings fetched per database round trip.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Aggregates written per statement.')
+        parser.add_argument('--verify', action='store_true', help='Only report mismatched aggregates.')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        professorIds = list(Professor.objects.order_by('id').values_list('id', flat=True))
+        instanceIds = set(ModuleInstance.objects.values_list('id', flat=True))
+        ranges = professorRanges(professorIds, options['ranges'] or workers * 4)
+        if not ranges:
+            self.stdout.write('No professors, nothing to rebuild.')
+            return
+
+        # Workers must not share the parent's database connections
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(workers) as pool, transaction.atomic():
+            if not options['verify']:
+                # Take the default database's write lock before the workers
+                # read, so no rating can change between being counted and
+                # its aggregate being written
+                with connection.cursor() as cursor:
+                    cursor.execute('UPDATE %s SET count = count WHERE 0' % RatingAggregate._meta.db_table)
+
+            known = set(professorIds)
+            startedAt = time.perf_counter()
+            read = 0
+            mismatches = []
+            jobs = [(first, last, options['chunk_size']) for first, last in ranges]
+
+            for done, (first, last, tallies, rangeRead, seconds) in enumerate(pool.imap_unordered(tallyRange, jobs), 1):
+                # Archives may still hold ratings of since deleted professors
+                # and module instances, which have no aggregate
+                tallies = {key: tally for key, tally in tallies.items() if key[0] in known and key[1] in instanceIds}
+                mismatches += readmodels.findAggregateMismatches(tallies, readmodels.storedAggregates(first, last))
+                read += rangeRead
+                elapsed = time.perf_counter() - startedAt
+                self.stdout.write(
+                    '[%d/%d] professors %d-%d: %d ratings in %.2fs, %d ratings/s overall'
+                    % (done, len(jobs), first, last, rangeRead, seconds, read / elapsed if elapsed else 0)
+                )
+
+            for (professorId, instanceId), actual, expected in mismatches[:20]:
+                self.stdout.write(
+                    'Professor %s, module instance %s: stored %s, expected %s'
+                    % (professorId, instanceId, dict(zip(readmodels.AGGREGATE_FIELDS, actual)), dict(zip(readmodels.AGGREGATE_FIELDS, expected)))
+                )
+            if len(mismatches) > 20:
+                self.stdout.write('... and %d more.' % (len(mismatches) - 20))
+
+            if options['verify']:
+                if mismatches:
+                    raise CommandError('%d aggregate mismatches found across %d ratings.' % (len(mismatches), read))
+                self.stdout.write('Aggregates are consistent across %d ratings.' % read)
+                return
+
+            written = readmodels.writeAggregates(mismatches, options['batch_size'])
+
+        if written:
+            caching.bumpGeneration(caching.RATINGS)
+        elapsed = time.perf_counter() - startedAt
+        self.stdout.write(
+            'Rebuilt aggregates from %d ratings in %.2fs (%d ratings/s), %d rows rewritten.'
+            % (read, elapsed, read / elapsed if elapsed else 0, written)
+        )
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from prof_rate_service import warmup
+
+
+class Command(BaseCommand):
+    help = 'Runs the worker warm-up and prints how long each startup phase took.'
+
+    def handle(self, *args, **options):
+        warmup.warmUp()
+        self.stdout.write(warmup.timingReport())
@@ -0,0 +1,18 @@
+import threading
+
+
+#-------------------------------------------------------------------------
+# Process-local counters, served by the serviceMetrics endpoint
+#-------------------------------------------------------------------------
+_counters = {}
+_lock = threading.Lock()
+
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def snapshot():
+    with _lock:
+        return dict(sorted(_counters.items()))
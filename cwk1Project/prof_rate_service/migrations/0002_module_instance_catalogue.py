@@ -0,0 +1,53 @@
+# Generated by Django 5.1.6 on 2026-10-19 17:48
+
+import json
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populateCatalogue(apps, schema_editor):
+    ModuleInstance = apps.get_model('prof_rate_service', 'ModuleInstance')
+    ModuleInstanceCatalogue = apps.get_model('prof_rate_service', 'ModuleInstanceCatalogue')
+    db = schema_editor.connection.alias
+
+    entries = []
+    for instance in ModuleInstance.objects.using(db).select_related('module').prefetch_related('professors'):
+        taughtBy = [
+            {'professor_code': p.professor_code, 'professor_name': p.name}
+            for p in sorted(instance.professors.all(), key=lambda p: p.id)
+        ]
+        entries.append(ModuleInstanceCatalogue(
+            module_instance_id=instance.id,
+            module_code=instance.module.code,
+            module_name=instance.module.name,
+            academic_year=instance.academic_year,
+            semester=instance.semester,
+            taught_by=json.dumps(taughtBy),
+        ))
+    ModuleInstanceCatalogue.objects.using(db).bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prof_rate_service', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModuleInstanceCatalogue',
+            fields=[
+                ('module_instance', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='prof_rate_service.moduleinstance')),
+                ('module_code', models.CharField(max_length=5)),
+                ('module_name', models.CharField(max_length=50)),
+                ('academic_year', models.PositiveIntegerField()),
+                ('semester', models.PositiveSmallIntegerField()),
+                ('taught_by', models.TextField(default='[]')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['module_code', 'academic_year', 'semester'], name='catalogue_listing_idx')],
+            },
+        ),
+        migrations.RunPython(populateCatalogue, migrations.RunPython.noop),
+    ]
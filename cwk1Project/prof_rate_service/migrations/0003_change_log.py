@@ -0,0 +1,65 @@
+# Generated by Django 5.1.6 on 2026-10-19 17:54
+
+from django.db import migrations, models
+
+
+# Start the feed with an insert for every existing record, so a consumer
+# reading from cursor 0 sees the full current state
+def seedChangeLog(apps, schema_editor):
+    db = schema_editor.connection.alias
+    ChangeLogEntry = apps.get_model('prof_rate_service', 'ChangeLogEntry')
+    Module = apps.get_model('prof_rate_service', 'Module')
+    Professor = apps.get_model('prof_rate_service', 'Professor')
+    ModuleInstance = apps.get_model('prof_rate_service', 'ModuleInstance')
+    Rating = apps.get_model('prof_rate_service', 'Rating')
+
+    def entries():
+        for m in Module.objects.using(db).order_by('id'):
+            yield ChangeLogEntry(entity='module', key=str(m.id), operation='insert',
+                                 data={'code': m.code, 'name': m.name})
+        for p in Professor.objects.using(db).order_by('id'):
+            yield ChangeLogEntry(entity='professor', key=str(p.id), operation='insert',
+                                 data={'professor_code': p.professor_code, 'name': p.name})
+        for i in ModuleInstance.objects.using(db).order_by('id'):
+            yield ChangeLogEntry(entity='module_instance', key=str(i.id), operation='insert',
+                                 data={'module_id': i.module_id, 'academic_year': i.academic_year, 'semester': i.semester})
+        for a in ModuleInstance.professors.through.objects.using(db).order_by('id'):
+            yield ChangeLogEntry(entity='assignment', key='%s:%s' % (a.moduleinstance_id, a.professor_id), operation='insert',
+                                 data={'module_instance_id': a.moduleinstance_id, 'professor_id': a.professor_id})
+        for r in Rating.objects.using(db).order_by('id'):
+            yield ChangeLogEntry(entity='rating', key=str(r.id), operation='insert',
+                                 data={'module_instance_id': r.module_instance_id, 'professor_id': r.professor_id, 'rating': r.rating})
+
+    ChangeLogEntry.objects.using(db).bulk_create(entries(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prof_rate_service', '0002_module_instance_catalogue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeFeedHorizon',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cursor', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(max_length=20)),
+                ('key', models.CharField(max_length=41)),
+                ('operation', models.CharField(choices=[('insert', 'Insert'), ('update', 'Update'), ('delete', 'Delete')], max_length=6)),
+                ('data', models.JSONField(null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['entity', 'key', 'id'], name='changelog_entity_key_idx')],
+            },
+        ),
+        migrations.RunPython(seedChangeLog, migrations.RunPython.noop),
+    ]
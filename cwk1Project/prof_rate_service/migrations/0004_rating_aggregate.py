@@ -0,0 +1,72 @@
+# Generated by Django 5.1.6 on 2026-10-19 18:01
+
+import django.db.models.deletion
+from django.db import connections, migrations, models
+from django.db.models import Count, Q, Sum
+
+
+# Tally the existing ratings, including those in archived partitions
+def populateAggregates(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Rating = apps.get_model('prof_rate_service', 'Rating')
+    RatingAggregate = apps.get_model('prof_rate_service', 'RatingAggregate')
+
+    tallies = {}
+    for alias in [db] + sorted(alias for alias in connections if alias.startswith('ratings_')):
+        query = (Rating.objects.using(alias)
+                .values_list('professor_id', 'module_instance_id')
+                .annotate(
+                    count=Count('id'),
+                    total=Sum('rating'),
+                    **{'rated_%d' % n: Count('id', filter=Q(rating=n)) for n in range(1, 6)}
+                )
+                .order_by()
+        )
+        for professorId, instanceId, *counts in query:
+            tally = tallies.setdefault((professorId, instanceId), [0] * 7)
+            for i, value in enumerate(counts):
+                tally[i] += value
+
+    RatingAggregate.objects.using(db).bulk_create(
+        RatingAggregate(
+            professor_id=professorId,
+            module_instance_id=instanceId,
+            count=tally[0],
+            total=tally[1],
+            rated_1=tally[2],
+            rated_2=tally[3],
+            rated_3=tally[4],
+            rated_4=tally[5],
+            rated_5=tally[6],
+        )
+        for (professorId, instanceId), tally in tallies.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prof_rate_service', '0003_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('rated_1', models.PositiveIntegerField(default=0)),
+                ('rated_2', models.PositiveIntegerField(default=0)),
+                ('rated_3', models.PositiveIntegerField(default=0)),
+                ('rated_4', models.PositiveIntegerField(default=0)),
+                ('rated_5', models.PositiveIntegerField(default=0)),
+                ('module_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prof_rate_service.moduleinstance')),
+                ('professor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prof_rate_service.professor')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('professor', 'module_instance'), name='unique_rating_aggregate')],
+            },
+        ),
+        migrations.RunPython(populateAggregates, migrations.RunPython.noop),
+    ]
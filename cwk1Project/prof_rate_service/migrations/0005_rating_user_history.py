@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-19 18:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prof_rate_service', '0004_rating_aggregate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['user', 'id', 'module_instance', 'professor', 'rating'], name='rating_user_history'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.6 on 2026-10-19 18:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Accounts made outside registerUser (in the admin, say) may share an
+# email, and the index cannot be built over them, so list them instead
+def checkDuplicateEmails(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    db = schema_editor.connection.alias
+    duplicates = list(User.objects.using(db)
+        .exclude(email='')
+        .values('email')
+        .annotate(accounts=models.Count('id'))
+        .filter(accounts__gt=1)
+        .order_by('email')
+        .values_list('email', flat=True)
+    )
+    if duplicates:
+        raise RuntimeError('Cannot add a unique index on user emails, these are used by more than one account: ' + ', '.join(duplicates))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prof_rate_service', '0005_rating_user_history'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(checkDuplicateEmails, migrations.RunPython.noop),
+        # Blank emails stay allowed for accounts made without one
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX auth_user_email_unique ON auth_user (email) WHERE email <> ''",
+            'DROP INDEX auth_user_email_unique',
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, router, transaction
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.core.exceptions import ValidationError
 
@@ -58,6 +58,13 @@ class Rating(models.Model):
                 name='unique_rating'
             )
         ]
+        # Covers myRatings, which pages through a user's ratings by id
+        indexes = [
+            models.Index(
+                fields=['user', 'id', 'module_instance', 'professor', 'rating'],
+                name='rating_user_history'
+            )
+        ]
 
     def clean(self):
         if not self.module_instance.professors.filter(id=self.professor.id).exists():
@@ -65,7 +72,94 @@ class Rating(models.Model):
         
     def save(self, *args, **kwargs):
         self.clean()
-        super().save(*args, **kwargs)
+        # The aggregate receivers read the stored row before the write and
+        # update the aggregates after it, all in this one transaction
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Rating, instance=self)):
+            super().save(*args, **kwargs)
+
+    def __str__(self):
+        return u'%s %s %s' % (self.module_instance, self.professor, self.user)
+
+# Read model for allModuleInstances, kept in step with the tables above
+# by the receivers in signals.py. taught_by holds the serialized JSON list
+# so the endpoint can emit rows without touching the professors table.
+class ModuleInstanceCatalogue(models.Model):
+    module_instance = models.OneToOneField(ModuleInstance, on_delete=models.CASCADE, primary_key=True)
+    module_code = models.CharField(max_length=5)
+    module_name = models.CharField(max_length=50)
+    academic_year = models.PositiveIntegerField()
+    semester = models.PositiveSmallIntegerField()
+    taught_by = models.TextField(default='[]')
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['module_code', 'academic_year', 'semester'],
+                name='catalogue_listing_idx'
+            )
+        ]
+
+    def __str__(self):
+        return u'%s %s %s' % (self.module_code, self.academic_year, self.semester)
+
+
+# Count, total and histogram of the ratings each professor received in
+# each module instance, across every rating partition. Kept in step with
+# Rating by the receivers in signals.py and rebuilt by rebuildaggregates.
+class RatingAggregate(models.Model):
+    professor = models.ForeignKey(Professor, on_delete=models.CASCADE)
+    module_instance = models.ForeignKey(ModuleInstance, on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    rated_1 = models.PositiveIntegerField(default=0)
+    rated_2 = models.PositiveIntegerField(default=0)
+    rated_3 = models.PositiveIntegerField(default=0)
+    rated_4 = models.PositiveIntegerField(default=0)
+    rated_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['professor', 'module_instance'],
+                name='unique_rating_aggregate'
+            )
+        ]
+
+    def __str__(self):
+        return u'%s %s %s' % (self.professor_id, self.module_instance_id, self.count)
+
+
+# Append-only log of catalogue and rating changes, served by the changes
+# endpoint. The id is the cursor consumers resume from.
+class ChangeLogEntry(models.Model):
+    OPERATION_CHOICES = [
+        ('insert', 'Insert'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+    ]
+
+    entity = models.CharField(max_length=20)
+    key = models.CharField(max_length=41)
+    operation = models.CharField(max_length=6, choices=OPERATION_CHOICES)
+    data = models.JSONField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['entity', 'key', 'id'],
+                name='changelog_entity_key_idx'
+            )
+        ]
+
+    def __str__(self):
+        return u'%s %s %s %s' % (self.id, self.operation, self.entity, self.key)
+
+
+# Consumers whose cursor is older than this have missed deletions that
+# compaction has since dropped, and must start again from cursor 0
+class ChangeFeedHorizon(models.Model):
+    cursor = models.BigIntegerField(default=0)
 
     def __str__(self):
-        return u'%s %s %s' % (self.module_instance, self.professor, self.user)
\ No newline at end of file
+        return u'%s' % self.cursor
@@ -0,0 +1,48 @@
+from django.conf import settings
+
+
+#-------------------------------------------------------------------------
+# Rating partitions
+# Ratings for the academic years in RATING_ARCHIVED_YEARS live in read-only
+# SQLite files, one per year (written by `manage.py archiveratings`), and
+# every other year stays in the default database. Ratings keep the ids the
+# default database gave them, so ids stay unique across partitions.
+#-------------------------------------------------------------------------
+def archiveAlias(year):
+    return 'ratings_%d' % year
+
+
+def archivePath(year):
+    return settings.RATING_ARCHIVE_DIR / ('ratings_%d.sqlite3' % year)
+
+
+def isArchived(year):
+    return year in settings.RATING_ARCHIVED_YEARS
+
+
+# Whether ratings for the year can no longer be written. A year is frozen
+# from the moment archiveratings starts writing its archive file, not only
+# once the year is served from it, as ratings written in between would be
+# removed from the default database without ever reaching the archive.
+def isFrozen(year):
+    return isArchived(year) or archivePath(year).exists()
+
+
+# Databases holding ratings for the given academic years (all of them when
+# years is None), so queries for current years skip the archives entirely
+def ratingDatabases(years=None):
+    archived = settings.RATING_ARCHIVED_YEARS
+    if years is not None:
+        archived = [year for year in archived if year in years]
+
+    databases = [archiveAlias(year) for year in sorted(archived)]
+    if years is None or any(not isArchived(year) for year in years):
+        databases.insert(0, 'default')
+    return databases
+
+
+# Average rounded half up, matching ROUND(AVG(...)) in SQLite
+def roundedAverage(total, count):
+    if not count:
+        return None
+    return (2 * total + count) // (2 * count)
@@ -0,0 +1,201 @@
+import cProfile
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import time
+from contextlib import ExitStack
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from . import metrics
+
+
+#-------------------------------------------------------------------------
+# On-demand request profiling
+# A request is profiled when it carries PROF_RATE_PROFILE_TOKEN in the
+# X-Profile-Token header, or at random at the rate PROF_RATE_PROFILE_SAMPLE_RATES
+# gives its URL name. The view runs under cProfile with the queries of the
+# default database, and of any other database already connected, captured.
+# Each profile is kept as a pstats file with a JSON summary beside it, and
+# only the newest PROF_RATE_PROFILE_KEEP are kept. Quoted values in the
+# captured SQL are redacted.
+#-------------------------------------------------------------------------
+TOKEN_HEADER = 'HTTP_X_PROFILE_TOKEN'
+PROFILE_ID = re.compile(r'^\d+-\d+-[A-Za-z0-9_]+$')
+
+# Saved SQL has every quoted value replaced, as any view's queries may
+# carry session keys, passwords or password hashes
+QUOTED_VALUE = re.compile(r"'(?:[^']|'')*'")
+
+
+def redact(sql):
+    return QUOTED_VALUE.sub("'<redacted>'", sql)
+
+
+# Capturing queries connects to the database, so archives and other
+# databases this thread has not opened are left out
+def capturedAliases():
+    return ['default'] + [
+        connection.alias for connection in connections.all(initialized_only=True)
+        if connection.alias != 'default' and connection.connection is not None
+    ]
+
+
+def profileDir():
+    return settings.PROF_RATE_PROFILE_DIR
+
+
+def shouldProfile(request, viewName):
+    token = settings.PROF_RATE_PROFILE_TOKEN
+    supplied = request.META.get(TOKEN_HEADER)
+    if token and supplied and hmac.compare_digest(supplied.encode(), token.encode()):
+        return 'token'
+
+    rate = settings.PROF_RATE_PROFILE_SAMPLE_RATES.get(viewName, 0)
+    if rate and random.random() < rate:
+        return 'sample'
+    return None
+
+
+# Drops the oldest profiles beyond PROF_RATE_PROFILE_KEEP
+def trimProfiles():
+    summaries = sorted(name for name in os.listdir(profileDir()) if name.endswith('.json'))
+    for name in summaries[:max(0, len(summaries) - settings.PROF_RATE_PROFILE_KEEP)]:
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(profileDir(), name[:-5] + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def saveProfile(profiler, summary):
+    os.makedirs(profileDir(), exist_ok=True)
+    profileId = '%d-%d-%s' % (time.time_ns(), os.getpid(), summary['view'])
+    summary['id'] = profileId
+
+    profiler.dump_stats(os.path.join(profileDir(), profileId + '.prof'))
+    # The summary is written last, as its presence marks a complete profile
+    with open(os.path.join(profileDir(), profileId + '.json'), 'w') as file:
+        json.dump(summary, file)
+
+    trimProfiles()
+    metrics.increment('profiling.saved')
+    return profileId
+
+
+# Returns: Every kept profile's summary, newest first, without its queries
+def listProfiles():
+    if not os.path.isdir(profileDir()):
+        return []
+
+    profiles = []
+    for name in sorted(os.listdir(profileDir()), reverse=True):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(profileDir(), name)) as file:
+                summary = json.load(file)
+        except (OSError, ValueError):
+            continue
+        summary.pop('queries', None)
+        profiles.append(summary)
+    return profiles
+
+
+#---------------------------------------------------------------------------
+# loadProfile
+# Returns: The profile's summary with its queries and its top functions,
+#          ordered by sortKey ('cumulative' or 'tottime'), or None if there
+#          is no such profile
+#---------------------------------------------------------------------------
+def loadProfile(profileId, sortKey='cumulative', limit=30):
+    if not PROFILE_ID.match(profileId):
+        return None
+
+    base = os.path.join(profileDir(), profileId)
+    try:
+        with open(base + '.json') as file:
+            summary = json.load(file)
+        stats = pstats.Stats(base + '.prof')
+    except (OSError, ValueError):
+        return None
+
+    column = 3 if sortKey == 'cumulative' else 2
+    functions = sorted(stats.stats.items(), key=lambda item: item[1][column], reverse=True)[:limit]
+    summary['functions'] = [
+        {
+            'function': '%s:%d(%s)' % function,
+            'calls': calls,
+            'primitive_calls': primitiveCalls,
+            'own_seconds': round(ownSeconds, 6),
+            'cumulative_seconds': round(cumulativeSeconds, 6),
+        }
+        for function, (primitiveCalls, calls, ownSeconds, cumulativeSeconds, callers) in functions
+    ]
+    return summary
+
+
+class ProfilingMiddleware:
+    # Must come last in MIDDLEWARE: returning the response from
+    # process_view skips the process_view of every middleware after it
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        viewName = request.resolver_match.url_name or view_func.__name__
+        trigger = shouldProfile(request, viewName)
+        if trigger is None:
+            return None
+
+        if iscoroutinefunction(view_func):
+            view_func = async_to_sync(view_func)
+
+        profiler = cProfile.Profile()
+        with ExitStack() as stack:
+            captures = [(alias, stack.enter_context(CaptureQueriesContext(connections[alias]))) for alias in capturedAliases()]
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already running in this process
+                metrics.increment('profiling.busy')
+                return None
+
+            # Requests that fail are kept too, with a 500 status
+            status = 500
+            startedAt = time.perf_counter()
+            try:
+                response = view_func(request, *view_args, **view_kwargs)
+                status = getattr(response, 'status_code', None)
+            finally:
+                profiler.disable()
+                duration = time.perf_counter() - startedAt
+                self.save(request, viewName, trigger, profiler, status, duration, captures)
+
+        return response
+
+    def save(self, request, viewName, trigger, profiler, status, duration, captures):
+        try:
+            saveProfile(profiler, {
+                'view': viewName,
+                'method': request.method,
+                'path': request.path,
+                'status': status,
+                'trigger': trigger,
+                'created': time.time(),
+                'seconds': round(duration, 6),
+                'query_count': sum(len(capture) for alias, capture in captures),
+                'queries': [
+                    {'database': alias, 'sql': redact(query['sql']), 'seconds': float(query['time'])}
+                    for alias, capture in captures for query in capture.captured_queries
+                ],
+            })
+        except OSError as e:
+            logging.getLogger(__name__).warning('Could not save profile of %s: %s', viewName, e)
@@ -0,0 +1,89 @@
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection, transaction
+from . import caching, changefeed, metrics, readmodels
+from .models import ModuleInstance, Rating
+
+
+#-------------------------------------------------------------------------
+# Rating upserts
+# A user's rating of a professor in a module instance is written with one
+# INSERT ... ON CONFLICT DO UPDATE on the unique_rating constraint, which
+# also checks that the professor teaches the instance. The rating the user
+# had before is read first without a lock, and the update only applies if
+# it is still that rating, so the aggregates and change log can be moved
+# by the difference. A write that loses a race with another is retried.
+# Raw SQL skips the Rating signal receivers, so their work is done here.
+#-------------------------------------------------------------------------
+UPSERT_ATTEMPTS = 3
+
+UPSERT_SQL = (
+    'INSERT INTO {rating} (user_id, module_instance_id, professor_id, rating) '
+    'SELECT %s, %s, %s, %s WHERE EXISTS ('
+    'SELECT 1 FROM {assignment} WHERE moduleinstance_id = %s AND professor_id = %s) '
+    'ON CONFLICT (user_id, module_instance_id, professor_id) '
+    'DO UPDATE SET rating = excluded.rating WHERE {rating}.rating IS %s '
+    'RETURNING id'
+)
+
+
+def currentRating(userId, instanceId, professorId):
+    return (Rating.objects
+        .filter(user_id=userId, module_instance_id=instanceId, professor_id=professorId)
+        .values_list('rating', flat=True)
+        .first()
+    )
+
+
+#---------------------------------------------------------------------------
+# upsertRating
+# Returns: (rating id, the user's previous rating or None if the rating
+#          was created)
+# Raises:  ValidationError if the professor does not teach the instance
+#---------------------------------------------------------------------------
+def upsertRating(userId, instanceId, professorId, rating):
+    sql = UPSERT_SQL.format(
+        rating=connection.ops.quote_name(Rating._meta.db_table),
+        assignment=connection.ops.quote_name(ModuleInstance.professors.through._meta.db_table),
+    )
+
+    for attempt in range(UPSERT_ATTEMPTS):
+        previous = currentRating(userId, instanceId, professorId)
+
+        # The upsert is the transaction's first statement, so it takes the
+        # write lock straight away rather than upgrading a read lock
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [userId, instanceId, professorId, rating, instanceId, professorId, previous])
+                row = cursor.fetchone()
+
+            if row is not None:
+                recordRating(row[0], userId, instanceId, professorId, rating, previous)
+
+        if row is not None:
+            if previous != rating:
+                caching.bumpGeneration(caching.RATINGS)
+            return row[0], previous
+
+        # Nothing was written: either the professor does not teach the
+        # instance, or the rating changed since it was read
+        if currentRating(userId, instanceId, professorId) == previous:
+            raise ValidationError('The selected professor does not teach this module instance.')
+        metrics.increment('ratings.upsert_retried')
+
+    raise DatabaseError('Rating kept changing during %d upsert attempts.' % UPSERT_ATTEMPTS)
+
+
+# Moves the aggregates and appends to the change log as the Rating
+# receivers in signals.py would have
+def recordRating(ratingId, userId, instanceId, professorId, rating, previous):
+    if previous is None:
+        readmodels.applyRating(professorId, instanceId, rating, 1)
+    elif previous != rating:
+        readmodels.changeRating(professorId, instanceId, previous, rating)
+    else:
+        return
+
+    changefeed.recordSaved(
+        Rating(id=ratingId, user_id=userId, module_instance_id=instanceId, professor_id=professorId, rating=rating),
+        previous is None,
+    )
@@ -0,0 +1,217 @@
+import json
+from django.db.models import F
+from . import partitions
+from .models import ModuleInstance, ModuleInstanceCatalogue, Rating, RatingAggregate
+
+
+#-------------------------------------------------------------------------
+# Module instance catalogue
+# Denormalized copy of each module instance with its module code and name
+# and a pre-serialized taught_by list, read by allModuleInstances.
+#-------------------------------------------------------------------------
+def serializeTaughtBy(professors):
+    return json.dumps([
+        {'professor_code': p.professor_code, 'professor_name': p.name}
+        for p in sorted(professors, key=lambda p: p.id)
+    ])
+
+
+def buildEntry(instance):
+    return ModuleInstanceCatalogue(
+        module_instance_id=instance.id,
+        module_code=instance.module.code,
+        module_name=instance.module.name,
+        academic_year=instance.academic_year,
+        semester=instance.semester,
+        taught_by=serializeTaughtBy(instance.professors.all()),
+    )
+
+
+def expectedEntries(instanceIds=None):
+    query = ModuleInstance.objects.select_related('module').prefetch_related('professors')
+    if instanceIds is not None:
+        query = query.filter(id__in=instanceIds)
+    return {instance.id: buildEntry(instance) for instance in query}
+
+
+# Rewrites the entries of the given module instances from the normalized
+# tables, dropping entries whose instance no longer exists
+def refreshCatalogue(instanceIds):
+    instanceIds = set(instanceIds)
+    if not instanceIds:
+        return
+
+    entries = expectedEntries(instanceIds)
+    ModuleInstanceCatalogue.objects.filter(module_instance_id__in=instanceIds - set(entries)).delete()
+    ModuleInstanceCatalogue.objects.bulk_create(
+        entries.values(),
+        update_conflicts=True,
+        unique_fields=['module_instance'],
+        update_fields=['module_code', 'module_name', 'academic_year', 'semester', 'taught_by'],
+    )
+
+
+CATALOGUE_FIELDS = ['module_code', 'module_name', 'academic_year', 'semester', 'taught_by']
+
+
+#---------------------------------------------------------------------------
+# findCatalogueMismatches
+# Compares the read model with the normalized tables.
+# Returns: A list of (module instance id, description) for every entry that
+#          is missing, stale, or has no module instance behind it.
+#---------------------------------------------------------------------------
+def findCatalogueMismatches():
+    expected = expectedEntries()
+    actual = {entry.module_instance_id: entry for entry in ModuleInstanceCatalogue.objects.all()}
+    mismatches = []
+
+    for instanceId, entry in expected.items():
+        if instanceId not in actual:
+            mismatches.append((instanceId, 'missing from catalogue'))
+            continue
+        for field in CATALOGUE_FIELDS:
+            if getattr(entry, field) != getattr(actual[instanceId], field):
+                mismatches.append((instanceId, '%s is %r, expected %r' % (field, getattr(actual[instanceId], field), getattr(entry, field))))
+
+    for instanceId in actual.keys() - expected.keys():
+        mismatches.append((instanceId, 'module instance no longer exists'))
+
+    return sorted(mismatches)
+
+
+#-------------------------------------------------------------------------
+# Rating aggregates
+# Count, total and histogram of each professor's ratings in each module
+# instance, read by allProfessorRatings and professorModuleRating in place
+# of the ratings themselves. A tally is a list in AGGREGATE_FIELDS order.
+#-------------------------------------------------------------------------
+HISTOGRAM_FIELDS = ['rated_1', 'rated_2', 'rated_3', 'rated_4', 'rated_5']
+AGGREGATE_FIELDS = ['count', 'total'] + HISTOGRAM_FIELDS
+
+
+def emptyTally():
+    return [0] * len(AGGREGATE_FIELDS)
+
+
+def addToTally(tally, rating, sign=1):
+    tally[0] += sign
+    tally[1] += sign * rating
+    if 1 <= rating <= 5:
+        tally[1 + rating] += sign
+
+
+# Adds a rating to its aggregate (sign 1) or takes it away (sign -1)
+def applyRating(professorId, instanceId, rating, sign):
+    changes = {'count': F('count') + sign, 'total': F('total') + sign * rating}
+    if 1 <= rating <= 5:
+        changes['rated_%d' % rating] = F('rated_%d' % rating) + sign
+
+    aggregate = RatingAggregate.objects.filter(professor_id=professorId, module_instance_id=instanceId)
+    if aggregate.update(**changes) or sign < 0:
+        return
+
+    # First rating of the pair. Another request may create the row at the
+    # same time, so insert it empty and apply the change as an update.
+    RatingAggregate.objects.bulk_create(
+        [RatingAggregate(professor_id=professorId, module_instance_id=instanceId)],
+        ignore_conflicts=True,
+    )
+    aggregate.update(**changes)
+
+
+# Moves one rating of the pair from the old value to the new one
+def changeRating(professorId, instanceId, old, new):
+    changes = {'total': F('total') + new - old}
+    if 1 <= old <= 5:
+        changes['rated_%d' % old] = F('rated_%d' % old) - 1
+    if 1 <= new <= 5:
+        changes['rated_%d' % new] = F('rated_%d' % new) + 1
+    RatingAggregate.objects.filter(professor_id=professorId, module_instance_id=instanceId).update(**changes)
+
+
+def professorRange(first, last):
+    filters = {}
+    if first is not None:
+        filters['professor_id__gte'] = first
+    if last is not None:
+        filters['professor_id__lte'] = last
+    return filters
+
+
+#---------------------------------------------------------------------------
+# tallyRatings
+# Streams the ratings of professors with ids from first to last (either
+# may be None for no bound) out of every partition.
+# Returns: ({(professor id, module instance id): tally}, ratings read)
+#---------------------------------------------------------------------------
+def tallyRatings(first=None, last=None, chunkSize=5000):
+    tallies = {}
+    read = 0
+
+    for db in partitions.ratingDatabases():
+        query = (Rating.objects.using(db)
+                .filter(**professorRange(first, last))
+                .values_list('professor_id', 'module_instance_id', 'rating')
+                .order_by()
+        )
+        for professorId, instanceId, rating in query.iterator(chunk_size=chunkSize):
+            tally = tallies.get((professorId, instanceId))
+            if tally is None:
+                tally = tallies[(professorId, instanceId)] = emptyTally()
+            addToTally(tally, rating)
+            read += 1
+
+    return tallies, read
+
+
+def storedAggregates(first=None, last=None):
+    query = (RatingAggregate.objects
+            .filter(**professorRange(first, last))
+            .values_list('professor_id', 'module_instance_id', *AGGREGATE_FIELDS)
+    )
+    return {(row[0], row[1]): list(row[2:]) for row in query}
+
+
+# Returns: A sorted list of (key, stored tally, expected tally) for every
+#          aggregate that differs, counting absent rows as empty tallies
+def findAggregateMismatches(tallies, stored):
+    mismatches = []
+    for key in tallies.keys() | stored.keys():
+        expected = tallies.get(key, emptyTally())
+        actual = stored.get(key, emptyTally())
+        if expected != actual:
+            mismatches.append((key, actual, expected))
+    return sorted(mismatches)
+
+
+# Writes the expected tallies of the given mismatches in batches, and
+# drops rows left with no ratings. Returns the number of rows changed.
+def writeAggregates(mismatches, batchSize=1000):
+    emptied = [key for key, actual, expected in mismatches if not expected[0]]
+    rows = [
+        RatingAggregate(professor_id=key[0], module_instance_id=key[1], **dict(zip(AGGREGATE_FIELDS, expected)))
+        for key, actual, expected in mismatches if expected[0]
+    ]
+
+    # One delete per professor with emptied rows
+    emptiedByProfessor = {}
+    for professorId, instanceId in emptied:
+        emptiedByProfessor.setdefault(professorId, []).append(instanceId)
+    for professorId, instanceIds in emptiedByProfessor.items():
+        RatingAggregate.objects.filter(professor_id=professorId, module_instance_id__in=instanceIds).delete()
+
+    for start in range(0, len(rows), batchSize):
+        RatingAggregate.objects.bulk_create(
+            rows[start:start + batchSize],
+            update_conflicts=True,
+            unique_fields=['professor', 'module_instance'],
+            update_fields=AGGREGATE_FIELDS,
+        )
+
+    return len(emptied) + len(rows)
+
+
+# Single-process rebuild of every aggregate, for small datasets and tests
+def rebuildAggregates():
+    tallies, read = tallyRatings()
+    return writeAggregates(findAggregateMismatches(tallies, storedAggregates()))
@@ -0,0 +1,41 @@
+from django.conf import settings
+
+
+#-------------------------------------------------------------------------
+# RatingPartitionRouter
+# Sends a rating to the archive of its academic year when that year is
+# archived, and to the default database otherwise. Archives are opened
+# read-only, so writes routed to them fail rather than change history.
+#-------------------------------------------------------------------------
+class RatingPartitionRouter:
+    def _aliasFor(self, model, hints):
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+
+        # Everything an archived rating points at lives in the default database
+        if model._meta.label != 'prof_rate_service.Rating':
+            return 'default' if (instance._state.db or '').startswith('ratings_') else None
+        if instance._meta.label != 'prof_rate_service.Rating' or instance.module_instance_id is None:
+            return None
+
+        year = instance.module_instance.academic_year
+        if year in settings.RATING_ARCHIVED_YEARS:
+            return 'ratings_%d' % year
+        return 'default'
+
+    def db_for_read(self, model, **hints):
+        return self._aliasFor(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._aliasFor(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Archived ratings still point at catalogue rows in the default database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Archives are built by archiveratings, never migrated
+        if db.startswith('ratings_'):
+            return False
+        return None
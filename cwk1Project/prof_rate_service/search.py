@@ -0,0 +1,105 @@
+import bisect
+import itertools
+import threading
+from . import caching
+from .models import Module, Professor
+
+
+PROFESSOR = 'professor'
+MODULE = 'module'
+
+
+def ngrams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+#-------------------------------------------------------------------------
+# SearchIndex
+# In-memory index over professor and module codes and names. Prefixes are
+# found by bisecting a sorted list of terms (each code, name and word of a
+# name); substrings by intersecting bigram or trigram postings and
+# checking the few candidates left.
+#-------------------------------------------------------------------------
+class SearchIndex:
+    def __init__(self, generation):
+        self.generation = generation
+
+        # (kind, code, name) for every searchable record
+        self.entries = (
+            [(PROFESSOR, code, name) for code, name in Professor.objects.values_list('professor_code', 'name')]
+            + [(MODULE, code, name) for code, name in Module.objects.values_list('code', 'name')]
+        )
+
+        terms = []
+        self.postings = {}
+        for position, (kind, code, name) in enumerate(self.entries):
+            for term in {code.lower(), name.lower(), *name.lower().split()}:
+                terms.append((term, position))
+            for text in (code.lower(), name.lower()):
+                for n in (2, 3):
+                    for gram in ngrams(text, n):
+                        self.postings.setdefault(gram, set()).add(position)
+
+        terms.sort()
+        self.terms = [term for term, position in terms]
+        self.termPositions = [position for term, position in terms]
+
+    # Yields lazily, so a short common prefix stops at the result limit
+    def prefixMatches(self, query):
+        start = bisect.bisect_left(self.terms, query)
+        for i in range(start, len(self.terms)):
+            if not self.terms[i].startswith(query):
+                return
+            yield self.termPositions[i]
+
+    # Also lazy: the postings are only intersected once the prefix matches
+    # run out, and candidates are only checked until the limit is reached
+    def substringMatches(self, query):
+        if len(query) < 2:
+            return
+
+        # Every bigram (for two letter queries) or trigram of the query
+        # must appear in a matching record
+        n = 2 if len(query) == 2 else 3
+        postings = sorted((self.postings.get(gram, set()) for gram in ngrams(query, n)), key=len)
+        candidates = set.intersection(*postings) if postings else set()
+
+        for position in sorted(candidates):
+            kind, code, name = self.entries[position]
+            if query in code.lower() or query in name.lower():
+                yield position
+
+    # Prefix matches first, then the remaining substring matches
+    def search(self, query, limit):
+        query = query.strip().lower()
+        seen = set()
+        results = []
+
+        for position in itertools.chain(self.prefixMatches(query), self.substringMatches(query)):
+            if position in seen:
+                continue
+            seen.add(position)
+            results.append(self.entries[position])
+            if len(results) >= limit:
+                break
+
+        return results
+
+
+_index = None
+_indexLock = threading.Lock()
+
+
+# The index is rebuilt when the catalogue generation moves on
+def searchIndex():
+    global _index
+
+    generation = caching.currentGeneration(caching.CATALOGUE)
+    index = _index
+    if index is not None and index.generation == generation:
+        return index
+
+    with _indexLock:
+        if _index is None or _index.generation != generation:
+            _index = SearchIndex(generation)
+        return _index
@@ -0,0 +1,184 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from . import caching, changefeed, readmodels
+from .models import Module, ModuleInstance, Professor, Rating
+
+
+#-------------------------------------------------------------------------
+# Module instance catalogue
+# Rewrites the read model entries touched by a catalogue write. These are
+# connected before the cache receivers below, so a body rebuilt after the
+# generation bump always reads the updated catalogue.
+#-------------------------------------------------------------------------
+def moduleInstanceSaved(sender, instance, **kwargs):
+    readmodels.refreshCatalogue([instance.pk])
+
+
+def moduleSaved(sender, instance, **kwargs):
+    readmodels.refreshCatalogue(instance.moduleinstance_set.values_list('id', flat=True))
+
+
+def professorSaved(sender, instance, **kwargs):
+    readmodels.refreshCatalogue(instance.moduleinstance_set.values_list('id', flat=True))
+
+
+# Deleting a professor drops its assignment rows without an m2m_changed
+# signal, so remember which instances it taught and refresh them afterwards
+def professorDeleting(sender, instance, **kwargs):
+    instance._taughtInstanceIds = list(instance.moduleinstance_set.values_list('id', flat=True))
+
+
+def professorDeleted(sender, instance, **kwargs):
+    readmodels.refreshCatalogue(getattr(instance, '_taughtInstanceIds', []))
+
+
+def assignmentsChangedCatalogue(sender, instance, action, reverse, pk_set, **kwargs):
+    # Forward changes (instance.professors.add) touch one module instance,
+    # reverse changes (professor.moduleinstance_set.add) touch those in pk_set
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            readmodels.refreshCatalogue([instance.pk])
+    elif action == 'pre_clear':
+        instance._clearedInstanceIds = list(instance.moduleinstance_set.values_list('id', flat=True))
+    elif action == 'post_clear':
+        readmodels.refreshCatalogue(getattr(instance, '_clearedInstanceIds', []))
+    elif action in ('post_add', 'post_remove'):
+        readmodels.refreshCatalogue(pk_set)
+
+
+post_save.connect(moduleInstanceSaved, sender=ModuleInstance, dispatch_uid='catalogue.moduleInstanceSaved')
+post_save.connect(moduleSaved, sender=Module, dispatch_uid='catalogue.moduleSaved')
+post_save.connect(professorSaved, sender=Professor, dispatch_uid='catalogue.professorSaved')
+pre_delete.connect(professorDeleting, sender=Professor, dispatch_uid='catalogue.professorDeleting')
+post_delete.connect(professorDeleted, sender=Professor, dispatch_uid='catalogue.professorDeleted')
+m2m_changed.connect(assignmentsChangedCatalogue, sender=ModuleInstance.professors.through, dispatch_uid='catalogue.assignmentsChanged')
+
+
+#-------------------------------------------------------------------------
+# Rating aggregates
+# A save or delete moves the contribution of the row as stored, read just
+# before the write in the same transaction, rather than of the values the
+# instance was loaded with, which another write may since have changed.
+# Bulk writes and raw SQL skip these receivers; rebuildaggregates repairs
+# the aggregates afterwards.
+#-------------------------------------------------------------------------
+AGGREGATED_FIELDS = ('professor_id', 'module_instance_id', 'rating')
+
+
+def storedRating(instance, using):
+    if instance.pk is None:
+        return None
+    return (Rating.objects.using(using)
+            .select_for_update()
+            .filter(pk=instance.pk)
+            .values_list(*AGGREGATED_FIELDS)
+            .first()
+    )
+
+
+def ratingSaving(sender, instance, using, **kwargs):
+    instance._aggregatedAs = storedRating(instance, using)
+
+
+def ratingSaved(sender, instance, created, **kwargs):
+    values = (instance.professor_id, instance.module_instance_id, instance.rating)
+    previous = getattr(instance, '_aggregatedAs', None)
+
+    if previous is None:
+        readmodels.applyRating(*values, 1)
+    elif previous != values:
+        readmodels.applyRating(*previous, -1)
+        readmodels.applyRating(*values, 1)
+
+
+def ratingDeleting(sender, instance, using, **kwargs):
+    instance._aggregatedAs = storedRating(instance, using)
+
+
+def ratingDeleted(sender, instance, **kwargs):
+    # Nothing to take back if the row was already gone
+    previous = getattr(instance, '_aggregatedAs', None)
+    if previous is not None:
+        readmodels.applyRating(*previous, -1)
+
+
+pre_save.connect(ratingSaving, sender=Rating, dispatch_uid='aggregates.ratingSaving')
+post_save.connect(ratingSaved, sender=Rating, dispatch_uid='aggregates.ratingSaved')
+pre_delete.connect(ratingDeleting, sender=Rating, dispatch_uid='aggregates.ratingDeleting')
+post_delete.connect(ratingDeleted, sender=Rating, dispatch_uid='aggregates.ratingDeleted')
+
+
+#-------------------------------------------------------------------------
+# Change feed
+# Appends every catalogue and rating write to the change log. Assignment
+# rows are removed without signals when either side is deleted, so those
+# deletions are captured in pre_delete.
+#-------------------------------------------------------------------------
+def recordSaved(sender, instance, created, **kwargs):
+    changefeed.recordSaved(instance, created)
+
+
+def recordDeleted(sender, instance, **kwargs):
+    changefeed.recordDeleted(instance)
+
+
+def recordAssignmentsDeleting(sender, instance, **kwargs):
+    if sender is ModuleInstance:
+        pairs = [(instance.pk, professorId) for professorId in instance.professors.values_list('id', flat=True)]
+    else:
+        pairs = [(instanceId, instance.pk) for instanceId in instance.moduleinstance_set.values_list('id', flat=True)]
+    changefeed.recordAssignments(pairs, 'delete')
+
+
+# Pairs are (module instance id, professor id) whichever side changed
+def assignmentPairs(instance, reverse, ids):
+    if reverse:
+        return [(instanceId, instance.pk) for instanceId in ids]
+    return [(instance.pk, professorId) for professorId in ids]
+
+
+def recordAssignmentsChanged(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add':
+        changefeed.recordAssignments(assignmentPairs(instance, reverse, pk_set), 'insert')
+    elif action == 'post_remove':
+        changefeed.recordAssignments(assignmentPairs(instance, reverse, pk_set), 'delete')
+    elif action == 'pre_clear':
+        related = instance.moduleinstance_set if reverse else instance.professors
+        changefeed.recordAssignments(assignmentPairs(instance, reverse, related.values_list('id', flat=True)), 'delete')
+
+
+for model in (Module, Professor, ModuleInstance, Rating):
+    post_save.connect(recordSaved, sender=model, dispatch_uid='changefeed.saved.%s' % model.__name__)
+    post_delete.connect(recordDeleted, sender=model, dispatch_uid='changefeed.deleted.%s' % model.__name__)
+
+for model in (Professor, ModuleInstance):
+    pre_delete.connect(recordAssignmentsDeleting, sender=model, dispatch_uid='changefeed.assignmentsDeleting.%s' % model.__name__)
+
+m2m_changed.connect(recordAssignmentsChanged, sender=ModuleInstance.professors.through, dispatch_uid='changefeed.assignmentsChanged')
+
+
+#-------------------------------------------------------------------------
+# Cache invalidation
+# Any write to the catalogue or to ratings moves the matching generation
+# on, which retires every cached value built from the old data.
+#-------------------------------------------------------------------------
+def catalogueChanged(sender, **kwargs):
+    caching.bumpGeneration(caching.CATALOGUE)
+
+
+def ratingsChanged(sender, **kwargs):
+    caching.bumpGeneration(caching.RATINGS)
+
+
+def assignmentsChanged(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        caching.bumpGeneration(caching.CATALOGUE)
+
+
+for model in (Module, Professor, ModuleInstance):
+    post_save.connect(catalogueChanged, sender=model, dispatch_uid='catalogueChanged.%s' % model.__name__)
+    post_delete.connect(catalogueChanged, sender=model, dispatch_uid='catalogueDeleted.%s' % model.__name__)
+
+post_save.connect(ratingsChanged, sender=Rating, dispatch_uid='ratingsChanged')
+post_delete.connect(ratingsChanged, sender=Rating, dispatch_uid='ratingsDeleted')
+
+m2m_changed.connect(assignmentsChanged, sender=ModuleInstance.professors.through, dispatch_uid='assignmentsChanged')
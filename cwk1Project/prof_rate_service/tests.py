@@ -1,3 +1,1492 @@
-from django.test import TestCase
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+from django.contrib.auth.models import Group, User
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, connections
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from . import readmodels
+from datetime import timedelta
+from . import analytics, cache_backends, caching, changefeed, logutils, metrics, partitions, search, throttling, views, warmup
+from .cache_backends import SQLiteCache
+from .management.commands.analytics import ormStatistics
+from .routers import RatingPartitionRouter
+from .models import ChangeLogEntry, Module, ModuleInstance, ModuleInstanceCatalogue, Professor, Rating, RatingAggregate
 
-# Create your tests here.
+
+# Every test gets a private, empty cache so it measures the real queries
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+# Adds a SQLite database alias for the rest of the test, as settings.py
+# adds one for each archived year
+def addDatabase(test, alias, name):
+    configured = connections.configure_settings({
+        'default': connections.settings['default'],
+        alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name},
+    })
+    connections.settings[alias] = configured[alias]
+
+    def remove():
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+    test.addCleanup(remove)
+    test.enterContext(mock.patch.object(type(test), 'databases', test.databases | {alias}))
+
+
+#-------------------------------------------------------------------------
+# Dataset sizes used by the regression tests:
+# (modules, professors, users), with two instances per module, two
+# professors per instance and each user rating every professor they can
+#-------------------------------------------------------------------------
+DATASET_SIZES = {
+    'small': (2, 3, 2),
+    'medium': (10, 8, 5),
+    'large': (40, 20, 10),
+}
+
+BENCHMARK_SIZE = (150, 60, 40)
+
+
+def seedDataset(moduleCount, professorCount, userCount):
+    Group.objects.get_or_create(name='Student')
+
+    modules = Module.objects.bulk_create(
+        Module(code='M%03d' % i, name='Module %d' % i) for i in range(moduleCount)
+    )
+    professors = Professor.objects.bulk_create(
+        Professor(professor_code='P%03d' % i, name='Professor %d' % i) for i in range(professorCount)
+    )
+    instances = ModuleInstance.objects.bulk_create(
+        ModuleInstance(module=module, academic_year=2023 + year, semester=1 + year)
+        for module in modules for year in range(2)
+    )
+
+    Assignment = ModuleInstance.professors.through
+    assignments = [
+        Assignment(moduleinstance_id=instance.id, professor_id=professors[(i + offset) % professorCount].id)
+        for i, instance in enumerate(instances) for offset in range(2)
+    ]
+    Assignment.objects.bulk_create(assignments)
+
+    users = User.objects.bulk_create(
+        User(username='user%d' % i, email='user%d@example.com' % i) for i in range(userCount)
+    )
+    Rating.objects.bulk_create(
+        Rating(user=user, module_instance_id=a.moduleinstance_id, professor_id=a.professor_id, rating=1 + (u + k) % 5)
+        for u, user in enumerate(users) for k, a in enumerate(assignments)
+    )
+
+    # Bulk inserts skip the signals that maintain the read models
+    readmodels.refreshCatalogue(instance.id for instance in instances)
+    readmodels.rebuildAggregates()
+    return users
+
+
+#-------------------------------------------------------------------------
+# Requests exercised against every dataset. Each maps a name to a function
+# of the test case returning the response.
+#-------------------------------------------------------------------------
+def allModuleInstances(test):
+    return test.client.get('/allModuleInstances/')
+
+
+def allProfessorRatings(test):
+    return test.client.get('/allProfessorRatings/')
+
+
+def allModuleInstancesCodes(test):
+    return test.client.get('/allModuleInstances/', {'fields': 'module_code,academic_year,semester'})
+
+
+def allProfessorNames(test):
+    return test.client.get('/allProfessorRatings/', {'fields': 'professor_code,name'})
+
+
+def professorModuleRating(test):
+    return test.client.get('/professorModuleRating/P002/M001/')
+
+
+def rateProfessor(test):
+    test.client.force_login(User.objects.create(username='rater', email='rater@example.com'))
+    return test.client.post('/rateProfessor/', {
+        'professor_code': 'P001', 'module_code': 'M000', 'year': 2024, 'semester': 2, 'rating': 4
+    })
+
+
+def myRatings(test):
+    test.client.force_login(User.objects.get(username='user0'))
+    return test.client.get('/myRatings/', {'limit': 5})
+
+
+def registerUser(test):
+    return test.client.post('/registerUser/', {
+        'new_username': 'newUser', 'new_email': 'new@example.com', 'new_password': 'HelloThere80'
+    })
+
+
+def searchCatalogue(test):
+    return test.client.get('/search/', {'q': 'module 1'})
+
+
+def changeFeed(test):
+    return test.client.get('/changes/', {'since': 0, 'limit': 50})
+
+
+def professorAnalytics(test):
+    return test.client.get('/professorAnalytics/')
+
+
+ENDPOINTS = {
+    'allModuleInstances': (allModuleInstances, 200),
+    'allProfessorRatings': (allProfessorRatings, 200),
+    'allModuleInstancesCodes': (allModuleInstancesCodes, 200),
+    'allProfessorNames': (allProfessorNames, 200),
+    'professorModuleRating': (professorModuleRating, 200),
+    'rateProfessor': (rateProfessor, 201),
+    'myRatings': (myRatings, 200),
+    'registerUser': (registerUser, 201),
+    'searchCatalogue': (searchCatalogue, 200),
+    'changeFeed': (changeFeed, 200),
+    'professorAnalytics': (professorAnalytics, 200),
+}
+
+# Tables each endpoint is expected to read in full. Any other full-table
+# scan in a query plan is a regression.
+ALLOWED_FULL_SCANS = {
+    'allModuleInstances': set(),
+    'allProfessorRatings': {'prof_rate_service_professor'},
+    'allModuleInstancesCodes': set(),
+    'allProfessorNames': {'prof_rate_service_professor'},
+    'professorModuleRating': set(),
+    'rateProfessor': {'prof_rate_service_professor', 'prof_rate_service_moduleinstance'},
+    'myRatings': {'prof_rate_service_professor', 'prof_rate_service_moduleinstance'},
+    'registerUser': set(),
+    'searchCatalogue': {'prof_rate_service_professor', 'prof_rate_service_module'},
+    'changeFeed': set(),
+    'professorAnalytics': {'prof_rate_service_rating'}, # Every rating is loaded on purpose
+}
+
+# Seconds each endpoint may take, with a cold cache, on the benchmark dataset
+RESPONSE_TIME_BUDGETS = {
+    'allModuleInstances': 0.25,
+    'allProfessorRatings': 0.25,
+    'allModuleInstancesCodes': 0.1,
+    'allProfessorNames': 0.1,
+    'professorModuleRating': 0.1,
+    'rateProfessor': 0.25,
+    'myRatings': 0.1,
+    'registerUser': 1.0,
+    'searchCatalogue': 0.1,
+    'changeFeed': 0.1,
+    'professorAnalytics': 0.25,
+}
+
+FULL_SCAN = re.compile(r'^SCAN (\S+)$')
+
+
+def capture(test, name):
+    request, status = ENDPOINTS[name]
+    cache.clear()
+    throttling.reset()
+    with CaptureQueriesContext(connection) as queries:
+        response = request(test)
+    test.assertEqual(response.status_code, status, '%s returned %s' % (name, response.content))
+    return [query['sql'] for query in queries.captured_queries]
+
+
+def fullScans(sql):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        details = [row[3] for row in cursor.fetchall()]
+    return {match.group(1) for match in map(FULL_SCAN.match, details) if match}
+
+
+#-------------------------------------------------------------------------
+# Query count must not grow with the data
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class QueryCountTests(TestCase):
+    def queryCounts(self, name):
+        counts = {}
+        for size, dimensions in DATASET_SIZES.items():
+            with self.subTest(size=size):
+                sid = connection.savepoint()
+                seedDataset(*dimensions)
+                counts[size] = len(capture(self, name))
+                connection.savepoint_rollback(sid)
+                self.client.logout()
+        return counts
+
+    def assertConstantQueries(self, name):
+        counts = self.queryCounts(name)
+        self.assertEqual(len(set(counts.values())), 1, '%s query counts grow with data: %s' % (name, counts))
+
+    def test_allModuleInstances(self):
+        self.assertConstantQueries('allModuleInstances')
+
+    def test_allProfessorRatings(self):
+        self.assertConstantQueries('allProfessorRatings')
+
+    def test_allModuleInstancesCodes(self):
+        self.assertConstantQueries('allModuleInstancesCodes')
+
+    def test_allProfessorNames(self):
+        self.assertConstantQueries('allProfessorNames')
+
+    def test_professorModuleRating(self):
+        self.assertConstantQueries('professorModuleRating')
+
+    def test_rateProfessor(self):
+        self.assertConstantQueries('rateProfessor')
+
+    def test_myRatings(self):
+        self.assertConstantQueries('myRatings')
+
+    def test_registerUser(self):
+        self.assertConstantQueries('registerUser')
+
+    def test_searchCatalogue(self):
+        self.assertConstantQueries('searchCatalogue')
+
+    def test_changeFeed(self):
+        self.assertConstantQueries('changeFeed')
+
+    @skipUnless(analytics.available(), 'NumPy is not installed')
+    def test_professorAnalytics(self):
+        self.assertConstantQueries('professorAnalytics')
+
+    def test_cachedReadsSkipTheDatabase(self):
+        seedDataset(*DATASET_SIZES['small'])
+        for name in ('allModuleInstances', 'allProfessorRatings'):
+            capture(self, name)
+            with CaptureQueriesContext(connection) as queries:
+                ENDPOINTS[name][0](self)
+            self.assertEqual(len(queries), 0, '%s hit the database while cached' % name)
+
+
+#-------------------------------------------------------------------------
+# Query plans must not gain full-table scans
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seedDataset(*DATASET_SIZES['medium'])
+
+    def assertNoNewFullScans(self, name):
+        for sql in capture(self, name):
+            if not sql.startswith('SELECT'):
+                continue
+            unexpected = fullScans(sql) - ALLOWED_FULL_SCANS[name]
+            self.assertFalse(unexpected, '%s scans %s in full:\n%s' % (name, ', '.join(sorted(unexpected)), sql))
+
+    def test_allModuleInstances(self):
+        self.assertNoNewFullScans('allModuleInstances')
+
+    def test_allProfessorRatings(self):
+        self.assertNoNewFullScans('allProfessorRatings')
+
+    def test_allModuleInstancesCodes(self):
+        self.assertNoNewFullScans('allModuleInstancesCodes')
+
+    def test_allProfessorNames(self):
+        self.assertNoNewFullScans('allProfessorNames')
+
+    def test_professorModuleRating(self):
+        self.assertNoNewFullScans('professorModuleRating')
+
+    def test_rateProfessor(self):
+        self.assertNoNewFullScans('rateProfessor')
+
+    def test_myRatings(self):
+        self.assertNoNewFullScans('myRatings')
+
+    def test_registerUser(self):
+        self.assertNoNewFullScans('registerUser')
+
+    def test_searchCatalogue(self):
+        self.assertNoNewFullScans('searchCatalogue')
+
+    def test_changeFeed(self):
+        self.assertNoNewFullScans('changeFeed')
+
+    @skipUnless(analytics.available(), 'NumPy is not installed')
+    def test_professorAnalytics(self):
+        self.assertNoNewFullScans('professorAnalytics')
+
+
+#-------------------------------------------------------------------------
+# Response times on the benchmark dataset
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class ResponseTimeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seedDataset(*BENCHMARK_SIZE)
+
+    def test_budgets(self):
+        for name, budget in RESPONSE_TIME_BUDGETS.items():
+            if name == 'professorAnalytics' and not analytics.available():
+                continue
+            with self.subTest(endpoint=name):
+                request, status = ENDPOINTS[name]
+                cache.clear()
+                startedAt = time.perf_counter()
+                response = request(self)
+                elapsed = time.perf_counter() - startedAt
+                self.assertEqual(response.status_code, status)
+                self.assertLess(elapsed, budget, '%s took %.3fs, budget %.3fs' % (name, elapsed, budget))
+
+
+#-------------------------------------------------------------------------
+# Sparse fieldsets on the list endpoints
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class FieldsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seedDataset(*DATASET_SIZES['small'])
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, path, fields):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, {'fields': fields})
+        self.assertEqual(response.status_code, 200)
+        return response.json(), [query['sql'] for query in queries.captured_queries]
+
+    def test_moduleInstances(self):
+        full = self.client.get('/allModuleInstances/').json()['module_instances']
+        body, queries = self.get('/allModuleInstances/', 'semester, module_code')
+        self.assertEqual(body['module_instances'], [{'module_code': m['module_code'], 'semester': m['semester']} for m in full])
+        self.assertNotIn('taught_by', queries[-1])
+
+    def test_professorRatingsWithoutRating(self):
+        full = self.client.get('/allProfessorRatings/').json()['all_professor_ratings']
+        body, queries = self.get('/allProfessorRatings/', 'professor_code')
+        self.assertEqual(body['all_professor_ratings'], [{'professor_code': p['professor_code']} for p in full])
+        self.assertFalse(any('prof_rate_service_ratingaggregate' in sql for sql in queries))
+
+        # Without the rating, new ratings leave the cached body in place
+        caching.bumpGeneration(caching.RATINGS)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/allProfessorRatings/', {'fields': 'professor_code'})
+        self.assertEqual(len(queries), 0)
+
+    def test_invalidFields(self):
+        for fields in ('professor_code,email', ' , '):
+            response = self.client.get('/allProfessorRatings/', {'fields': fields})
+            self.assertEqual(response.status_code, 400)
+        self.assertIn('module_code', self.client.get('/allModuleInstances/', {'fields': 'x'}).json()['error'])
+
+
+#-------------------------------------------------------------------------
+# Module instance catalogue read model
+# Every change goes through the ORM, so the signal receivers keep the read
+# model up to date and the cached allModuleInstances body is rebuilt.
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class CatalogueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.m1 = Module.objects.create(code='CD1', name='Computing for "Dummies"')
+        self.m2 = Module.objects.create(code='PG1', name='Programming \\ naïve')
+        self.p1 = Professor.objects.create(professor_code='VS1', name='Professor V. Smart')
+        self.p2 = Professor.objects.create(professor_code='JE1', name='Professor J. Excellent')
+        self.p3 = Professor.objects.create(professor_code='TT1', name='Professor T. Terrible')
+        self.i1 = ModuleInstance.objects.create(module=self.m1, academic_year=2024, semester=1)
+        self.i2 = ModuleInstance.objects.create(module=self.m1, academic_year=2024, semester=2)
+        self.i3 = ModuleInstance.objects.create(module=self.m2, academic_year=2025, semester=1)
+        self.i1.professors.add(self.p1, self.p2)
+        self.i2.professors.add(self.p2)
+        self.i3.professors.add(self.p3)
+
+    # allModuleInstances as built straight from the normalized tables
+    def expectedPayload(self):
+        return {'module_instances': [
+            {
+                'module_code': instance.module.code,
+                'module_name': instance.module.name,
+                'academic_year': instance.academic_year,
+                'semester': instance.semester,
+                'taught_by': [
+                    {'professor_code': professor.professor_code, 'professor_name': professor.name}
+                    for professor in instance.professors.order_by('id')
+                ],
+            }
+            for instance in ModuleInstance.objects.select_related('module').order_by('module__code', 'academic_year', 'semester')
+        ]}
+
+    def assertCatalogueMatches(self):
+        self.assertEqual(readmodels.findCatalogueMismatches(), [])
+
+        response = self.client.get('/allModuleInstances/')
+        self.assertEqual(response.status_code, 200)
+        expected = self.expectedPayload()
+        self.assertEqual(response.json(), expected)
+
+        response = self.client.get('/allModuleInstances/', {'fields': 'module_name,semester'})
+        self.assertEqual(response.json(), {'module_instances': [
+            {'module_name': item['module_name'], 'semester': item['semester']} for item in expected['module_instances']
+        ]})
+
+    def test_created(self):
+        self.assertCatalogueMatches()
+
+    def test_moduleRenamed(self):
+        self.assertCatalogueMatches()
+        self.m1.name = 'Computing for Experts'
+        self.m1.save()
+        self.assertCatalogueMatches()
+
+    def test_professorRenamed(self):
+        self.assertCatalogueMatches()
+        self.p2.name = 'Professor J. Adequate'
+        self.p2.save()
+        self.assertCatalogueMatches()
+
+    def test_instanceChanged(self):
+        self.i2.academic_year = 2023
+        self.i2.save()
+        self.assertCatalogueMatches()
+
+    def test_forwardAssignmentChanges(self):
+        self.i1.professors.add(self.p3)
+        self.assertCatalogueMatches()
+        self.i1.professors.remove(self.p1)
+        self.assertCatalogueMatches()
+        self.i1.professors.clear()
+        self.assertCatalogueMatches()
+
+    def test_reverseAssignmentChanges(self):
+        self.p3.moduleinstance_set.add(self.i1, self.i2)
+        self.assertCatalogueMatches()
+        self.p3.moduleinstance_set.remove(self.i1)
+        self.assertCatalogueMatches()
+        self.p2.moduleinstance_set.clear()
+        self.assertCatalogueMatches()
+
+    def test_professorDeleted(self):
+        self.p2.delete()
+        self.assertCatalogueMatches()
+
+    def test_moduleDeletionCascades(self):
+        self.m1.delete()
+        self.assertCatalogueMatches()
+        self.assertEqual(ModuleInstanceCatalogue.objects.count(), 1)
+
+    def test_checkAndRepair(self):
+        self.assertCatalogueMatches()
+        out = StringIO()
+        call_command('checkcatalogue', stdout=out)
+        self.assertIn('Catalogue is consistent.', out.getvalue())
+
+        # Queryset writes skip the signals, leaving the read model behind
+        Module.objects.filter(pk=self.m2.pk).update(name='Renamed quietly')
+        ModuleInstanceCatalogue.objects.filter(module_instance=self.i2).delete()
+        with self.assertRaises(CommandError):
+            call_command('checkcatalogue', stdout=StringIO())
+
+        out = StringIO()
+        call_command('checkcatalogue', '--repair', stdout=out)
+        self.assertIn('Repaired 2 entries.', out.getvalue())
+        self.assertCatalogueMatches()
+
+
+#-------------------------------------------------------------------------
+# Change feed
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.module = Module.objects.create(code='CD1', name='Computing for Dummies')
+        self.professor = Professor.objects.create(professor_code='VS1', name='Professor V. Smart')
+        self.instance = ModuleInstance.objects.create(module=self.module, academic_year=2024, semester=1)
+        self.instance.professors.add(self.professor)
+        self.user = User.objects.create(username='student')
+
+    def changes(self, since=0, limit=100):
+        response = self.client.get('/changes/', {'since': since, 'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_recordsCatalogueAndRatingChanges(self):
+        rating = Rating.objects.create(user=self.user, module_instance=self.instance, professor=self.professor, rating=3)
+        rating.rating = 5
+        rating.save()
+        rating.delete()
+
+        ops = [(c['entity'], c['op']) for c in self.changes()['changes']]
+        self.assertEqual(ops, [
+            ('module', 'insert'), ('professor', 'insert'), ('module_instance', 'insert'), ('assignment', 'insert'),
+            ('rating', 'insert'), ('rating', 'update'), ('rating', 'delete'),
+        ])
+
+    def test_assignmentDeletionsAreRecorded(self):
+        cursor = self.changes()['next_cursor']
+        key = '%s:%s' % (self.instance.id, self.professor.id)
+        self.professor.delete()
+
+        changes = self.changes(cursor)['changes']
+        self.assertIn(('assignment', key, 'delete'),
+                      [(c['entity'], c['key'], c['op']) for c in changes])
+
+    def test_pagination(self):
+        first = self.changes(limit=3)
+        self.assertEqual(len(first['changes']), 3)
+        self.assertTrue(first['has_more'])
+
+        rest = self.changes(first['next_cursor'])
+        self.assertEqual(len(rest['changes']), 1)
+        self.assertFalse(rest['has_more'])
+
+    def test_compaction(self):
+        self.professor.name = 'Professor V. Smarter'
+        self.professor.save()
+        cursor = self.changes()['next_cursor']
+        self.module.delete()
+        ChangeLogEntry.objects.filter(operation='delete').update(created=ChangeLogEntry.objects.first().created - timedelta(days=60))
+
+        superseded, tombstones = changefeed.compact(timedelta(days=30))
+        self.assertEqual((superseded, tombstones), (4, 3))
+        self.assertEqual(self.client.get('/changes/', {'since': cursor}).status_code, 410)
+
+        # Starting over from 0 still gives the current state
+        self.assertEqual([(c['entity'], c['op'], c['data']) for c in self.changes()['changes']], [
+            ('professor', 'update', {'professor_code': 'VS1', 'name': 'Professor V. Smarter'}),
+        ])
+
+
+#-------------------------------------------------------------------------
+# Rating aggregates
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        module = Module.objects.create(code='CD1', name='Computing for Dummies')
+        self.professor = Professor.objects.create(professor_code='VS1', name='Professor V. Smart')
+        self.instance = ModuleInstance.objects.create(module=module, academic_year=2024, semester=1)
+        self.instance.professors.add(self.professor)
+        self.users = [User.objects.create(username='student%d' % i) for i in range(3)]
+
+    def rate(self, user, rating):
+        return Rating.objects.create(user=user, module_instance=self.instance, professor=self.professor, rating=rating)
+
+    def aggregate(self):
+        return readmodels.storedAggregates().get((self.professor.id, self.instance.id))
+
+    def test_signalsKeepAggregatesInStep(self):
+        ratings = [self.rate(user, rating) for user, rating in zip(self.users, (4, 5, 2))]
+        self.assertEqual(self.aggregate(), [3, 11, 0, 1, 0, 1, 1])
+
+        ratings[1].rating = 1
+        ratings[1].save()
+        self.assertEqual(self.aggregate(), [3, 7, 1, 1, 0, 1, 0])
+
+        Rating.objects.get(pk=ratings[0].pk).delete()
+        self.assertEqual(self.aggregate(), [2, 3, 1, 1, 0, 0, 0])
+
+        self.professor.delete()
+        self.assertFalse(RatingAggregate.objects.exists())
+
+    def test_staleInstances(self):
+        rating = self.rate(self.users[0], 3)
+        other = Rating.objects.get(pk=rating.pk)
+        other.rating = 5
+        other.save()
+
+        # Saving the stale instance moves the stored 5, not the loaded 3
+        rating.rating = 1
+        rating.save()
+        self.assertEqual(self.aggregate(), [1, 1, 1, 0, 0, 0, 0])
+
+        other.delete()
+        self.assertEqual(self.aggregate(), [0, 0, 0, 0, 0, 0, 0])
+
+        # Deleting a row that is already gone takes nothing back
+        rating.delete()
+        self.assertEqual(self.aggregate(), [0, 0, 0, 0, 0, 0, 0])
+
+    def test_failedAggregateUpdateUndoesSave(self):
+        rating = self.rate(self.users[0], 3)
+        rating.rating = 4
+        with mock.patch.object(readmodels, 'applyRating', side_effect=DatabaseError('disk I/O error')):
+            with self.assertRaises(DatabaseError):
+                rating.save()
+        self.assertEqual(Rating.objects.get(pk=rating.pk).rating, 3)
+        self.assertEqual(self.aggregate(), [1, 3, 0, 0, 1, 0, 0])
+
+    def test_rebuildRepairsDrift(self):
+        for user, rating in zip(self.users, (4, 5, 2)):
+            self.rate(user, rating)
+        RatingAggregate.objects.update(count=1, rated_4=0)
+
+        tallies, read = readmodels.tallyRatings(self.professor.id, self.professor.id)
+        mismatches = readmodels.findAggregateMismatches(tallies, readmodels.storedAggregates())
+        self.assertEqual((read, len(mismatches)), (3, 1))
+
+        readmodels.writeAggregates(mismatches)
+        self.assertEqual(self.aggregate(), [3, 11, 0, 1, 0, 1, 1])
+        self.assertEqual(readmodels.findAggregateMismatches(tallies, readmodels.storedAggregates()), [])
+
+
+#-------------------------------------------------------------------------
+# Rating upserts through rateProfessor
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class RatingUpsertTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        module = Module.objects.create(code='CD1', name='Computing for Dummies')
+        self.professor = Professor.objects.create(professor_code='VS1', name='Professor V. Smart')
+        Professor.objects.create(professor_code='JE1', name='Professor J. Excellent')
+        self.instance = ModuleInstance.objects.create(module=module, academic_year=2024, semester=1)
+        self.instance.professors.add(self.professor)
+        self.client.force_login(User.objects.create(username='student'))
+
+    def rate(self, rating, professorCode='VS1'):
+        return self.client.post('/rateProfessor/', {
+            'professor_code': professorCode, 'module_code': 'CD1', 'year': 2024, 'semester': 1, 'rating': rating
+        })
+
+    def aggregate(self):
+        return readmodels.storedAggregates().get((self.professor.id, self.instance.id))
+
+    def test_createsThenUpdates(self):
+        response = self.rate(4)
+        self.assertEqual((response.status_code, response.json()['created']), (201, True))
+        self.assertEqual(self.aggregate(), [1, 4, 0, 0, 0, 1, 0])
+
+        response = self.rate(2)
+        self.assertEqual((response.status_code, response.json()['created']), (200, False))
+        self.assertEqual(Rating.objects.get().rating, 2)
+        self.assertEqual(self.aggregate(), [1, 2, 0, 1, 0, 0, 0])
+
+        changes = [(c.entity, c.operation, c.data) for c in ChangeLogEntry.objects.filter(entity='rating').order_by('id')]
+        self.assertEqual([(entity, operation, data['rating']) for entity, operation, data in changes], [
+            ('rating', 'insert', 4), ('rating', 'update', 2),
+        ])
+
+    def test_updateIsASingleWrite(self):
+        self.rate(4)
+        with CaptureQueriesContext(connection) as queries:
+            self.rate(5)
+        writes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('INSERT INTO "prof_rate_service_rating"')]
+        self.assertEqual(len(writes), 1)
+        self.assertIn('ON CONFLICT', writes[0])
+
+    def test_unchangedRatingWritesNothing(self):
+        self.rate(3)
+        entries = ChangeLogEntry.objects.count()
+        self.assertEqual(self.rate(3).status_code, 200)
+        self.assertEqual(ChangeLogEntry.objects.count(), entries)
+        self.assertEqual(self.aggregate(), [1, 3, 0, 0, 1, 0, 0])
+
+    def test_professorMustTeachTheInstance(self):
+        response = self.rate(3, 'JE1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'The selected professor does not teach this module instance.')
+        self.assertFalse(Rating.objects.exists())
+
+    def test_updatesAreServedStraightAway(self):
+        self.rate(1)
+        self.assertEqual(self.client.get('/allProfessorRatings/').json()['all_professor_ratings'][0]['rating'], 1)
+        self.rate(5)
+        self.assertEqual(self.client.get('/allProfessorRatings/').json()['all_professor_ratings'][0]['rating'], 5)
+
+
+#-------------------------------------------------------------------------
+# Rating history
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class MyRatingsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seedDataset(*DATASET_SIZES['medium'])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.users[1])
+
+    def page(self, **params):
+        response = self.client.get('/myRatings/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pagesThroughOwnRatings(self):
+        expected = list(Rating.objects.filter(user=self.users[1]).order_by('-id').values_list('id', 'rating'))
+        seen = []
+        page = self.page(limit=7)
+        while True:
+            seen += [(entry['id'], entry['rating']) for entry in page['ratings']]
+            if page['next_cursor'] is None:
+                break
+            page = self.page(limit=7, before=page['next_cursor'])
+        self.assertEqual(seen, expected)
+
+    def test_details(self):
+        rating = Rating.objects.filter(user=self.users[1]).select_related('module_instance__module', 'professor').latest('id')
+        [entry] = self.page(limit=1)['ratings']
+        self.assertEqual(entry, {
+            'id': rating.id,
+            'module_code': rating.module_instance.module.code,
+            'module_name': rating.module_instance.module.name,
+            'academic_year': rating.module_instance.academic_year,
+            'semester': rating.module_instance.semester,
+            'professor_code': rating.professor.professor_code,
+            'professor_name': rating.professor.name,
+            'rating': rating.rating,
+        })
+
+    def test_usesTheHistoryIndex(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.page(before=10**9)
+        [sql] = [query['sql'] for query in queries.captured_queries if 'prof_rate_service_rating' in query['sql']]
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = ' '.join(row[3] for row in cursor.fetchall())
+        self.assertIn('COVERING INDEX rating_user_history', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_loginAndParameters(self):
+        self.assertEqual(self.client.get('/myRatings/', {'before': 'x'}).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get('/myRatings/').status_code, 302)
+
+
+#-------------------------------------------------------------------------
+# Professor analytics
+#-------------------------------------------------------------------------
+@skipUnless(analytics.available(), 'NumPy is not installed')
+@override_settings(CACHES=TEST_CACHES)
+class AnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seedDataset(*DATASET_SIZES['medium'])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_matchesOrmAggregation(self):
+        vectorized, vectorizedMean = analytics.professorStatistics(analytics.loadRatingMatrix())
+        orm, ormMean = ormStatistics()
+
+        self.assertAlmostEqual(vectorizedMean, ormMean)
+        self.assertEqual(vectorized.keys(), orm.keys())
+        for professorId, statistics in orm.items():
+            for key, value in statistics.items():
+                self.assertAlmostEqual(vectorized[professorId][key], value, msg='%s of professor %s' % (key, professorId))
+
+    def test_rankings(self):
+        response = self.client.get('/professorAnalytics/').json()
+        rankings = response['professor_rankings']
+
+        self.assertEqual(response['ratings'], Rating.objects.count())
+        self.assertEqual([entry['rank'] for entry in rankings], list(range(1, len(rankings) + 1)))
+        self.assertEqual(rankings, sorted(rankings, key=lambda entry: -entry['adjusted_mean']))
+        for entry in rankings:
+            self.assertLessEqual(entry['ci_low'], entry['adjusted_mean'])
+            self.assertGreaterEqual(entry['ci_high'], entry['adjusted_mean'])
+
+    def test_cachedUntilRatingsChange(self):
+        first = self.client.get('/professorAnalytics/').json()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/professorAnalytics/')
+        self.assertEqual(len(queries), 0)
+
+        Rating.objects.filter(rating__gt=1).first().delete()
+        self.assertEqual(self.client.get('/professorAnalytics/').json()['ratings'], first['ratings'] - 1)
+
+
+#-------------------------------------------------------------------------
+# Request profiling
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES, PROF_RATE_PROFILE_TOKEN='let-me-profile', PROF_RATE_PROFILE_KEEP=2)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(PROF_RATE_PROFILE_DIR=directory.name))
+        cache.clear()
+        seedDataset(*DATASET_SIZES['small'])
+        self.staff = User.objects.create(username='staff', is_staff=True)
+
+    def profiles(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/profiles/')
+        self.client.logout()
+        return response.json()['profiles']
+
+    def test_profilesRequestsWithTheToken(self):
+        response = self.client.get('/allModuleInstances/', HTTP_X_PROFILE_TOKEN='let-me-profile')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['module_instances']), 4)
+
+        [summary] = self.profiles()
+        self.assertEqual((summary['view'], summary['status'], summary['trigger']), ('allModuleInstances', 200, 'token'))
+
+        self.client.force_login(self.staff)
+        profile = self.client.get('/profiles/%s/' % summary['id']).json()['profile']
+        self.assertEqual(len(profile['queries']), summary['query_count'])
+        self.assertTrue(any('buildModuleInstances' in entry['function'] for entry in profile['functions']))
+
+    def test_ignoresOtherRequests(self):
+        self.client.get('/allModuleInstances/')
+        self.client.get('/allModuleInstances/', HTTP_X_PROFILE_TOKEN='guess')
+        self.assertEqual(self.profiles(), [])
+
+    def test_sampledViewsAndRing(self):
+        with override_settings(PROF_RATE_PROFILE_SAMPLE_RATES={'professorModuleRating': 1.0}):
+            for i in range(3):
+                self.client.get('/professorModuleRating/P002/M001/')
+            self.client.get('/allProfessorRatings/')
+
+        profiles = self.profiles()
+        self.assertEqual([(p['view'], p['trigger']) for p in profiles], [('professorModuleRating', 'sample')] * 2)
+
+    def test_unopenedDatabasesLeftAlone(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        addDatabase(self, 'unopened', os.path.join(directory.name, 'unopened.sqlite3'))
+
+        self.client.get('/allModuleInstances/', HTTP_X_PROFILE_TOKEN='let-me-profile')
+        self.assertIsNone(connections['unopened'].connection)
+        self.assertEqual(len(self.profiles()), 1)
+
+    @override_settings(PROF_RATE_THROTTLE_RATES={})
+    def test_authQueriesRedacted(self):
+        response = self.client.post('/registerUser/', {
+            'new_username': 'profiled', 'new_email': 'profiled@example.com', 'new_password': 'HelloThere80'
+        }, HTTP_X_PROFILE_TOKEN='let-me-profile')
+        self.assertEqual(response.status_code, 201)
+
+        [summary] = self.profiles()
+        self.client.force_login(self.staff)
+        queries = self.client.get('/profiles/%s/' % summary['id']).json()['profile']['queries']
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertIn("'<redacted>'", sql)
+        for secret in ('profiled', User.objects.get(username='profiled').password):
+            self.assertNotIn(secret, sql)
+
+    @override_settings(PROF_RATE_THROTTLE_RATES={})
+    def test_sessionKeysRedacted(self):
+        self.client.force_login(User.objects.create(username='student'))
+        sessionKey = self.client.session.session_key
+        response = self.client.post('/rateProfessor/', {
+            'professor_code': 'P001', 'module_code': 'M000', 'year': 2024, 'semester': 2, 'rating': 3
+        }, HTTP_X_PROFILE_TOKEN='let-me-profile')
+        self.assertEqual(response.status_code, 201)
+
+        [summary] = self.profiles()
+        self.client.force_login(self.staff)
+        profile = self.client.get('/profiles/%s/' % summary['id']).json()['profile']
+        self.assertTrue(any('django_session' in query['sql'] for query in profile['queries']))
+        self.assertNotIn(sessionKey, json.dumps(profile))
+
+    def test_staffOnly(self):
+        self.client.force_login(User.objects.create(username='student'))
+        self.assertEqual(self.client.get('/profiles/').status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get('/profiles/../settings/').status_code, 404)
+
+
+#-------------------------------------------------------------------------
+# Shared SQLite cache backend
+#-------------------------------------------------------------------------
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.sqlite3')
+
+    def backend(self, maxBytes=1024 * 1024):
+        return SQLiteCache(self.path, {'OPTIONS': {'MAX_BYTES': maxBytes}})
+
+    def usage(self, backend):
+        return backend._connection().execute('SELECT bytes FROM cache_usage WHERE id = 1').fetchone()[0]
+
+    def inThreads(self, count, target):
+        threads = [threading.Thread(target=target) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_entriesExpire(self):
+        backend = self.backend()
+        backend.set('short', 1, 0.05)
+        backend.set('forever', 2, None)
+        backend.set('default', 3)
+        self.assertEqual(backend.get('short'), 1)
+
+        time.sleep(0.1)
+        self.assertIsNone(backend.get('short'))
+        self.assertEqual(backend.get('forever'), 2)
+        self.assertEqual(backend.get('default'), 3)
+        self.assertIsNone(backend._connection().execute("SELECT expires FROM cache_entry WHERE key = ?", (backend.make_key('forever'),)).fetchone()[0])
+
+    def test_zeroTimeoutIsNotStored(self):
+        backend = self.backend()
+        backend.set('gone', 1)
+        backend.set('gone', 2, 0)
+        backend.set('never', 3, 0)
+        self.assertIsNone(backend.get('gone'))
+        self.assertIsNone(backend.get('never'))
+        self.assertEqual(self.usage(backend), 0)
+
+    def test_leastRecentlyUsedEvicted(self):
+        backend = self.backend(maxBytes=2000)
+        with mock.patch.object(cache_backends, 'ACCESS_RESOLUTION', 0):
+            for key in ('a', 'b', 'c'):
+                backend.set(key, b'x' * 500)
+                time.sleep(0.01)
+            backend.get('a')
+            time.sleep(0.01)
+            backend.set('d', b'x' * 500)
+
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual([backend.has_key(key) for key in ('a', 'c', 'd')], [True, True, True])
+        self.assertLessEqual(self.usage(backend), 2000)
+
+    def test_expiredEntriesFreeSpaceFirst(self):
+        backend = self.backend(maxBytes=2000)
+        backend.set('live', b'x' * 500)
+        time.sleep(0.01)
+        backend.set('expired', b'x' * 1000, 0.05)
+        time.sleep(0.1)
+        backend.set('new', b'x' * 600)
+
+        # Dropping the expired entry is enough, so no live entry goes
+        self.assertTrue(backend.has_key('live'))
+        self.assertTrue(backend.has_key('new'))
+
+    def test_concurrentIncrementsAllCount(self):
+        backend = self.backend()
+        backend.set('counter', 0, None)
+
+        def increment():
+            for i in range(50):
+                backend.incr('counter')
+
+        self.inThreads(4, increment)
+        self.assertEqual(backend.get('counter'), 200)
+
+    def test_concurrentAddsOnlyOneWins(self):
+        backend = self.backend()
+        added = []
+        self.inThreads(8, lambda: added.append(backend.add('once', threading.get_ident())))
+        self.assertEqual(added.count(True), 1)
+
+    def test_deleteManyAndClear(self):
+        backend = self.backend()
+        backend.set_many({'a': 1, 'b': 2, 'c': 3})
+        backend.delete_many(['a', 'b'])
+        self.assertEqual(backend.get_many(['a', 'b', 'c']), {'c': 3})
+
+        backend.clear()
+        self.assertIsNone(backend.get('c'))
+        self.assertEqual(self.usage(backend), 0)
+
+
+#-------------------------------------------------------------------------
+# Single-flight response builds
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class CoalescingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.builds = 0
+        self.release = threading.Event()
+
+    def builder(self):
+        self.builds += 1
+        self.release.wait(5)
+        return {'build': self.builds}
+
+    def fetch(self, results):
+        results.append(caching.cachedBody('coalesced', self.builder, [caching.RATINGS]))
+
+    def inThreads(self, count):
+        results = []
+        threads = [threading.Thread(target=self.fetch, args=(results,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def finish(self, threads):
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+    def counter(self, name):
+        return metrics.snapshot().get(name, 0)
+
+    @override_settings(PROF_RATE_CACHE_SERVE_STALE=False)
+    def test_concurrentMissesBuildOnce(self):
+        coalesced = self.counter('cache.coalesced')
+        threads, results = self.inThreads(5)
+        while self.counter('cache.coalesced') - coalesced < 4:
+            time.sleep(0.01)
+        self.finish(threads)
+
+        self.assertEqual(self.builds, 1)
+        self.assertEqual(results, [b'{"build": 1}'] * 5)
+
+    def test_staleServedWhileRebuilding(self):
+        self.release.set()
+        self.fetch([])
+        self.release.clear()
+        caching.bumpGeneration(caching.RATINGS)
+
+        staleServed = self.counter('cache.stale_served')
+        threads, results = self.inThreads(1)
+        while self.builds < 2:
+            time.sleep(0.01)
+        self.fetch(results)
+        self.assertEqual(results, [b'{"build": 1}'])
+        self.assertEqual(self.counter('cache.stale_served'), staleServed + 1)
+
+        self.finish(threads)
+        self.assertEqual(results[1], b'{"build": 2}')
+
+    @skipUnless(caching.fcntl, 'File locks are not available')
+    @override_settings(PROF_RATE_CACHE_SERVE_STALE=False, PROF_RATE_CACHE_BUILD_WAIT=0.1)
+    def test_waitsForOtherProcesses(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.release.set()
+
+        # A lock taken through another open file stands in for another process
+        with override_settings(PROF_RATE_CACHE_LOCK_DIR=directory.name), open(os.path.join(directory.name, 'coalesced.lock'), 'a') as file:
+            caching.fcntl.flock(file, caching.fcntl.LOCK_EX)
+            expired = self.counter('cache.build_wait_expired')
+            self.fetch([])
+            self.assertEqual(self.counter('cache.build_wait_expired'), expired + 1)
+
+            caching.fcntl.flock(file, caching.fcntl.LOCK_UN)
+            caching.bumpGeneration(caching.RATINGS)
+            self.fetch([])
+            self.assertEqual(self.counter('cache.build_wait_expired'), expired + 1)
+        self.assertEqual(self.builds, 2)
+
+
+#-------------------------------------------------------------------------
+# Registration
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class RegistrationTests(TestCase):
+    def setUp(self):
+        throttling.reset()
+        self.student = Group.objects.create(name='Student')
+
+    def register(self, username, email, password='HelloThere80'):
+        response = self.client.post('/registerUser/', {'new_username': username, 'new_email': email, 'new_password': password})
+        return response.status_code, response.json()
+
+    def test_registersStudent(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.register('student', 'student@example.com')[0], 201)
+        self.assertEqual([query['sql'].split()[0] for query in queries.captured_queries], ['SAVEPOINT', 'INSERT', 'INSERT', 'RELEASE'])
+
+        user = User.objects.get(username='student')
+        self.assertTrue(user.check_password('HelloThere80'))
+        self.assertEqual(list(user.groups.all()), [self.student])
+
+    def test_takenUsernameAndEmail(self):
+        self.register('student', 'student@example.com')
+        self.assertEqual(self.register('student', 'other@example.com'), (400, {'error': 'Username already in use. Please use a different username.'}))
+        self.assertEqual(self.register('other', 'student@example.com'), (400, {'error': 'Email already in use. Please register with a different email.'}))
+        self.assertEqual(User.objects.count(), 1)
+
+        # Only emails that were given must be unique
+        self.assertEqual([self.register(username, '')[0] for username in ('first', 'second')], [201, 201])
+
+    def test_missingValuesAndGroup(self):
+        self.assertEqual(self.register('student', 'student@example.com', '')[0], 400)
+        self.student.delete()
+        self.assertEqual(self.register('student', 'student@example.com')[0], 500)
+        self.assertFalse(User.objects.exists())
+
+
+#-------------------------------------------------------------------------
+# Write throttling and admission control
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class ThrottlingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seedDataset(*DATASET_SIZES['small'])
+
+    def setUp(self):
+        cache.clear()
+        throttling.reset()
+
+    def test_bucketsCapped(self):
+        bucket = throttling.TokenBucket(1, 60)
+        with mock.patch.object(throttling, 'MAX_BUCKETS', 10):
+            for i in range(100):
+                self.assertEqual(bucket.take('ip:%d' % i), 0)
+                self.assertLessEqual(len(bucket.buckets), 10)
+
+            # The newest clients are still throttled, the longest idle forgotten
+            self.assertGreater(bucket.take('ip:99'), 0)
+            self.assertNotIn('ip:0', bucket.buckets)
+
+    def rate(self, username, professorCode='P001'):
+        self.client.force_login(User.objects.get_or_create(username=username)[0])
+        return self.client.post('/rateProfessor/', {
+            'professor_code': professorCode, 'module_code': 'M000', 'year': 2024, 'semester': 2, 'rating': 3
+        })
+
+    @override_settings(PROF_RATE_THROTTLE_RATES={'rateProfessor': (2, 60)})
+    def test_throttlesEachUser(self):
+        rejected = metrics.snapshot().get('throttle.rejected.rateProfessor', 0)
+        self.assertEqual([self.rate('a').status_code for i in range(3)], [201, 200, 429])
+
+        response = self.rate('a')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(self.rate('b').status_code, 201)
+        self.assertEqual(metrics.snapshot()['throttle.rejected.rateProfessor'], rejected + 2)
+
+    @override_settings(PROF_RATE_THROTTLE_RATES={'registerUser': (1, 60)})
+    def test_throttlesEachAddressBeforeLogin(self):
+        def register(username, address):
+            return self.client.post('/registerUser/', {
+                'new_username': username, 'new_email': username + '@example.com', 'new_password': 'HelloThere80'
+            }, REMOTE_ADDR=address).status_code
+
+        self.assertEqual([register('one', '10.0.0.1'), register('two', '10.0.0.1'), register('three', '10.0.0.2')], [201, 429, 201])
+
+    def test_bucketRefills(self):
+        bucket = throttling.TokenBucket(1, 0.05)
+        self.assertEqual(bucket.take('key'), 0)
+        self.assertGreater(bucket.take('key'), 0)
+        time.sleep(0.06)
+        self.assertEqual(bucket.take('key'), 0)
+
+    @override_settings(PROF_RATE_ADMISSION_LIMITS={'slow': 1}, PROF_RATE_ADMISSION_RETRY_AFTER=2)
+    def test_admission(self):
+        entered, release = threading.Event(), threading.Event()
+
+        @throttling.admit('slow')
+        def slowView(request):
+            entered.set()
+            release.wait(5)
+            return JsonResponse({})
+
+        @throttling.admit('slow')
+        async def asyncView(request):
+            return JsonResponse({})
+
+        request = RequestFactory().get('/')
+        thread = threading.Thread(target=slowView, args=(request,))
+        thread.start()
+        entered.wait(5)
+
+        for view in (slowView, async_to_sync(asyncView)):
+            response = view(request)
+            self.assertEqual((response.status_code, response['Retry-After']), (503, '2'))
+
+        release.set()
+        thread.join()
+        self.assertEqual(async_to_sync(asyncView)(request).status_code, 200)
+
+
+#-------------------------------------------------------------------------
+# Structured logging
+# Records the configured handler accepts are caught before they reach its
+# queue, so these tests see exactly what the listener would write.
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class LoggingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.handler = logging.getLogger('prof_rate_service').handlers[0]
+        self.sampler = self.handler.filters[0]
+        self.records = []
+        for patcher in (mock.patch.object(self.handler, 'enqueue', self.records.append),
+                        mock.patch.object(self.sampler, '_windows', {})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_clientErrorsSampled(self):
+        dropped = metrics.snapshot().get('log.dropped.allModuleInstances.invalid_fields.400', 0)
+        for i in range(self.sampler.burst + 3):
+            self.assertEqual(self.client.get('/allModuleInstances/', {'fields': 'nonsense'}).status_code, 400)
+
+        self.assertEqual(len(self.records), self.sampler.burst)
+        for record in self.records:
+            self.assertEqual((record.levelname, record.event, record.status), ('WARNING', 'allModuleInstances.invalid_fields', 400))
+            self.assertIsNone(record.exc_info)
+            self.assertNotIn('traceback', json.loads(self.handler.format(record)))
+
+        self.client.force_login(User.objects.create(username='staff', is_staff=True))
+        counters = self.client.get('/metrics/').json()['metrics']
+        self.assertEqual(counters['log.dropped.allModuleInstances.invalid_fields.400'], dropped + 3)
+
+    def test_samplingWindowResets(self):
+        sampler = logutils.SamplingFilter(burst=1, window=0.05)
+        record = logging.makeLogRecord({'sample_key': 'event.404'})
+        self.assertEqual([sampler.filter(record), sampler.filter(record)], [True, False])
+        time.sleep(0.06)
+        self.assertTrue(sampler.filter(record))
+        self.assertTrue(sampler.filter(logging.makeLogRecord({})))
+
+    def test_serverErrorsKeepTraceback(self):
+        with mock.patch.object(views, 'renderModuleInstances', side_effect=DatabaseError('disk I/O error')):
+            for i in range(self.sampler.burst + 1):
+                self.assertEqual(self.client.get('/allModuleInstances/').status_code, 500)
+
+        # Server errors are never sampled
+        self.assertEqual(len(self.records), self.sampler.burst + 1)
+        entry = json.loads(self.handler.format(self.records[0]))
+        self.assertEqual(entry['level'], 'ERROR')
+        self.assertIn('DatabaseError: disk I/O error', entry['traceback'])
+
+
+class BackgroundHandlerTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'service.log'
+
+    def makeHandler(self, maxsize):
+        handler = logutils.BackgroundHandler(self.path, maxsize)
+        handler.setFormatter(logutils.StructuredFormatter())
+        self.addCleanup(handler.target.close)
+        return handler
+
+    def written(self):
+        return [json.loads(line)['message'] for line in self.path.read_text().splitlines()]
+
+    def test_writesInBackground(self):
+        handler = self.makeHandler(10)
+        values = ['first']
+        handler.handle(logging.makeLogRecord({'msg': 'Rated %s', 'args': (values,)}))
+        values.append('second')
+        handler.stop()
+        self.assertEqual(self.written(), ["Rated ['first']"])
+
+    def test_shedsWhenQueueFull(self):
+        handler = self.makeHandler(2)
+        handler.stop()
+        dropped = metrics.snapshot().get('log.dropped.queue_full', 0)
+        for i in range(5):
+            handler.handle(logging.makeLogRecord({'msg': 'Record %d' % i}))
+        self.assertEqual(metrics.snapshot()['log.dropped.queue_full'], dropped + 3)
+
+        handler.listener.start()
+        handler.stop()
+        self.assertEqual(self.written(), ['Record 0', 'Record 1'])
+
+    def test_listenerRestartedAfterFork(self):
+        handler = self.makeHandler(10)
+        pid = os.fork()
+        if pid == 0:
+            handler.handle(logging.makeLogRecord({'msg': 'From child'}))
+            handler.stop()
+            os._exit(0)
+        self.assertEqual(os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]), 0)
+        self.assertEqual(self.written(), ['From child'])
+
+        # The parent's listener is unaffected
+        handler.handle(logging.makeLogRecord({'msg': 'From parent'}))
+        handler.stop()
+        self.assertEqual(self.written(), ['From child', 'From parent'])
+
+
+#-------------------------------------------------------------------------
+# Worker warm-up
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class WarmupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seedDataset(*DATASET_SIZES['small'])
+
+    def test_commandWarmsTheHotResponses(self):
+        out = StringIO()
+        with mock.patch.dict(warmup.startupTimings, clear=True):
+            call_command('warmup', stdout=out)
+
+        report = out.getvalue()
+        for phase in ('database', 'urlResolver', 'catalogue', 'responses'):
+            self.assertIn(phase + '=', report)
+
+        with self.assertNumQueries(0):
+            views.renderModuleInstances()
+            views.renderProfessorRatings()
+
+    @skipUnless(hasattr(os, 'fork'), 'Processes cannot be forked here')
+    def test_forkedWorkersDropInheritedConnections(self):
+        warmup.registerForkHook()
+        connection.ensure_connection()
+
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if connection.connection is None else 1)
+        self.assertEqual(os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]), 0)
+
+        # The parent's connection is left open and usable
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            self.assertEqual(cursor.fetchone(), (1,))
+
+    def test_appImportsNotCountedTwice(self):
+        with mock.patch.dict(warmup.startupTimings, {'appImports': 0.1}, clear=True):
+            warmup.recordDjangoSetup(0.3)
+            self.assertAlmostEqual(warmup.startupTimings['djangoSetup'], 0.2)
+            self.assertIn('(total 300.0ms)', warmup.timingReport())
+
+
+#-------------------------------------------------------------------------
+# Catalogue search index
+#-------------------------------------------------------------------------
+@override_settings(CACHES=TEST_CACHES)
+class SearchTests(TestCase):
+    def setUp(self):
+        Professor.objects.create(professor_code='ZZ9', name='Xprog Person')
+        Module.objects.create(code='PR1', name='Programming')
+        Module.objects.create(code='CS2', name='Computer Programs')
+        self.index = search.SearchIndex(0)
+
+    def codes(self, query, limit=20):
+        return [code for kind, code, name in self.index.search(query, limit)]
+
+    def test_prefixMatchesComeFirst(self):
+        self.assertEqual(self.codes('prog'), ['PR1', 'CS2', 'ZZ9'])
+
+    def test_substringFallback(self):
+        self.assertEqual(self.codes('mput'), ['CS2'])
+        self.assertEqual(sorted(self.codes('og')), ['CS2', 'PR1', 'ZZ9'])
+
+    def test_caseFolded(self):
+        self.assertEqual(self.codes('  PROG '), self.codes('prog'))
+        self.assertEqual(self.codes('Cs2'), ['CS2'])
+
+    def test_limit(self):
+        self.assertEqual(self.codes('prog', limit=1), ['PR1'])
+        self.assertEqual(self.codes('og', limit=2), self.codes('og')[:2])
+
+    def test_substringsSkippedOnceLimitReached(self):
+        self.index.postings = mock.Mock(get=mock.Mock(side_effect=AssertionError('postings were read')))
+        self.assertEqual(self.codes('prog', limit=2), ['PR1', 'CS2'])
+
+
+#-------------------------------------------------------------------------
+# Rating partitions and archives
+#-------------------------------------------------------------------------
+@override_settings(RATING_ARCHIVED_YEARS=[2023])
+class RatingRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = RatingPartitionRouter()
+
+    def rating(self, year):
+        return Rating(module_instance=ModuleInstance(id=year, academic_year=year))
+
+    def test_ratingsRoutedByYear(self):
+        self.assertEqual(self.router.db_for_write(Rating, instance=self.rating(2023)), 'ratings_2023')
+        self.assertEqual(self.router.db_for_read(Rating, instance=self.rating(2023)), 'ratings_2023')
+        self.assertEqual(self.router.db_for_write(Rating, instance=self.rating(2024)), 'default')
+        self.assertIsNone(self.router.db_for_read(Rating))
+
+    def test_archivedRatingsPointAtTheDefaultDatabase(self):
+        rating = self.rating(2023)
+        rating._state.db = 'ratings_2023'
+        self.assertEqual(self.router.db_for_read(Professor, instance=rating), 'default')
+        self.assertIsNone(self.router.db_for_read(Professor, instance=self.rating(2024)))
+
+    def test_archivesNeverMigrated(self):
+        self.assertFalse(self.router.allow_migrate('ratings_2023', 'prof_rate_service', 'rating'))
+        self.assertIsNone(self.router.allow_migrate('default', 'prof_rate_service', 'rating'))
+
+    def test_ratingDatabases(self):
+        self.assertEqual(partitions.ratingDatabases(), ['default', 'ratings_2023'])
+        self.assertEqual(partitions.ratingDatabases([2023]), ['ratings_2023'])
+        self.assertEqual(partitions.ratingDatabases([2024]), ['default'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = seedDataset(*DATASET_SIZES['small'])
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(RATING_ARCHIVE_DIR=Path(directory.name)))
+        self.path = Path(directory.name) / 'ratings_2023.sqlite3'
+
+    # Opens the archive as settings.py does for archived years
+    def serveArchive(self):
+        addDatabase(self, 'ratings_2023', 'file:%s?mode=ro&immutable=1' % self.path)
+        self.enterContext(override_settings(RATING_ARCHIVED_YEARS=[2023]))
+
+    def myRatings(self):
+        self.client.force_login(self.users[0])
+        response = self.client.get('/myRatings/', {'limit': 200})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['ratings']
+
+    def test_roundTrip(self):
+        archivedIds = set(Rating.objects.filter(module_instance__academic_year=2023).values_list('id', flat=True))
+        before = self.myRatings()
+
+        call_command('archiveratings', 2023, stdout=StringIO())
+
+        self.assertFalse(Rating.objects.filter(module_instance__academic_year=2023).exists())
+        self.assertTrue(Rating.objects.filter(module_instance__academic_year=2024).exists())
+        archive = sqlite3.connect('file:%s?mode=ro' % self.path, uri=True)
+        try:
+            self.assertEqual({row[0] for row in archive.execute('SELECT id FROM %s' % Rating._meta.db_table)}, archivedIds)
+        finally:
+            archive.close()
+
+        # The archive serves the same history once its year is archived
+        self.serveArchive()
+        cache.clear()
+        self.assertEqual(self.myRatings(), before)
+        self.assertEqual(set(Rating.objects.using('ratings_2023').values_list('id', flat=True)), archivedIds)
+
+    def test_archiveIsReadOnly(self):
+        call_command('archiveratings', 2023, stdout=StringIO())
+        self.serveArchive()
+
+        with self.assertRaises(DatabaseError):
+            Rating.objects.using('ratings_2023').update(rating=1)
+
+    def test_archivedYearFrozenBeforeServed(self):
+        self.client.force_login(self.users[0])
+        rating = {'professor_code': 'P000', 'module_code': 'M000', 'year': 2023, 'semester': 1, 'rating': 2}
+        self.assertIn(self.client.post('/rateProfessor/', rating).status_code, (200, 201))
+
+        aggregates = list(RatingAggregate.objects.order_by('pk').values_list('total', 'count'))
+        call_command('archiveratings', 2023, stdout=StringIO())
+
+        response = self.client.post('/rateProfessor/', rating)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('archived', response.json()['error'])
+        self.assertFalse(Rating.objects.filter(module_instance__academic_year=2023).exists())
+        self.assertEqual(list(RatingAggregate.objects.order_by('pk').values_list('total', 'count')), aggregates)
+
+    def test_yearArchivedOnce(self):
+        call_command('archiveratings', 2023, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('archiveratings', 2023, stdout=StringIO())
@@ -0,0 +1,183 @@
+import functools
+import logging
+import math
+import threading
+import time
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from . import metrics
+from .logutils import logClientError
+
+
+#-------------------------------------------------------------------------
+# Write throttling and admission control
+# Both are per process and apply to the views decorated below, named by
+# the scope they are decorated with:
+# - throttle gives each user (or each client address, before login) a
+#   token bucket per scope, sized by PROF_RATE_THROTTLE_RATES as
+#   {scope: (requests, seconds)}. A request with no token left gets a 429.
+# - admit lets at most PROF_RATE_ADMISSION_LIMITS[scope] requests run the
+#   view at once. Requests beyond that get a 503 straight away rather than
+#   queuing on the database.
+# Rejections carry Retry-After and are counted in metrics. Scopes missing
+# from the settings are not limited.
+#-------------------------------------------------------------------------
+# Buckets kept per scope. A client with no bucket is treated as having a
+# full one, so refilled buckets are dropped first when a new client
+# arrives at the cap, then the longest idle ones.
+MAX_BUCKETS = 10000
+
+
+class TokenBucket:
+    def __init__(self, requests, seconds):
+        self.config = (requests, seconds)
+        self.capacity = requests
+        self.refillRate = requests / seconds
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    # Returns: 0 when a token was taken, else the seconds until one is free
+    def take(self, key):
+        now = time.monotonic()
+        with self.lock:
+            if key not in self.buckets and len(self.buckets) >= MAX_BUCKETS:
+                self.prune(now)
+
+            tokens, updatedAt = self.buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updatedAt) * self.refillRate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return 0
+
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / self.refillRate
+
+    # Frees a tenth of the cap at least, so pruning is rare
+    def prune(self, now):
+        full = self.capacity / self.refillRate
+        self.buckets = {key: value for key, value in self.buckets.items() if now - value[1] < full}
+
+        keep = MAX_BUCKETS * 9 // 10
+        if len(self.buckets) > keep:
+            idle = sorted(self.buckets.items(), key=lambda item: item[1][1])
+            self.buckets = dict(idle[len(self.buckets) - keep:])
+
+
+class Admission:
+    def __init__(self, limit):
+        self.config = limit
+        self.slots = threading.BoundedSemaphore(limit)
+
+    def enter(self):
+        return self.slots.acquire(blocking=False)
+
+    def leave(self):
+        self.slots.release()
+
+
+_limiters = {}
+_limitersLock = threading.Lock()
+
+
+# Returns: The scope's limiter for the current settings, or None when the
+#          scope is not limited
+def limiter(kind, scope, config):
+    if config is None:
+        return None
+
+    with _limitersLock:
+        current = _limiters.get((kind, scope))
+        if current is None or current.config != config:
+            current = TokenBucket(*config) if kind == 'throttle' else Admission(config)
+            _limiters[(kind, scope)] = current
+        return current
+
+
+def reset():
+    with _limitersLock:
+        _limiters.clear()
+
+
+def clientKey(request, user):
+    if user is not None and user.is_authenticated:
+        return 'user:%s' % user.pk
+
+    # Behind a proxy, PROF_RATE_CLIENT_IP_HEADER names the META key it
+    # puts the client's address in
+    header = getattr(settings, 'PROF_RATE_CLIENT_IP_HEADER', None)
+    address = request.META.get(header) if header else None
+    return 'ip:%s' % (address or request.META.get('REMOTE_ADDR', ''))
+
+
+def rejection(scope, status, event, retryAfter, message):
+    logClientError(logging.getLogger(__name__), status, event, 'Rejected %s: %s', scope, message)
+    metrics.increment('%s.%s' % (event, scope))
+    response = JsonResponse({'error': message}, status=status)
+    response['Retry-After'] = str(max(1, math.ceil(retryAfter)))
+    return response
+
+
+def throttleBucket(scope):
+    return limiter('throttle', scope, getattr(settings, 'PROF_RATE_THROTTLE_RATES', {}).get(scope))
+
+
+# Returns: A 429 response if the request is over its scope's rate, else None
+def checkThrottle(request, scope, bucket, user):
+    if bucket is None:
+        return None
+
+    wait = bucket.take(clientKey(request, user))
+    if not wait:
+        return None
+    return rejection(scope, 429, 'throttle.rejected', wait, 'Too many requests. Please try again in %d seconds.' % max(1, math.ceil(wait)))
+
+
+def throttle(scope):
+    def decorator(view):
+        # Async views load the user without blocking, and only when the
+        # scope is throttled
+        if iscoroutinefunction(view):
+            async def wrapper(request, *args, **kwargs):
+                bucket = throttleBucket(scope)
+                user = await request.auser() if bucket is not None and hasattr(request, 'auser') else None
+                return checkThrottle(request, scope, bucket, user) or await view(request, *args, **kwargs)
+        else:
+            def wrapper(request, *args, **kwargs):
+                bucket = throttleBucket(scope)
+                return checkThrottle(request, scope, bucket, getattr(request, 'user', None)) or view(request, *args, **kwargs)
+        return functools.wraps(view)(wrapper)
+    return decorator
+
+
+def admit(scope):
+    def decorator(view):
+        def enter():
+            admission = limiter('admission', scope, getattr(settings, 'PROF_RATE_ADMISSION_LIMITS', {}).get(scope))
+            if admission is not None and not admission.enter():
+                retryAfter = getattr(settings, 'PROF_RATE_ADMISSION_RETRY_AFTER', 1)
+                return None, rejection(scope, 503, 'admission.rejected', retryAfter, 'The service is busy. Please try again shortly.')
+            return admission, None
+
+        if iscoroutinefunction(view):
+            async def wrapper(request, *args, **kwargs):
+                admission, rejected = enter()
+                if rejected is not None:
+                    return rejected
+                try:
+                    return await view(request, *args, **kwargs)
+                finally:
+                    if admission is not None:
+                        admission.leave()
+        else:
+            def wrapper(request, *args, **kwargs):
+                admission, rejected = enter()
+                if rejected is not None:
+                    return rejected
+                try:
+                    return view(request, *args, **kwargs)
+                finally:
+                    if admission is not None:
+                        admission.leave()
+        return functools.wraps(view)(wrapper)
+    return decorator
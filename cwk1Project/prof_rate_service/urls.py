@@ -6,6 +6,13 @@ urlpatterns = [
     path('allProfessorRatings/', views.allProfessorRatings, name='allProfessorRatings'),
     path('professorModuleRating/<str:professorCode>/<str:moduleCode>/', views.professorModuleRating, name='professorModuleRating'),
     path('rateProfessor/', views.rateProfessor, name='rateProfessor'),
+    path('myRatings/', views.myRatings, name='myRatings'),
     path('', views.homeView, name='home'),
-    path('registerUser/', views.registerUser, name='registerUser')
+    path('registerUser/', views.registerUser, name='registerUser'),
+    path('search/', views.searchCatalogue, name='searchCatalogue'),
+    path('changes/', views.changeFeed, name='changeFeed'),
+    path('metrics/', views.serviceMetrics, name='serviceMetrics'),
+    path('professorAnalytics/', views.professorAnalytics, name='professorAnalytics'),
+    path('profiles/', views.profileList, name='profileList'),
+    path('profiles/<str:profileId>/', views.profileDetail, name='profileDetail')
 ]
\ No newline at end of file
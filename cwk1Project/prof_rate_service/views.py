@@ -1,29 +1,104 @@
 from django.db import DatabaseError, IntegrityError
-from django.core.exceptions import FieldError, ValidationError
+from django.core.exceptions import ValidationError
 from django.http import JsonResponse, HttpResponse
-from .models import ModuleInstance, Professor, Rating
-from django.db.models import Avg, F, IntegerField
-from django.db.models.functions import Round, Cast
+from django.db.models import Sum
+from .models import ModuleInstance, ModuleInstanceCatalogue, Professor, Rating, RatingAggregate
+import json
 import logging
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
-from django.contrib.auth.models import User, Group
+from django.contrib.auth.models import Group
+from . import accounts, analytics, caching, changefeed, metrics, partitions, profiling, ratings, search, throttling
+from .logutils import logClientError
+
+
+#---------------------------------------------------------------------------
+# requestedFields
+# Reads the comma separated fields parameter of a list endpoint, so callers
+# that only need some fields of each item get a smaller body built from
+# fewer columns.
+# Returns: The named fields in the order of available, or all of available
+#          when the parameter is not given
+# Raises:  ValueError if a name is not one of available, or none are given
+#---------------------------------------------------------------------------
+def requestedFields(request, available):
+    fields = request.GET.get('fields')
+    if fields is None:
+        return list(available)
+
+    names = {name.strip() for name in fields.split(',') if name.strip()}
+    if not names or names - set(available):
+        raise ValueError('Provided fields must be a comma separated list of: ' + ', '.join(available) + '.')
+    return [field for field in available if field in names]
+
+
+# Responses are cached separately for each set of fields
+def fieldsCacheName(name, fields, available):
+    if fields == list(available):
+        return name
+    return '%s:%s' % (name, ','.join(fields))
 
 
 #-------------------------------------------------------------------------
 # Service Option 1: allModuleInstances
 # Returns: A list of all module instances and the professors teaching them:
 #          [module_code, module_name, academic_year, semester, taught_by]
+#          or only the fields named in the fields parameter
 #-------------------------------------------------------------------------
+MODULE_INSTANCE_FIELDS = ['module_code', 'module_name', 'academic_year', 'semester', 'taught_by']
+MODULE_INSTANCE_FORMATS = {'module_code': '%s', 'module_name': '%s', 'academic_year': '%d', 'semester': '%d', 'taught_by': '%s'}
+MODULE_INSTANCE_TEXT = {'module_code', 'module_name'}
+
+
+def buildModuleInstances(fields=MODULE_INSTANCE_FIELDS):
+
+    logger = logging.getLogger(__name__)
+
+    # Single ordered scan of the catalogue read model, whose rows already
+    # hold the module details and the serialized taught_by list. Only the
+    # requested columns are read.
+    query = (ModuleInstanceCatalogue.objects
+            .order_by('module_code', 'academic_year', 'semester')
+            .values_list(*fields)
+    )
+
+    # Emit each row straight into the response body. taught_by is stored
+    # serialized already and numbers are written as they are, so only the
+    # text columns need encoding, a column at a time.
+    template = '{%s}' % ', '.join('"%s": %s' % (field, MODULE_INSTANCE_FORMATS[field]) for field in fields)
+    columns = list(zip(*query)) or [()] * len(fields)
+    columns = [map(json.dumps, column) if field in MODULE_INSTANCE_TEXT else column for field, column in zip(fields, columns)]
+    rows = [template % row for row in zip(*columns)]
+
+    if not rows:
+        logger.info('allModuleInstances query returned no results.')
+
+    return ('{"module_instances": [%s]}' % ', '.join(rows)).encode('utf-8')
+
+
+# Pre-rendered body, rebuilt only when the catalogue changes
+def renderModuleInstances(fields=MODULE_INSTANCE_FIELDS):
+    return caching.cachedBody(
+        fieldsCacheName('allModuleInstances', fields, MODULE_INSTANCE_FIELDS),
+        lambda: buildModuleInstances(fields),
+        [caching.CATALOGUE]
+    )
+
+
 def allModuleInstances(request):
 
     logger = logging.getLogger(__name__)
 
+    try:
+        fields = requestedFields(request, MODULE_INSTANCE_FIELDS)
+    except ValueError as e:
+        logClientError(logger, 400, 'allModuleInstances.invalid_fields', 'Fields error: %s', str(e))
+        return JsonResponse({'error': str(e)}, status=400)
+
     # Try fetch all module instances, along with their related professors and modules
     try:
-        query = (ModuleInstance.objects.prefetch_related('professors')
-                .select_related('module')
-        )
+        body = renderModuleInstances(fields)
     
     # Catch exceptions if query fails + return error messages with relevant HTTP codes
     except DatabaseError as e:
@@ -32,31 +107,8 @@ def allModuleInstances(request):
     except Exception as e:
         logger.exception('Unexpected error: %s', str(e))
         return JsonResponse({'error': 'An unexpected error occurred.'}, status=500)
-    
-    if not query:
-        logger.info('allModuleInstances query returned no results.')
-        return JsonResponse({'module_instances': []}, safe=False, status=200)
-
-    response = []
-
-    # Build repsonse if query is successful
-    for item in query:
-        moduleInstanceData = {
-            'module_code': item.module.code, # Fetched from related Module table
-            'module_name': item.module.name, # Fetched from related Module table
-            'academic_year': item.academic_year,
-            'semester': item.semester,
-            'taught_by': [] # Initialise taught_by to allow addition of professors
-        }
 
-        # Add related professors to taught_by field in response
-        for p in item.professors.values_list('professor_code', 'name'):
-            moduleInstanceData['taught_by'].append({'professor_code': p[0], 'professor_name': p[1]})
-
-        # Add response data to response variable
-        response.append(moduleInstanceData)
-
-    return JsonResponse({'module_instances': response}, safe=False, status=200)
+    return HttpResponse(body, content_type='application/json', status=200)
 
 
 
@@ -64,20 +116,70 @@ def allModuleInstances(request):
 # Service Option 2: allProfessorRatings
 # Returns: A list of each professor along with their overall rating:
 #          [professor code, professor name, avg rating across all instances]
+#          or only the fields named in the fields parameter
 #---------------------------------------------------------------------------
+PROFESSOR_RATING_FIELDS = ['professor_code', 'name', 'rating']
+
+
+def buildProfessorRatings(fields=PROFESSOR_RATING_FIELDS):
+
+    logger = logging.getLogger(__name__)
+
+    # Fetch all professors, with only the requested details
+    columns = [field for field in fields if field != 'rating']
+    professors = list(Professor.objects.values_list('id', *columns))
+
+    if not professors:
+        logger.info('Searching for professor ratings returned no results.')
+        return {'module_instances': []}
+
+    # Rating totals come from the aggregates, which cover every partition,
+    # and are skipped altogether when the rating is not wanted
+    totals = {}
+    if 'rating' in fields:
+        totals = {
+            professorId: (total, count)
+            for professorId, total, count in RatingAggregate.objects
+                .values_list('professor_id')
+                .annotate(total=Sum('total'), count=Sum('count'))
+                .order_by()
+        }
+
+    response = []
+    for professor in professors:
+        entry = dict(zip(columns, professor[1:]))
+        if 'rating' in fields:
+            total, count = totals.get(professor[0], (0, 0))
+            entry['rating'] = partitions.roundedAverage(total, count)
+        response.append(entry)
+
+    return {'all_professor_ratings': response}
+
+
+# Pre-rendered body, rebuilt when ratings or professor details change, or
+# only the latter when the rating is left out
+def renderProfessorRatings(fields=PROFESSOR_RATING_FIELDS):
+    scopes = [caching.CATALOGUE, caching.RATINGS] if 'rating' in fields else [caching.CATALOGUE]
+    return caching.cachedBody(
+        fieldsCacheName('allProfessorRatings', fields, PROFESSOR_RATING_FIELDS),
+        lambda: buildProfessorRatings(fields),
+        scopes
+    )
+
+
 def allProfessorRatings(request):
 
     logger = logging.getLogger(__name__)
 
+    try:
+        fields = requestedFields(request, PROFESSOR_RATING_FIELDS)
+    except ValueError as e:
+        logClientError(logger, 400, 'allProfessorRatings.invalid_fields', 'Fields error: %s', str(e))
+        return JsonResponse({'error': str(e)}, status=400)
+
     # Try fetch all professors along with their average ratings
     try:
-        query = (Professor.objects
-                .values(
-                    'professor_code',
-                    'name'
-                )
-                .annotate(rating=Cast(Round(Avg('rating__rating')), IntegerField()))
-        )
+        body = renderProfessorRatings(fields)
     
     # Catch exceptions if query fails + return error messages with relevant HTTP codes
     except DatabaseError as e:
@@ -86,16 +188,8 @@ def allProfessorRatings(request):
     except Exception as e:
         logger.exception('Unexpected error: %s', str(e))
         return JsonResponse({'error': 'An unexpected error occurred.'}, status=500)
-    
-    if not query:
-        logger.info('Searching for professor ratings returned no results.')
-        return JsonResponse({'module_instances': []}, safe=False, status=200)
-
-    # Query result has all information we need
-    # Therefore no need to build up response, simply list
-    response = list(query)
 
-    return JsonResponse({'all_professor_ratings': response}, safe=False, status=200)
+    return HttpResponse(body, content_type='application/json', status=200)
 
 
 
@@ -109,27 +203,24 @@ def professorModuleRating(request, professorCode, moduleCode):
 
     logger = logging.getLogger(__name__)
 
-    # Try fetch all rating objects for a professor and module instance,
-    # and calculate avg rating across retrieved ratings
+    # Try fetch the professor and the module's instances, then total the
+    # professor's rating aggregates for those instances
     try:
-        query = (Rating.objects
-            .filter(
-                module_instance__module__code=moduleCode,
-                professor__professor_code=professorCode
-            )
-            .values(
-                module_code=F('module_instance__module__code'),
-                module_name=F('module_instance__module__name'),
-                professor_code=F('professor__professor_code'),
-                professor_name=F('professor__name')
-            )
-            .annotate(rating=Cast(Round(Avg('rating')), IntegerField()))
+        professor = Professor.objects.filter(professor_code=professorCode).values_list('id', 'professor_code', 'name').first()
+        instances = list(ModuleInstance.objects
+            .filter(module__code=moduleCode)
+            .values_list('id', 'module__code', 'module__name')
         )
 
+        total, count = 0, 0
+        if professor and instances:
+            totals = (RatingAggregate.objects
+                .filter(professor_id=professor[0], module_instance_id__in=[instance[0] for instance in instances])
+                .aggregate(total=Sum('total'), count=Sum('count'))
+            )
+            total, count = totals['total'] or 0, totals['count'] or 0
+
     # Catch exceptions if query fails + return error messages with relevant HTTP codes
-    except FieldError as e:
-        logger.exception('Field error: %s', str(e))
-        return JsonResponse({'error': 'Invalid field name or query parameters.'}, status=400)
     except DatabaseError as e:
         logger.exception('Database error: %s', str(e))
         return JsonResponse({'error': 'Database encountered an error.'}, status=500)
@@ -137,14 +228,17 @@ def professorModuleRating(request, professorCode, moduleCode):
         logger.exception('Unexpected error: %s', str(e))
         return JsonResponse({'error': 'An unexpected error occurred.'}, status=500)
 
-    if not query:
-        logger.info('professorModuleRating query returned no results.')
+    if not count:
+        logClientError(logger, 404, 'professorModuleRating.not_found', 'professorModuleRating query returned no results.')
         return JsonResponse({'error': 'Professor ' + professorCode + ' does not teach Module ' + moduleCode}, status=404)
-    
 
-    # Query result has all information we need
-    # Therefore no need to build up response, simply list
-    response = list(query)
+    response = [{
+        'module_code': instances[0][1],
+        'module_name': instances[0][2],
+        'professor_code': professor[1],
+        'professor_name': professor[2],
+        'rating': partitions.roundedAverage(total, count)
+    }]
 
     return JsonResponse({'professor_module_rating': response}, safe=False, status=200)
 
@@ -153,10 +247,13 @@ def professorModuleRating(request, professorCode, moduleCode):
 
 #---------------------------------------------------------------------------
 # Service Option 4: rateProfessor
-# Returns: Success message that rating has been added to database
+# Returns: Success message that rating has been added to database, or that
+#          the user's earlier rating has been updated
 #---------------------------------------------------------------------------
 @login_required
 @csrf_exempt
+@throttling.throttle('rateProfessor')
+@throttling.admit('rateProfessor')
 def rateProfessor(request):
     
     logger = logging.getLogger(__name__)
@@ -173,72 +270,71 @@ def rateProfessor(request):
         # Check user rating can be converted into an integer
         try:
             userRating = int(userRating)
-        except ValueError:
-            logger.exception('Rating error: Provided rating is not an integer.')
+        except (TypeError, ValueError):
+            logClientError(logger, 400, 'rateProfessor.invalid_rating', 'Rating error: Provided rating is not an integer.')
             return JsonResponse({'error': 'Provided rating must be a number between 1 and 5.'}, status=400)
 
         # Check user rating is between 1 and 5
         if userRating < 1 or userRating > 5:
-            logger.exception('Rating error: Provided rating is not between 1 and 5.')
+            logClientError(logger, 400, 'rateProfessor.invalid_rating', 'Rating error: Provided rating is not between 1 and 5.')
             return JsonResponse({'error': 'Provided rating must be between 1 and 5.'}, status=400)
         
         # Check academic year can be converted into an integer
         try:
             academicYear = int(academicYear)
-        except ValueError:
-            logger.exception('Year error: Provided year is not an integer.')
+        except (TypeError, ValueError):
+            logClientError(logger, 400, 'rateProfessor.invalid_year', 'Year error: Provided year is not an integer.')
             return JsonResponse({'error': 'Provided year must be a year between 2000 and 3000.'}, status=400)
         
         # Check academic year is within model constraints
         if academicYear < 2000 or academicYear > 3000:
-            logger.exception('Year error: Provided year is not between 2000 and 3000.')
+            logClientError(logger, 400, 'rateProfessor.invalid_year', 'Year error: Provided year is not between 2000 and 3000.')
             return JsonResponse({'error': 'Provided year must be between 2000 and 3000.'}, status=400)
         
         # Check module semester can be converted into an integer
         try:
             moduleSemester = int(moduleSemester)
-        except ValueError:
-            logger.exception('Semester error: Provided semester is not an integer.')
+        except (TypeError, ValueError):
+            logClientError(logger, 400, 'rateProfessor.invalid_semester', 'Semester error: Provided semester is not an integer.')
             return JsonResponse({'error': 'Provided semester must be either be 1 or 2.'}, status=400)
         
         # Check module semester is within model constraints
         if moduleSemester < 1 or moduleSemester > 2:
-            logger.exception('Semester error: Provided semester is neither 1 nor 2.')
+            logClientError(logger, 400, 'rateProfessor.invalid_semester', 'Semester error: Provided semester is neither 1 nor 2.')
             return JsonResponse({'error': 'Provided semester must be be either 1 or 2.'}, status=400)
 
 
+        # Ratings for archived years are frozen, including a year whose
+        # archive is written but not yet served
+        if partitions.isFrozen(academicYear):
+            logClientError(logger, 400, 'rateProfessor.archived_year', 'Year error: Provided year has been archived.')
+            return JsonResponse({'error': 'Ratings for ' + str(academicYear) + ' have been archived and can no longer be added.'}, status=400)
+
         try:
-            # Try fetch user specified professor and module instance from database
-            professor = Professor.objects.get(professor_code=professorCode)
-            moduleInstance = ModuleInstance.objects.get(academic_year=academicYear,
-                                                        semester=moduleSemester,
-                                                        module__code=moduleCode)
+            # Try fetch user specified professor and module instance from the
+            # in-process catalogue, which is reloaded whenever the catalogue changes
+            catalogue = caching.catalogue()
+            professor = catalogue.getProfessor(professorCode)
+            moduleInstance = catalogue.getModuleInstance(moduleCode, academicYear, moduleSemester)
             
-            # Add new rating to database for specified professor and module instance
-            (Rating.objects
-                    .create(
-                        user=request.user,
-                        module_instance=moduleInstance,
-                        professor=professor,
-                        rating=userRating
-                    )
-            )
+            # Add the rating, or replace the user's earlier rating of this
+            # professor in this module instance, in a single upsert
+            ratingId, previous = ratings.upsertRating(request.user.id, moduleInstance.id, professor.id, userRating)
 
-            return JsonResponse({'rating': 'Rating successfully added to system.'}, status=201)
+            if previous is None:
+                return JsonResponse({'rating': 'Rating successfully added to system.', 'created': True}, status=201)
+            return JsonResponse({'rating': 'Rating successfully updated.', 'created': False}, status=200)
 
         # Catch exceptions if any query fails + return error messages with relevant HTTP codes
         except Professor.DoesNotExist as e:
-            logger.exception('DoesNotExist error: %s', str(e))
+            logClientError(logger, 404, 'rateProfessor.unknown_professor', 'DoesNotExist error: %s', str(e))
             return JsonResponse({'error': 'Provided professor code is invalid'}, status=404)
         except ModuleInstance.DoesNotExist as e:
-            logger.exception('DoesNotExist error: %s', str(e))
+            logClientError(logger, 404, 'rateProfessor.unknown_module_instance', 'DoesNotExist error: %s', str(e))
             return JsonResponse({'error': 'Provided module instance is invalid. Please check the module code, year, and semester.'}, status=404)
         except ValidationError as e:
-            logger.exception('Validation error: %s', str(e))
+            logClientError(logger, 400, 'rateProfessor.invalid', 'Validation error: %s', str(e))
             return JsonResponse({'error': e.message}, status=400)
-        except IntegrityError as e:
-            logger.exception('Integrity error: %s', str(e))
-            return JsonResponse({'error': 'This rating has previously been made for this professor and module instance.'}, status=400)
         except Exception as e:
             logger.exception('Unexpected error: %s', str(e))
             return JsonResponse({'error': 'An unexpected error occurred.'}, status=500)
@@ -246,11 +342,87 @@ def rateProfessor(request):
     return JsonResponse({'error': 'Invalid request method used. Please try again with a POST request.'}, status=405)
 
 
+#---------------------------------------------------------------------------
+# Service: myRatings
+# Returns: The logged in user's ratings, newest first, a page at a time:
+#          {ratings: [id, module_code, module_name, academic_year, semester,
+#          professor_code, professor_name, rating], next_cursor}
+#          Pass next_cursor back as before to get the following page; it is
+#          null on the last page.
+#---------------------------------------------------------------------------
+MY_RATINGS_LIMIT_DEFAULT = 50
+MY_RATINGS_LIMIT_MAX = 200
+
+
+@login_required
+def myRatings(request):
+
+    logger = logging.getLogger(__name__)
+
+    # Check cursor and limit can be converted into integers
+    try:
+        before = request.GET.get('before')
+        before = None if before is None else int(before)
+        limit = int(request.GET.get('limit', MY_RATINGS_LIMIT_DEFAULT))
+    except ValueError:
+        logClientError(logger, 400, 'myRatings.invalid_parameter', 'My ratings error: provided cursor or limit is not an integer.')
+        return JsonResponse({'error': 'Provided before and limit must be whole numbers.'}, status=400)
+    limit = max(1, min(limit, MY_RATINGS_LIMIT_MAX))
+
+    try:
+        # Ids are unique across partitions, so each partition gives its
+        # next page below the cursor and the newest of them are kept
+        rows = []
+        for db in partitions.ratingDatabases():
+            ratings = Rating.objects.using(db).filter(user_id=request.user.id)
+            if before is not None:
+                ratings = ratings.filter(id__lt=before)
+            rows += ratings.order_by('-id').values_list('id', 'module_instance_id', 'professor_id', 'rating')[:limit + 1]
+
+        rows.sort(reverse=True)
+        page = rows[:limit]
+        catalogue = caching.catalogue()
+
+    # Catch exceptions if any query fails + return error messages with relevant HTTP codes
+    except DatabaseError as e:
+        logger.exception('Database error: %s', str(e))
+        return JsonResponse({'error': 'Database encountered an error.'}, status=500)
+    except Exception as e:
+        logger.exception('Unexpected error: %s', str(e))
+        return JsonResponse({'error': 'An unexpected error occurred.'}, status=500)
+
+    # Archives may hold ratings of since deleted professors and module
+    # instances, which are left out
+    response = []
+    for ratingId, instanceId, professorId, rating in page:
+        instance = catalogue.moduleInstancesById.get(instanceId)
+        professor = catalogue.professorsById.get(professorId)
+        if instance is None or professor is None:
+            continue
+        response.append({
+            'id': ratingId,
+            'module_code': instance.module.code,
+            'module_name': instance.module.name,
+            'academic_year': instance.academic_year,
+            'semester': instance.semester,
+            'professor_code': professor.professor_code,
+            'professor_name': professor.name,
+            'rating': rating
+        })
+
+    return JsonResponse({
+        'ratings': response,
+        'next_cursor': page[-1][0] if len(rows) > limit else None
+    }, status=200)
+
+
 #---------------------------------------------------------------------------
 # Service: registerUser
 # Returns: Success message that user has been added to database
 #---------------------------------------------------------------------------
-def registerUser(request):
+@throttling.throttle('registerUser')
+@throttling.admit('registerUser')
+async def registerUser(request):
     logger = logging.getLogger(__name__)
 
     # Only try process request if POST method is used
@@ -261,35 +433,29 @@ def registerUser(request):
             email = request.POST.get("new_email")
             password = request.POST.get("new_password")
 
-            # Check if provided email is already in use
-            if User.objects.filter(email=email).exists():
-                logger.info('Email error: tried to register with email already in use.')
-                return JsonResponse({'error': 'Email already in use. Please register with a different email.'}, status=400)
-            
-            # Check if provided username is already in use
-            if User.objects.filter(username=username).exists():
-                logger.info('Username error: tried to register with username already in use.')
-                return JsonResponse({'error': 'Username already in use. Please use a different username.'}, status=400)
-            
-            # Create new user with provided username, email, and password
-            newUser = User.objects.create_user(username=username, email=email, password=password)
+            if not username or not password:
+                logClientError(logger, 400, 'registerUser.missing_value', 'Missing value error: username or password not provided.')
+                return JsonResponse({'error': 'User creation failed due to missing values for either username, email, or password.'}, status=400)
 
-            # Add new user to Student permissions group
-            studentGroup = Group.objects.get(name='Student')
-            newUser.groups.add(studentGroup)
+            # Hash the password off the event loop, then add the user and
+            # their Student group membership together. Taken usernames and
+            # emails are reported by the unique indexes on auth_user.
+            hashedPassword = await accounts.hashPassword(password)
+            await sync_to_async(accounts.createStudent)(username, email, hashedPassword)
 
             return JsonResponse({'register_user': 'User registered successfully.'}, status=201)
         
         # Catch exceptions if any query fails + return error messages with relevant HTTP codes
         except IntegrityError as e:
+            field = accounts.conflictingField(e)
+            if field == 'email':
+                logClientError(logger, 400, 'registerUser.email_in_use', 'Email error: tried to register with email already in use.')
+                return JsonResponse({'error': 'Email already in use. Please register with a different email.'}, status=400)
+            if field == 'username':
+                logClientError(logger, 400, 'registerUser.username_in_use', 'Username error: tried to register with username already in use.')
+                return JsonResponse({'error': 'Username already in use. Please use a different username.'}, status=400)
             logger.exception('Integrity error: %s', str(e))
             return JsonResponse({'error': 'An internal error occured during user creation.'}, status=500)
-        except ValidationError as e:
-            logger.exception('Validation error: %s', str(e))
-            return JsonResponse({'error': 'Input data is invalid. Please ensure you have submitted correctly formatted username, email, and password.'}, status=400)
-        except KeyError as e:
-            logger.exception('Key error: %s', str(e))
-            return JsonResponse({'error': 'User creation failed due to missing values for either username, email, or password.'}, status=400)
         except Group.DoesNotExist:
             logger.exception('Group error: permission group does not exist.')
             return JsonResponse({'error': 'Unexpected error occurred when creating user.'}, status=500)
@@ -300,6 +466,200 @@ def registerUser(request):
     return JsonResponse({'error': 'Invalid request method used. Please try again with a POST request.'}, status=405)
 
 
+#---------------------------------------------------------------------------
+# Service: searchCatalogue
+# Returns: Professors and modules whose code or name starts with, or
+#          contains, the query text:
+#          {professors: [professor_code, name], modules: [module_code, module_name]}
+#---------------------------------------------------------------------------
+SEARCH_LIMIT_DEFAULT = 20
+SEARCH_LIMIT_MAX = 100
+
+def searchCatalogue(request):
+
+    logger = logging.getLogger(__name__)
+
+    queryText = request.GET.get('q', '').strip()
+    if not queryText:
+        logClientError(logger, 400, 'search.missing_query', 'Search error: no query text provided.')
+        return JsonResponse({'error': 'Please provide some text to search for using the q parameter.'}, status=400)
+
+    # Check limit can be converted into an integer within range
+    try:
+        limit = int(request.GET.get('limit', SEARCH_LIMIT_DEFAULT))
+    except ValueError:
+        logClientError(logger, 400, 'search.invalid_limit', 'Search error: provided limit is not an integer.')
+        return JsonResponse({'error': 'Provided limit must be a number between 1 and %d.' % SEARCH_LIMIT_MAX}, status=400)
+    limit = max(1, min(limit, SEARCH_LIMIT_MAX))
+
+    # Search the in-memory index, which is rebuilt when the catalogue changes
+    try:
+        results = search.searchIndex().search(queryText, limit)
+    except DatabaseError as e:
+        logger.exception('Database error: %s', str(e))
+        return JsonResponse({'error': 'Database encountered an error.'}, status=500)
+    except Exception as e:
+        logger.exception('Unexpected error: %s', str(e))
+        return JsonResponse({'error': 'An unexpected error occurred.'}, status=500)
+
+    response = {'professors': [], 'modules': []}
+    for kind, code, name in results:
+        if kind == search.PROFESSOR:
+            response['professors'].append({'professor_code': code, 'name': name})
+        else:
+            response['modules'].append({'module_code': code, 'module_name': name})
+
+    return JsonResponse(response, status=200)
+
+
+#---------------------------------------------------------------------------
+# Service: changeFeed
+# Returns: Catalogue and rating changes after the given cursor, oldest first:
+#          {changes: [cursor, entity, key, op, data], next_cursor, has_more}
+#---------------------------------------------------------------------------
+CHANGES_LIMIT_DEFAULT = 500
+CHANGES_LIMIT_MAX = 5000
+
+def changeFeed(request):
+
+    logger = logging.getLogger(__name__)
+
+    # Check cursor and limit can be converted into integers
+    try:
+        since = int(request.GET.get('since', 0))
+        limit = int(request.GET.get('limit', CHANGES_LIMIT_DEFAULT))
+    except ValueError:
+        logClientError(logger, 400, 'changes.invalid_parameter', 'Changes error: provided cursor or limit is not an integer.')
+        return JsonResponse({'error': 'Provided since and limit must be whole numbers.'}, status=400)
+
+    if since < 0:
+        logClientError(logger, 400, 'changes.invalid_parameter', 'Changes error: provided cursor is negative.')
+        return JsonResponse({'error': 'Provided since must not be negative.'}, status=400)
+    limit = max(1, min(limit, CHANGES_LIMIT_MAX))
+
+    try:
+        # Deletions before the horizon have been compacted away, so a
+        # consumer behind it cannot catch up incrementally
+        horizon = changefeed.currentHorizon()
+        if 0 < since < horizon:
+            logClientError(logger, 410, 'changes.behind_horizon', 'Changes error: cursor %s is behind horizon %s.', since, horizon)
+            return JsonResponse({
+                'error': 'Changes up to cursor ' + str(horizon) + ' have been compacted. Please discard local data and resync from cursor 0.',
+                'resync_from': 0
+            }, status=410)
+
+        entries, hasMore = changefeed.changesSince(since, limit)
+
+    # Catch exceptions if query fails + return error messages with relevant HTTP codes
+    except DatabaseError as e:
+        logger.exception('Database error: %s', str(e))
+        return JsonResponse({'error': 'Database encountered an error.'}, status=500)
+    except Exception as e:
+        logger.exception('Unexpected error: %s', str(e))
+        return JsonResponse({'error': 'An unexpected error occurred.'}, status=500)
+
+    response = {
+        'changes': [
+            {'cursor': cursor, 'entity': entity, 'key': key, 'op': operation, 'data': data}
+            for cursor, entity, key, operation, data in entries
+        ],
+        'next_cursor': entries[-1][0] if entries else since,
+        'has_more': hasMore
+    }
+
+    return JsonResponse(response, status=200)
+
+
+#---------------------------------------------------------------------------
+# Service: professorAnalytics
+# Returns: Professor rankings on bias-adjusted, smoothed mean ratings:
+#          {global_mean, ratings, prior_weight, professor_rankings: [rank,
+#          professor_code, name, ratings, mean, smoothed_mean,
+#          adjusted_mean, ci_low, ci_high]}
+#---------------------------------------------------------------------------
+def renderProfessorAnalytics():
+    return caching.cachedBody('professorAnalytics', analytics.buildProfessorAnalytics, [caching.CATALOGUE, caching.RATINGS])
+
+
+@throttling.admit('professorAnalytics')
+def professorAnalytics(request):
+
+    logger = logging.getLogger(__name__)
+
+    if not analytics.available():
+        logger.error('Professor analytics requested but NumPy is not installed.')
+        return JsonResponse({'error': 'Analytics are not available on this server.'}, status=503)
+
+    # Try fetch the analytics, recomputed once per change to the ratings
+    # or professors
+    try:
+        body = renderProfessorAnalytics()
+    except DatabaseError as e:
+        logger.exception('Database error: %s', str(e))
+        return JsonResponse({'error': 'Database encountered an error.'}, status=500)
+    except Exception as e:
+        logger.exception('Unexpected error: %s', str(e))
+        return JsonResponse({'error': 'An unexpected error occurred.'}, status=500)
+
+    return HttpResponse(body, content_type='application/json', status=200)
+
+
+#---------------------------------------------------------------------------
+# Service: serviceMetrics
+# Returns: This process's counters (dropped log records and the like).
+#          Staff only.
+#---------------------------------------------------------------------------
+def serviceMetrics(request):
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Only staff may view service metrics.'}, status=403)
+
+    return JsonResponse({'metrics': metrics.snapshot()}, status=200)
+
+
+#---------------------------------------------------------------------------
+# Service: profileList
+# Returns: The kept request profiles, newest first:
+#          [id, view, method, path, status, trigger, created, seconds,
+#          query_count]. Staff only.
+#---------------------------------------------------------------------------
+def profileList(request):
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Only staff may view request profiles.'}, status=403)
+
+    return JsonResponse({'profiles': profiling.listProfiles()}, status=200)
+
+
+#---------------------------------------------------------------------------
+# Service: profileDetail
+# Returns: One request profile with its SQL queries and its top functions
+#          by cumulative time, or by own time with ?sort=tottime. Staff only.
+#---------------------------------------------------------------------------
+PROFILE_FUNCTIONS_DEFAULT = 30
+PROFILE_FUNCTIONS_MAX = 500
+
+def profileDetail(request, profileId):
+
+    logger = logging.getLogger(__name__)
+
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Only staff may view request profiles.'}, status=403)
+
+    try:
+        limit = int(request.GET.get('limit', PROFILE_FUNCTIONS_DEFAULT))
+    except ValueError:
+        logClientError(logger, 400, 'profiles.invalid_limit', 'Profile error: provided limit is not an integer.')
+        return JsonResponse({'error': 'Provided limit must be a number between 1 and %d.' % PROFILE_FUNCTIONS_MAX}, status=400)
+    limit = max(1, min(limit, PROFILE_FUNCTIONS_MAX))
+    sortKey = 'tottime' if request.GET.get('sort') == 'tottime' else 'cumulative'
+
+    profile = profiling.loadProfile(profileId, sortKey, limit)
+    if profile is None:
+        logClientError(logger, 404, 'profiles.not_found', 'Profile error: no profile %s.', profileId)
+        return JsonResponse({'error': 'No profile with id ' + profileId + ' was found.'}, status=404)
+
+    return JsonResponse({'profile': profile}, status=200)
+
+
 #---------------------------------------------------------------------------
 # Service: homeView
 # Returns: String. Used for redirection post-login.
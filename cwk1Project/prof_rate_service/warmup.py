@@ -0,0 +1,110 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver, reverse
+
+
+# Seconds spent in each startup phase of this process, in the order recorded
+startupTimings = {}
+
+
+def recordTiming(phase, seconds):
+    startupTimings[phase] = seconds
+
+
+# The app's imports are timed inside django.setup(), so they are taken out
+# of its time to keep the phases from overlapping in the total
+def recordDjangoSetup(seconds):
+    recordTiming('djangoSetup', seconds - startupTimings.get('appImports', 0))
+
+
+@contextmanager
+def timed(phase):
+    startedAt = time.perf_counter()
+    try:
+        yield
+    finally:
+        recordTiming(phase, time.perf_counter() - startedAt)
+
+
+def timingReport():
+    phases = ', '.join('%s=%.1fms' % (phase, seconds * 1000) for phase, seconds in startupTimings.items())
+    total = sum(startupTimings.values()) * 1000
+    return 'Startup timings: %s (total %.1fms)' % (phases, total)
+
+
+#-------------------------------------------------------------------------
+# warmUp
+# Pays the cold-start costs of a fresh worker before it takes traffic:
+# DB connections, URL resolver compilation, the in-process catalogue and
+# search index, and the pre-rendered bodies of the hot read endpoints.
+#-------------------------------------------------------------------------
+def warmUp():
+    # Imported here as views pull in the URL and model machinery
+    from . import caching, search, views
+
+    with timed('database'):
+        for connection in connections.all():
+            connection.ensure_connection()
+
+    with timed('urlResolver'):
+        resolver = get_resolver()
+        resolver.resolve('/allModuleInstances/')
+        reverse('allModuleInstances')
+
+    with timed('catalogue'):
+        caching.catalogue()
+        search.searchIndex()
+
+    with timed('responses'):
+        views.renderModuleInstances()
+        views.renderProfessorRatings()
+
+
+#-------------------------------------------------------------------------
+# Forking after the warm-up
+# Servers that load the app before forking (gunicorn --preload, uWSGI
+# without lazy-apps) run the warm-up in the master, and with CONN_MAX_AGE
+# every worker would go on using the database connections it inherited.
+# SQLite handles are not safe to use across fork(), so each child drops
+# them and opens its own. They are dropped rather than closed, as closing
+# would act on the handles the parent still uses.
+#-------------------------------------------------------------------------
+_forkHookRegistered = False
+
+
+def dropInheritedConnections():
+    for connection in connections.all(initialized_only=True):
+        connection.connection = None
+
+
+def registerForkHook():
+    global _forkHookRegistered
+
+    if not _forkHookRegistered and hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=dropInheritedConnections)
+        _forkHookRegistered = True
+
+
+#---------------------------------------------------------------------------
+# runStartupWarmup
+# Called from wsgi.py or asgi.py, which servers import either in each
+# worker or once in the master before forking the workers. Controlled by
+# the PROF_RATE_WARMUP setting.
+#---------------------------------------------------------------------------
+def runStartupWarmup():
+    logger = logging.getLogger(__name__)
+    registerForkHook()
+
+    if getattr(settings, 'PROF_RATE_WARMUP', False):
+        # A failed warm-up only costs the first requests their speed,
+        # so never let it stop the worker from starting
+        try:
+            warmUp()
+        except Exception as e:
+            logger.exception('Warm-up error: %s', str(e))
+
+    logger.info(timingReport())
@@ -1,20 +1,33 @@
+import os
+import sys
 import requests
 # Need to install tabulate for client to work!
 from tabulate import tabulate
+from replica import Replica, ReplicaError
+
+# Address of the service, e.g. http://127.0.0.1:8000 for a local server
+# Set with PROF_RATE_SERVICE_URL or by starting the client with --url <address>
+DEFAULT_SERVICE_URL = "https://sc21bphn.pythonanywhere.com"
+SERVICE_URL = os.environ.get('PROF_RATE_SERVICE_URL', DEFAULT_SERVICE_URL).rstrip('/')
 
 session = requests.Session()
 
+# In local mode, list, view and average are answered from a replica of the
+# service kept in replica.sqlite3 next to this file
+localMode = False
+replica = None
+
 # Function for calling login API
 def login(input_url):
     try:
 
         # Send get request login endpoint to fetch a CSRF token
-        url = "https://sc21bphn.pythonanywhere.com/accounts/login/"
+        url = f"{SERVICE_URL}/accounts/login/"
 
         if input_url != url:
             print(
                 "Invalid login URL provided. Please make sure you are using the following URL to login: \n"
-                "https://sc21bphn.pythonanywhere.com/accounts/login/"
+                f"{SERVICE_URL}/accounts/login/"
             )
             return
 
@@ -41,7 +54,7 @@ def login(input_url):
             headers = {
                 'X-CSRFToken': csrfToken,
                 'Content-Type': 'application/x-www-form-urlencoded',
-                'Referer': 'https://sc21bphn.pythonanywhere.com/accounts/login/'
+                'Referer': f'{SERVICE_URL}/accounts/login/'
             }
 
             # Make post request to login endpoint,
@@ -76,7 +89,7 @@ def login(input_url):
 # Function for calling logout API   
 def logout():
     try:
-        url = "https://sc21bphn.pythonanywhere.com/accounts/logout/"
+        url = f"{SERVICE_URL}/accounts/logout/"
 
         # Only allow logout if the user is already logged into an account
         if 'sessionid' in session.cookies:
@@ -93,7 +106,7 @@ def logout():
             headers = {
                 'X-CSRFToken': csrfToken,
                 'Content-Type': 'application/x-www-form-urlencoded',
-                'Referer': 'https://sc21bphn.pythonanywhere.com/accounts/logout/'
+                'Referer': f'{SERVICE_URL}/accounts/logout/'
             }
 
             # Make post request to the logout endpoint
@@ -124,11 +137,93 @@ def logout():
         print(f"An error with the network occured during logout: {e}")
         return
     
+# Returns the local replica, first catching it up with the service if it
+# is stale or a refresh was asked for. Returns None if it has never synced.
+def localReplica(refresh=False):
+    global replica
+    if replica is None:
+        replica = Replica(session, SERVICE_URL)
+
+    try:
+        if refresh or replica.isStale():
+            replica.sync()
+    except (requests.RequestException, ReplicaError) as e:
+        if replica.getMeta('synced_at') is None:
+            print(f"The local replica could not be synced: {e}")
+            return None
+        print(f"The local replica could not be refreshed, showing the last synced data: {e}")
+    return replica
+
+
+# Function for syncing the local replica with the service
+# A full sync discards the replica and downloads everything again
+def sync(full=False):
+    global replica
+    try:
+        if replica is None:
+            replica = Replica(session, SERVICE_URL)
+        applied = replica.sync(force=full)
+        print(f"Local replica synced, {applied} changes applied.")
+    except ReplicaError as e:
+        print(f"An error occured during sync: {e}")
+    except requests.RequestException as e:
+        print(f"An error with the network occured during sync: {e}")
+
+
+# Function for switching list, view and average between the local replica and the service
+def mode(newMode):
+    global localMode
+    if newMode == 'local':
+        if localReplica() is None:
+            print("Staying in live mode.")
+            return
+        localMode = True
+        print("Local mode on: list, view and average are answered from the local replica.")
+    elif newMode == 'live':
+        localMode = False
+        print("Live mode on: list, view and average are answered by the service.")
+    else:
+        print("The mode command must be structured as follows: mode <local|live>")
+
+
+def printModuleInstances(moduleInstances):
+    moduleData = []
+    titles = ['Code', 'Name', 'Year', 'Semester', 'Taught by']
+    for item in moduleInstances:
+
+        taughtBy = ""
+        for professor in item['taught_by']:
+            taughtBy += professor['professor_code'] + ", " + professor['professor_name'] + "\n"
+
+        moduleData.append([item['module_code'], 
+                        item['module_name'], 
+                        item['academic_year'], 
+                        item['semester'],
+                        taughtBy])
+    print(tabulate(moduleData, headers=titles, tablefmt='grid'))
+
+
+def printProfessorRatings(professorRatings):
+    for item in professorRatings:
+        print(f"The rating of {item['name']} ({item['professor_code']}) is {item['rating']}")
+
+
+def printProfessorModuleRating(professorModuleRating):
+    for item in professorModuleRating:
+        print(f"The rating of {item['professor_name']} ({item['professor_code']}) in module {item['module_name']} ({item['module_code']}) is {item['rating']}")
+
+
 # Function for calling all module instances API
-def list():
+def list(refresh=False):
+    if localMode:
+        localData = localReplica(refresh)
+        if localData is not None:
+            printModuleInstances(localData.moduleInstances())
+            return
+
     try:
         # Make GET request to allModuleInstances endpoint + store response
-        url = "https://sc21bphn.pythonanywhere.com/allModuleInstances/"
+        url = f"{SERVICE_URL}/allModuleInstances/"
         response = session.get(url)
 
         # Try get JSON response, return if unsuccessful
@@ -145,20 +240,7 @@ def list():
             return
 
         # If request successful, put result in a table format and output
-        moduleData = []
-        titles = ['Code', 'Name', 'Year', 'Semester', 'Taught by']
-        for item in responseData['module_instances']:
-
-            taughtBy = ""
-            for professor in item['taught_by']:
-                taughtBy += professor['professor_code'] + ", " + professor['professor_name'] + "\n"
-
-            moduleData.append([item['module_code'], 
-                            item['module_name'], 
-                            item['academic_year'], 
-                            item['semester'],
-                            taughtBy])
-        print(tabulate(moduleData, headers=titles, tablefmt='grid'))
+        printModuleInstances(responseData['module_instances'])
         return
 
     # Return error if issue with network during request
@@ -167,10 +249,16 @@ def list():
         return
 
 # Function for calling all professor ratings API
-def view():
+def view(refresh=False):
+    if localMode:
+        localData = localReplica(refresh)
+        if localData is not None:
+            printProfessorRatings(localData.professorRatings())
+            return
+
     try:
         # Make GET request to allProfessorRatings endpoint + store response
-        url = "https://sc21bphn.pythonanywhere.com/allProfessorRatings/"
+        url = f"{SERVICE_URL}/allProfessorRatings/"
         response = session.get(url)
 
         # Try get JSON response, return error message if unsuccessful
@@ -187,8 +275,7 @@ def view():
             return
 
         # If request successful, format and output result
-        for item in responseData['all_professor_ratings']:
-            print(f"The rating of {item['name']} ({item['professor_code']}) is {item['rating']}")
+        printProfessorRatings(responseData['all_professor_ratings'])
         return
 
     # Return error if issue with network during request
@@ -197,11 +284,23 @@ def view():
         return
 
 # Function for calling average professor rating API
-def average(professorCode, moduleCode):
+def average(professorCode, moduleCode, refresh=False):
+    # A replica synced without the change feed has no per-module ratings,
+    # so it falls through to the service
+    if localMode:
+        localData = localReplica(refresh)
+        localRating = localData.professorModuleRating(professorCode, moduleCode) if localData else None
+        if localRating == []:
+            print("An error occured during the request: No ratings found for this professor and module.")
+            return
+        if localRating is not None:
+            printProfessorModuleRating(localRating)
+            return
+
     try:
         # Make GET request to professorModuleRating endpoint + store response
         # Use provided professor and module code
-        url = f"https://sc21bphn.pythonanywhere.com/professorModuleRating/{professorCode}/{moduleCode}" 
+        url = f"{SERVICE_URL}/professorModuleRating/{professorCode}/{moduleCode}" 
         response = session.get(url)
         
         # try get JSON response, return error message if unsuccessful
@@ -218,8 +317,7 @@ def average(professorCode, moduleCode):
             return
         
         # If request successful, format and output result
-        for item in responseData['professor_module_rating']:
-            print(f"The rating of {item['professor_name']} ({item['professor_code']}) in module {item['module_name']} ({item['module_code']}) is {item['rating']}")
+        printProfessorModuleRating(responseData['professor_module_rating'])
         return
 
     # Return error if issue with network during request
@@ -231,7 +329,7 @@ def average(professorCode, moduleCode):
 # Function for calling rating API
 def rate(professorCode, moduleCode, year, semester, rating):
     try:
-        url = "https://sc21bphn.pythonanywhere.com/rateProfessor/"
+        url = f"{SERVICE_URL}/rateProfessor/"
 
         # Only proceed with API request if user is logged in
         # If not, return error message
@@ -255,7 +353,7 @@ def rate(professorCode, moduleCode, year, semester, rating):
             headers = {
                 'X-CSRFToken': csrfToken,
                 'Content-Type': 'application/x-www-form-urlencoded',
-                'Referer': 'https://sc21bphn.pythonanywhere.com/rateProfessor/'
+                'Referer': f'{SERVICE_URL}/rateProfessor/'
             }
 
             # Create new user rating by making request to rating endpoint
@@ -269,7 +367,8 @@ def rate(professorCode, moduleCode, year, semester, rating):
                 return
 
             # Output result of request
-            if response.status_code == 201:
+            # 201 means a new rating, 200 that an earlier one was updated
+            if response.status_code in (200, 201):
                 print(responseData['rating'])
                 return
             elif response.status_code == 401:
@@ -289,13 +388,71 @@ def rate(professorCode, moduleCode, year, semester, rating):
         return
     
 
+# Function for calling the rating history API
+# Fetches every page of the logged in user's ratings
+def myRatings():
+    if 'sessionid' not in session.cookies:
+        print("You must be logged in to view your ratings. Please log in and try again.")
+        return
+
+    try:
+        url = f"{SERVICE_URL}/myRatings/"
+        ratingData = []
+        params = {}
+
+        while True:
+            # Don't follow the redirect to the login page if the session expired
+            response = session.get(url, params=params, allow_redirects=False)
+
+            if response.status_code == 302:
+                print("Unauthorised request. Please ensure you are logged in before using this service.")
+                return
+
+            # Try get JSON response, return error message if unsuccessful
+            try:
+                responseData = response.json()
+            except ValueError:
+                print(f"Request failed with status code {response.status_code} and a bad JSON response.")
+                return
+
+            if response.status_code != 200:
+                error = responseData.get('error', 'No error message was given.')
+                print(f"An error occured during the request: {error}")
+                return
+
+            for item in responseData['ratings']:
+                ratingData.append([item['module_code'],
+                                item['module_name'],
+                                item['academic_year'],
+                                item['semester'],
+                                item['professor_code'] + ", " + item['professor_name'],
+                                item['rating']])
+
+            if responseData['next_cursor'] is None:
+                break
+            params = {'before': responseData['next_cursor']}
+
+        if not ratingData:
+            print("You have not rated any professors yet.")
+            return
+
+        titles = ['Code', 'Name', 'Year', 'Semester', 'Professor', 'Rating']
+        print(tabulate(ratingData, headers=titles, tablefmt='grid'))
+        return
+
+    # Return error if issue with network during request
+    except requests.RequestException as e:
+        print(f"An error with the network occured during myratings request: {e}")
+        return
+
+
 # Function for calling register API
 def register():
     try:
         # If there is no CSRF token in session, fetch one from login page
         # CSRF token needed for POST request
         if 'csrftoken' not in session.cookies:
-            url = "https://sc21bphn.pythonanywhere.com/accounts/login/"
+            url = f"{SERVICE_URL}/accounts/login/"
             response = session.get(url)
 
             # Check if login page could be fetched
@@ -317,7 +474,7 @@ def register():
         headers = {
                 'X-CSRFToken': csrfToken,
                 'Content-Type': 'application/x-www-form-urlencoded',
-                'Referer': 'https://sc21bphn.pythonanywhere.com/accounts/login/'
+                'Referer': f'{SERVICE_URL}/accounts/login/'
             }
         
         # Take user inputs for username, email, password + prep request data
@@ -331,7 +488,7 @@ def register():
         }
 
         # Create new user by making post request to user registration endpoint
-        url = "https://sc21bphn.pythonanywhere.com/registerUser/"
+        url = f"{SERVICE_URL}/registerUser/"
         response = session.post(url, data=requestData, headers=headers)
 
         # Try get JSON response, return error message if unsuccessful 
@@ -365,6 +522,11 @@ def commandHelp():
     print("view                                                             allows the user to view the rating of all professors.")
     print("average <professor_code> <module_code>                           allows the user to view the average rating of a specific professor for a specific module.")
     print("rate <professor_code> <module_code> <year> <semester> <rating>   allows the user to submit a rating of a specific professor for a specific module instance.")
+    print("myratings                                                        allows the user to view every rating they have submitted.")
+    print("sync [--full]                                                    brings the local replica up to date, or downloads it again with --full.")
+    print("mode <local|live>                                                answers list, view and average from the local replica or from the service.")
+    print("")
+    print("In local mode, add --refresh to list, view or average to sync the replica before answering.")
     print("exit                                                             exits the application.")
     print("")
     return
@@ -394,18 +556,18 @@ def main():
                 print("The logout command must be structured as follows: logout")
         
         elif commandParts[0].lower() == 'list':
-            if len(commandParts) == 1:
-                list()
+            if commandParts[1:] in ([], ['--refresh']):
+                list(refresh=len(commandParts) == 2)
             else:
                 print("Incorrect number of arguments used for the list command.")
-                print("The list command must be structured as follows: list")
+                print("The list command must be structured as follows: list [--refresh]")
 
         elif commandParts[0].lower() == 'view':
-            if len(commandParts) == 1:
-                view()
+            if commandParts[1:] in ([], ['--refresh']):
+                view(refresh=len(commandParts) == 2)
             else:
                 print("Incorrect number of arguments used for the view command.")
-                print("The view command must be structured as follows: view")
+                print("The view command must be structured as follows: view [--refresh]")
         
         elif commandParts[0].lower() == 'register':
             if len(commandParts) == 1:
@@ -415,11 +577,25 @@ def main():
                 print("The register command must be structured as follows: register")
 
         elif commandParts[0].lower() == 'average':
-            if len(commandParts) == 3:
-                average(commandParts[1], commandParts[2])
+            if len(commandParts) == 3 or (len(commandParts) == 4 and commandParts[3] == '--refresh'):
+                average(commandParts[1], commandParts[2], refresh=len(commandParts) == 4)
             else:
                 print("Incorrect number of arguments used for the average command.")
-                print("The average command must be structured as follows: average <professor_code> <module_code>")
+                print("The average command must be structured as follows: average <professor_code> <module_code> [--refresh]")
+
+        elif commandParts[0].lower() == 'sync':
+            if commandParts[1:] in ([], ['--full']):
+                sync(full=len(commandParts) == 2)
+            else:
+                print("Incorrect number of arguments used for the sync command.")
+                print("The sync command must be structured as follows: sync [--full]")
+
+        elif commandParts[0].lower() == 'mode':
+            if len(commandParts) == 2:
+                mode(commandParts[1].lower())
+            else:
+                print("Incorrect number of arguments used for the mode command.")
+                print("The mode command must be structured as follows: mode <local|live>")
         
         elif commandParts[0].lower() == 'rate':
             if len(commandParts) == 6:
@@ -428,6 +604,13 @@ def main():
                 print("Incorrect number of arguments used for the rate command.")
                 print("The rate command must be structured as follows: average <professor_code> <module_code> <year> <semester> <rating>")
 
+        elif commandParts[0].lower() == 'myratings':
+            if len(commandParts) == 1:
+                myRatings()
+            else:
+                print("Incorrect number of arguments used for the myratings command.")
+                print("The myratings command must be structured as follows: myratings")
+
         # Exit application if user command is 'exit'
         elif userCommand.lower() == 'exit':
             if len(commandParts) == 1:
@@ -439,5 +622,21 @@ def main():
         else:
             commandHelp()
 
+# Usage: py client.py [--url <address>]
+#        py client.py load [options], see loadtest.py
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    arguments = sys.argv[1:]
+
+    if arguments[:1] == ['load']:
+        import loadtest
+        loadtest.main(arguments[1:])
+
+    elif arguments[:1] == ['--url'] and len(arguments) == 2:
+        SERVICE_URL = arguments[1].rstrip('/')
+        main()
+
+    elif not arguments:
+        main()
+
+    else:
+        print("Usage: py client.py [--url <address>] or py client.py load [options]")
\ No newline at end of file
@@ -0,0 +1,320 @@
+import argparse
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+import requests
+from requests.adapters import HTTPAdapter
+from tabulate import tabulate
+
+# Load mode for soak testing a staging or local server
+# Simulated users, each with their own session and account, run the
+# client's commands in a weighted mix. Between them they start commands at
+# the target rate, and the latency and outcome of each command are
+# reported by command at the end. All sessions share one pool of
+# keep-alive connections.
+#
+# The server throttles registerUser and rateProfessor per user and per
+# client address, so raise PROF_RATE_THROTTLE_RATES on the server under
+# test to measure more than the throttle. Throttled commands (429) and ones
+# turned away while the server is busy (503) are counted apart from errors.
+
+DEFAULT_URL = os.environ.get('PROF_RATE_SERVICE_URL', 'http://127.0.0.1:8000')
+
+# Relative weights of the commands each simulated user runs
+DEFAULT_MIX = {'list': 25, 'view': 25, 'average': 25, 'rate': 15, 'login': 5, 'register': 5}
+
+# Commands needing an account; a user without one registers instead
+ACCOUNT_COMMANDS = ('login', 'rate')
+
+PERCENTILES = (50, 90, 95, 99)
+
+THROTTLED = (429, 503)
+
+
+# Returns: The pth percentile of the sorted values, by nearest rank
+def percentile(values, p):
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+# Parses a mix given as e.g. list=4,view=4,rate=1; commands left out are not run
+def parseMix(text):
+    mix = {}
+    for part in text.split(','):
+        command, _, weight = part.partition('=')
+        command = command.strip()
+        if command not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown command '{command}' in mix, expected one of {', '.join(DEFAULT_MIX)}")
+        try:
+            mix[command] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"the weight of '{command}' in the mix must be a number")
+
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("at least one command in the mix must have a weight above 0")
+    return mix
+
+
+# Hands out the times commands are due at, spaced evenly at the target
+# rate, until the run is over
+class Pacer:
+    def __init__(self, rate, duration):
+        self.interval = 1 / rate
+        self.nextAt = time.monotonic()
+        self.stopAt = self.nextAt + duration
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    # Waits until the caller's next command is due
+    # Returns: False once the run is over
+    def wait(self):
+        with self.lock:
+            dueAt = self.nextAt
+            self.nextAt += self.interval
+
+        if dueAt >= self.stopAt:
+            return False
+        return not self.stopped.wait(max(0, dueAt - time.monotonic()))
+
+    def stop(self):
+        self.stopped.set()
+
+
+class Results:
+    def __init__(self):
+        self.latencies = {}
+        self.outcomes = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    # outcome is 'ok', 'throttled' or 'error'; error describes what went wrong
+    def record(self, command, seconds, outcome, error=None):
+        with self.lock:
+            if seconds is not None:
+                self.latencies.setdefault(command, []).append(seconds)
+            self.outcomes.setdefault(command, Counter())[outcome] += 1
+            if error is not None:
+                self.errors.setdefault(command, Counter())[error] += 1
+
+    def report(self, elapsed, targetRate):
+        rows = []
+        total = Counter()
+        for command in DEFAULT_MIX:
+            outcomes = self.outcomes.get(command)
+            if not outcomes:
+                continue
+
+            sent = sum(outcomes.values())
+            total.update(outcomes)
+            latencies = sorted(self.latencies.get(command, []))
+            rows.append([command, sent, outcomes['ok'], outcomes['throttled'], outcomes['error'],
+                         f"{100 * outcomes['error'] / sent:.1f}"]
+                        + [f"{1000 * percentile(latencies, p):.1f}" if latencies else '-' for p in PERCENTILES]
+                        + [f"{1000 * latencies[-1]:.1f}" if latencies else '-'])
+
+        if not rows:
+            print("No commands were run.")
+            return
+
+        sent = sum(total.values())
+        print(f"{sent} commands in {elapsed:.1f}s, {sent / elapsed:.1f}/s against a target of {targetRate:g}/s.")
+        print(f"{total['ok']} succeeded, {total['throttled']} were throttled and {total['error']} failed ({100 * total['error'] / sent:.1f}%).")
+
+        titles = ['Command', 'Sent', 'OK', 'Throttled', 'Errors', 'Error %'] + [f"p{p} ms" for p in PERCENTILES] + ['Max ms']
+        print(tabulate(rows, headers=titles, tablefmt='grid'))
+
+        for command in DEFAULT_MIX:
+            for error, count in self.errors.get(command, Counter()).most_common(5):
+                print(f"{command}: {count} x {error}")
+
+        if sent / elapsed < 0.9 * targetRate:
+            print("The target rate was not reached, the simulated users spent the run waiting on the server. Try more --users.")
+
+
+#-------------------------------------------------------------------------
+# Simulated users
+# Each runs the client's commands through their own session, holding the
+# account they last registered.
+#-------------------------------------------------------------------------
+class SimulatedUser:
+    def __init__(self, baseUrl, adapter, username, password, moduleInstances, results, rng):
+        self.baseUrl = baseUrl
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.baseUsername = username
+        self.password = password
+        self.moduleInstances = moduleInstances
+        self.results = results
+        self.rng = rng
+        self.accounts = 0
+        self.username = None
+
+    def run(self, pacer, mix):
+        commands = [command for command in mix if mix[command] > 0]
+        weights = [mix[command] for command in commands]
+
+        while pacer.wait():
+            command = self.rng.choices(commands, weights)[0]
+            if command in ACCOUNT_COMMANDS and self.username is None:
+                command = 'register'
+            self.timed(command, getattr(self, command))
+
+    # Runs one command, recording how long it took and how it went
+    # The command returns its response and whether that was a success
+    def timed(self, command, action):
+        startedAt = time.perf_counter()
+        try:
+            response, succeeded = action()
+        except requests.RequestException as e:
+            self.results.record(command, None, 'error', type(e).__name__)
+            return
+        seconds = time.perf_counter() - startedAt
+
+        if succeeded:
+            self.results.record(command, seconds, 'ok')
+        elif response.status_code in THROTTLED:
+            self.results.record(command, seconds, 'throttled')
+        else:
+            self.results.record(command, seconds, 'error', f"status code {response.status_code}")
+
+    def csrfHeaders(self, path):
+        csrfToken = self.session.cookies.get('csrftoken')
+        if not csrfToken:
+            self.session.get(f"{self.baseUrl}/accounts/login/")
+            csrfToken = self.session.cookies.get('csrftoken', '')
+        return {'X-CSRFToken': csrfToken, 'Referer': f"{self.baseUrl}{path}"}
+
+    # Registers a new account and logs in to it
+    def register(self):
+        username = f"{self.baseUsername}-{self.accounts}"
+        self.accounts += 1
+        requestData = {
+            "new_username": username,
+            "new_email": f"{username}@example.com",
+            "new_password": self.password
+        }
+        response = self.session.post(f"{self.baseUrl}/registerUser/", data=requestData, headers=self.csrfHeaders('/registerUser/'))
+        if response.status_code != 201:
+            return response, False
+
+        self.username = username
+        self.session.cookies.clear()
+        return self.login()
+
+    def login(self):
+        credentials = {"username": self.username, "password": self.password}
+        response = self.session.post(f"{self.baseUrl}/accounts/login/", data=credentials,
+                                     headers=self.csrfHeaders('/accounts/login/'), allow_redirects=False)
+        # A successful login redirects to the home page
+        return response, response.status_code == 302 and 'sessionid' in self.session.cookies
+
+    def list(self):
+        response = self.session.get(f"{self.baseUrl}/allModuleInstances/")
+        return response, response.status_code == 200
+
+    def view(self):
+        response = self.session.get(f"{self.baseUrl}/allProfessorRatings/")
+        return response, response.status_code == 200
+
+    def average(self):
+        professorCode, moduleCode, _, _ = self.rng.choice(self.moduleInstances)
+        response = self.session.get(f"{self.baseUrl}/professorModuleRating/{professorCode}/{moduleCode}/")
+        # 404 is the answer for a professor not yet rated in the module
+        return response, response.status_code in (200, 404)
+
+    def rate(self):
+        professorCode, moduleCode, year, semester = self.rng.choice(self.moduleInstances)
+        requestData = {
+            "professor_code": professorCode,
+            "module_code": moduleCode,
+            "year": year,
+            "semester": semester,
+            "rating": self.rng.randint(1, 5)
+        }
+        # Not following the redirect to the login page if the session was lost
+        response = self.session.post(f"{self.baseUrl}/rateProfessor/", data=requestData,
+                                     headers=self.csrfHeaders('/rateProfessor/'), allow_redirects=False)
+        return response, response.status_code in (200, 201)
+
+
+# Returns: Every (professor code, module code, year, semester) the users can
+#          ask about and rate, or None if the service could not list them
+def fetchModuleInstances(session, baseUrl):
+    try:
+        response = session.get(f"{baseUrl}/allModuleInstances/")
+        if response.status_code != 200:
+            print(f"Could not list the module instances, the service returned status code {response.status_code}.")
+            return None
+        moduleInstances = response.json()['module_instances']
+    except (requests.RequestException, ValueError, KeyError) as e:
+        print(f"Could not list the module instances: {e}")
+        return None
+
+    return [(professor['professor_code'], item['module_code'], item['academic_year'], item['semester'])
+            for item in moduleInstances for professor in item['taught_by']]
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(prog='py client.py load', description='Runs simulated users against the service and reports how it held up.')
+    parser.add_argument('--url', default=DEFAULT_URL, help=f"address of the service (default {DEFAULT_URL}, or PROF_RATE_SERVICE_URL)")
+    parser.add_argument('--users', type=int, default=10, help='simulated users running at once (default 10)')
+    parser.add_argument('--rate', type=float, default=20, help='commands started per second across all users (default 20)')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run for (default 60)')
+    parser.add_argument('--mix', type=parseMix, default=DEFAULT_MIX,
+                        help='command weights, e.g. list=4,view=4,average=2,rate=1 (default %s)' % ','.join(f"{command}={weight}" for command, weight in DEFAULT_MIX.items()))
+    parser.add_argument('--prefix', default=None, help='start of the simulated users\' usernames (default a new one each run)')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the commands the users choose')
+    options = parser.parse_args(arguments)
+
+    if options.users < 1 or options.rate <= 0 or options.duration <= 0:
+        parser.error("--users, --rate and --duration must be above 0")
+
+    baseUrl = options.url.rstrip('/')
+    prefix = options.prefix or f"load-{uuid.uuid4().hex[:8]}"
+    seed = options.seed if options.seed is not None else random.randrange(2 ** 32)
+
+    # One connection per user at most, kept open between their commands
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=options.users, max_retries=0)
+    setupSession = requests.Session()
+    setupSession.mount('http://', adapter)
+    setupSession.mount('https://', adapter)
+
+    moduleInstances = fetchModuleInstances(setupSession, baseUrl)
+    if not moduleInstances:
+        if moduleInstances is not None:
+            print("The service has no module instances to ask about or rate.")
+        return
+
+    print(f"Running {options.users} users against {baseUrl} at {options.rate:g} commands/s for {options.duration:g}s, "
+          f"as {prefix}-*, seed {seed}. Press Ctrl+C to stop early.")
+
+    results = Results()
+    users = [
+        SimulatedUser(baseUrl, adapter, f"{prefix}-{index}", f"Load-{prefix}-{index}", moduleInstances, results, random.Random(seed + index))
+        for index in range(options.users)
+    ]
+    pacer = Pacer(options.rate, options.duration)
+    threads = [threading.Thread(target=user.run, args=(pacer, options.mix), daemon=True) for user in users]
+
+    startedAt = time.monotonic()
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        print("Stopping, waiting for commands in flight.")
+        pacer.stop()
+        for thread in threads:
+            thread.join()
+
+    results.report(time.monotonic() - startedAt, options.rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import json
+import os
+import sqlite3
+import time
+
+# Local SQLite mirror of the service's modules, module instances, professors
+# and ratings, kept up to date from the service's change feed. When the
+# service has no change feed, the list and view payloads are mirrored
+# instead, refreshed with conditional requests.
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS modules (id INTEGER PRIMARY KEY, code TEXT, name TEXT)",
+    "CREATE TABLE IF NOT EXISTS professors (id INTEGER PRIMARY KEY, code TEXT, name TEXT)",
+    "CREATE TABLE IF NOT EXISTS module_instances (id INTEGER PRIMARY KEY, module_id INTEGER, academic_year INTEGER, semester INTEGER)",
+    "CREATE TABLE IF NOT EXISTS assignments (module_instance_id INTEGER, professor_id INTEGER, PRIMARY KEY (module_instance_id, professor_id))",
+    "CREATE TABLE IF NOT EXISTS ratings (id INTEGER PRIMARY KEY, module_instance_id INTEGER, professor_id INTEGER, rating INTEGER)",
+    "CREATE INDEX IF NOT EXISTS ratings_professor ON ratings (professor_id, module_instance_id)",
+    # Payloads mirrored when the service has no change feed
+    "CREATE TABLE IF NOT EXISTS payloads (name TEXT PRIMARY KEY, etag TEXT, body TEXT)",
+]
+
+# How the feed's entities map onto local tables and columns
+ENTITY_TABLES = {
+    'module': ('modules', {'code': 'code', 'name': 'name'}),
+    'professor': ('professors', {'professor_code': 'code', 'name': 'name'}),
+    'module_instance': ('module_instances', {'module_id': 'module_id', 'academic_year': 'academic_year', 'semester': 'semester'}),
+    'rating': ('ratings', {'module_instance_id': 'module_instance_id', 'professor_id': 'professor_id', 'rating': 'rating'}),
+}
+
+# Seconds after a sync before local answers first catch up with the feed
+MAX_AGE = 300
+
+
+class ReplicaError(Exception):
+    pass
+
+
+# Average rounded half up, as the service rounds it
+def roundedAverage(total, count):
+    if not count:
+        return None
+    return (2 * total + count) // (2 * count)
+
+
+class Replica:
+    def __init__(self, session, baseUrl, path=None):
+        self.session = session
+        self.baseUrl = baseUrl.rstrip('/')
+        self.path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'replica.sqlite3')
+        self.db = sqlite3.connect(self.path)
+        with self.db:
+            for statement in SCHEMA:
+                self.db.execute(statement)
+
+        # A replica synced from another service is no use for this one
+        if self.getMeta('service_url') != self.baseUrl:
+            self.clear()
+
+    def getMeta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def setMeta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def clear(self):
+        with self.db:
+            for table in ('meta', 'modules', 'professors', 'module_instances', 'assignments', 'ratings', 'payloads'):
+                self.db.execute("DELETE FROM %s" % table)
+            self.setMeta('service_url', self.baseUrl)
+
+    #---------------------------------------------------------------------
+    # Syncing
+    #---------------------------------------------------------------------
+
+    # Brings the mirror up to date, from scratch when force is set.
+    # Returns the number of changes applied.
+    def sync(self, force=False):
+        if force:
+            self.clear()
+
+        if self.getMeta('mode') != 'payloads':
+            applied = self.syncChanges()
+            if applied is not None:
+                return applied
+
+        return self.syncPayloads()
+
+    # Applies the change feed from the stored cursor. Returns None when
+    # the service has no change feed.
+    def syncChanges(self):
+        cursor = int(self.getMeta('cursor', 0))
+        applied = 0
+
+        while True:
+            response = self.session.get(f"{self.baseUrl}/changes/", params={'since': cursor, 'limit': 5000})
+
+            if response.status_code == 404:
+                return None
+
+            # Too far behind the feed's horizon to catch up, so start over
+            if response.status_code == 410:
+                self.clear()
+                cursor = 0
+                continue
+
+            if response.status_code != 200:
+                raise ReplicaError(f"change feed returned status code {response.status_code}")
+
+            page = response.json()
+            with self.db:
+                for change in page['changes']:
+                    self.applyChange(change)
+                cursor = page['next_cursor']
+                self.setMeta('cursor', cursor)
+                self.setMeta('mode', 'changes')
+                self.setMeta('synced_at', time.time())
+            applied += len(page['changes'])
+
+            if not page['has_more']:
+                return applied
+
+    def applyChange(self, change):
+        entity, key, op, data = change['entity'], change['key'], change['op'], change['data']
+
+        if entity == 'assignment':
+            instanceId, professorId = (int(part) for part in key.split(':'))
+            if op == 'delete':
+                self.db.execute("DELETE FROM assignments WHERE module_instance_id = ? AND professor_id = ?", (instanceId, professorId))
+            else:
+                self.db.execute("INSERT OR IGNORE INTO assignments VALUES (?, ?)", (instanceId, professorId))
+            return
+
+        if entity not in ENTITY_TABLES:
+            return
+        table, columns = ENTITY_TABLES[entity]
+
+        # Inserts and updates are both applied as upserts
+        if op == 'delete':
+            self.db.execute(f"DELETE FROM {table} WHERE id = ?", (int(key),))
+        else:
+            names = ['id'] + list(columns.values())
+            values = [int(key)] + [data[field] for field in columns]
+            self.db.execute(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                values
+            )
+
+    # Mirrors the list and view payloads, downloading each only if it
+    # changed since the last refresh. Returns the number of payloads updated.
+    def syncPayloads(self):
+        updated = 0
+
+        for name in ('allModuleInstances', 'allProfessorRatings'):
+            row = self.db.execute("SELECT etag FROM payloads WHERE name = ?", (name,)).fetchone()
+            headers = {'If-None-Match': row[0]} if row and row[0] else {}
+            response = self.session.get(f"{self.baseUrl}/{name}/", headers=headers)
+
+            if response.status_code == 304:
+                continue
+            if response.status_code != 200:
+                raise ReplicaError(f"{name} returned status code {response.status_code}")
+
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO payloads (name, etag, body) VALUES (?, ?, ?)",
+                    (name, response.headers.get('ETag'), response.text)
+                )
+            updated += 1
+
+        with self.db:
+            self.setMeta('mode', 'payloads')
+            self.setMeta('synced_at', time.time())
+        return updated
+
+    def isStale(self):
+        return time.time() - float(self.getMeta('synced_at', 0)) > MAX_AGE
+
+    #---------------------------------------------------------------------
+    # Local answers, in the same shape as the service's responses
+    #---------------------------------------------------------------------
+    def payload(self, name):
+        row = self.db.execute("SELECT body FROM payloads WHERE name = ?", (name,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def moduleInstances(self):
+        if self.getMeta('mode') == 'payloads':
+            return self.payload('allModuleInstances')['module_instances']
+
+        instances = []
+        rows = self.db.execute(
+            "SELECT i.id, m.code, m.name, i.academic_year, i.semester FROM module_instances i "
+            "JOIN modules m ON m.id = i.module_id ORDER BY m.code, i.academic_year, i.semester"
+        ).fetchall()
+        for instanceId, code, name, year, semester in rows:
+            taughtBy = self.db.execute(
+                "SELECT p.code, p.name FROM assignments a JOIN professors p ON p.id = a.professor_id "
+                "WHERE a.module_instance_id = ? ORDER BY p.id", (instanceId,)
+            ).fetchall()
+            instances.append({
+                'module_code': code,
+                'module_name': name,
+                'academic_year': year,
+                'semester': semester,
+                'taught_by': [{'professor_code': p[0], 'professor_name': p[1]} for p in taughtBy]
+            })
+        return instances
+
+    def professorRatings(self):
+        if self.getMeta('mode') == 'payloads':
+            return self.payload('allProfessorRatings').get('all_professor_ratings', [])
+
+        rows = self.db.execute(
+            "SELECT p.code, p.name, SUM(r.rating), COUNT(r.id) FROM professors p "
+            "LEFT JOIN ratings r ON r.professor_id = p.id GROUP BY p.id ORDER BY p.id"
+        ).fetchall()
+        return [{'professor_code': code, 'name': name, 'rating': roundedAverage(total or 0, count)}
+                for code, name, total, count in rows]
+
+    # Returns None when the mirror cannot answer (payload mode has no
+    # per-module ratings), or an empty list when there are no ratings
+    def professorModuleRating(self, professorCode, moduleCode):
+        if self.getMeta('mode') == 'payloads':
+            return None
+
+        row = self.db.execute(
+            "SELECT m.code, m.name, p.code, p.name, SUM(r.rating), COUNT(r.id) FROM ratings r "
+            "JOIN professors p ON p.id = r.professor_id "
+            "JOIN module_instances i ON i.id = r.module_instance_id "
+            "JOIN modules m ON m.id = i.module_id "
+            "WHERE p.code = ? AND m.code = ?", (professorCode, moduleCode)
+        ).fetchone()
+        if not row or not row[5]:
+            return []
+        return [{
+            'module_code': row[0],
+            'module_name': row[1],
+            'professor_code': row[2],
+            'professor_name': row[3],
+            'rating': roundedAverage(row[4], row[5])
+        }]